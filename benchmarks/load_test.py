@@ -0,0 +1,126 @@
+"""
+Load test of the court connect crawl against the local stand-in server, reporting items/sec, request
+amplification (requests served per docket scraped), the share of 503s and the time the crawlers took to drain
+
+Starts `benchmarks.stand_in_server`, seeds redis with its last name searches and runs `--crawlers` crawlers through
+it as an http proxy, so the spider keeps its real allowed domains and urls
+
+    python -m benchmarks.load_test --cases 2000 --crawlers 4 --latency 0.1 --error-rate 0.05
+    python -m benchmarks.load_test --redis-host localhost --mongo-uri mongodb://localhost:27017 -s DOWNLOAD_DELAY=0
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from string import ascii_lowercase
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from pymongo import MongoClient
+from scrapy.utils.project import get_project_settings
+from scrapy_redis.connection import get_redis_from_settings
+
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+from populate_court_connect_start_urls import BASE_URL, schedule_start_urls
+
+# the real host, the stand-in server is reached as its proxy
+PROXIED_BASE_URL = BASE_URL.replace('https://', 'http://')
+
+
+def wait_for_server(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return server_stats(port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def server_stats(port):
+    with urlopen(f'http://localhost:{port}/stats', timeout=10) as response:
+        return json.load(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cases', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--crawlers', type=int, default=2)
+    parser.add_argument('--idle-time', type=int, default=10, help='seconds an idle crawler waits before closing')
+    parser.add_argument('--redis-host')
+    parser.add_argument('--mongo-uri')
+    parser.add_argument('-s', dest='settings', action='append', default=[], metavar='NAME=VALUE',
+                        help='setting passed through to every crawler')
+    args = parser.parse_args()
+
+    # off by default, the load test measures the crawlers the way they are run against the site
+    crawler_settings = [
+        f'MAX_IDLE_TIME_BEFORE_CLOSE={args.idle_time}', 'RATE_LIMIT_ENABLED=true', 'DELAYED_RETRY_ENABLED=true',
+    ] + args.settings
+    if args.redis_host:
+        crawler_settings.append(f'REDIS_HOST={args.redis_host}')
+    if args.mongo_uri:
+        crawler_settings.append(f'MONGO_URI={args.mongo_uri}')
+
+    settings = get_project_settings()
+    settings.setdict(dict(setting.split('=', 1) for setting in crawler_settings), priority='cmdline')
+
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.stand_in_server', '--port', str(args.port), '--cases', str(args.cases),
+        '--latency', str(args.latency), '--error-rate', str(args.error_rate), '--seed', str(args.seed),
+    ])
+    crawlers = []
+    try:
+        wait_for_server(args.port)
+
+        # every name the stand-in server generates starts with a letter, so single letters cover all its cases
+        schedule_start_urls(settings, PROXIED_BASE_URL, list(ascii_lowercase), [])
+        get_redis_from_settings(settings).delete(f'rate-limit:{urlparse(PROXIED_BASE_URL).netloc}')
+
+        crawling_job_id = f'load-test-{int(time.time())}'
+        environment = dict(os.environ, http_proxy=f'http://localhost:{args.port}')
+        command = [
+            sys.executable, '-m', 'scrapy', 'crawl', CourtConnectCrawlSpider.name,
+            '-a', f'crawling_job_id={crawling_job_id}', '--loglevel', 'WARNING',
+        ]
+        for setting in crawler_settings:
+            command += ['-s', setting]
+
+        started_at = time.monotonic()
+        crawlers = [subprocess.Popen(command, env=environment) for _ in range(args.crawlers)]
+        for crawler in crawlers:
+            crawler.wait()
+        elapsed = time.monotonic() - started_at
+
+        stats = server_stats(args.port)
+    finally:
+        for process in crawlers + [server]:
+            if process.poll() is None:
+                process.terminate()
+
+    client = MongoClient(settings.get('MONGO_URI'))
+    items = client[settings.get('MONGO_DATABASE')][f'job-{crawling_job_id}'].count_documents({})
+    client.close()
+
+    # the crawlers only notice the queue drained after idling for `--idle-time`
+    drain_time = max(elapsed - args.idle_time, 1e-9)
+    print(json.dumps(stats, indent=2))
+    print(f'crawlers:              {args.crawlers}')
+    print(f'time to drain:         {drain_time:.1f} s')
+    print(f'items:                 {items} of {stats["cases"]} cases')
+    print(f'items/sec:             {items / drain_time:.1f}')
+    print(f'request amplification: {stats["requests"] / max(items, 1):.2f} requests per item')
+    print(f'503 share:             {stats.get("responses/503", 0) / max(stats["requests"], 1):.1%}')
+    if any(crawler.returncode for crawler in crawlers):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
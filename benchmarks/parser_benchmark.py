@@ -0,0 +1,199 @@
+"""
+Offline benchmark of the court connect parse spiders over the docket reports saved in benchmarks/corpus
+
+Reports pages/sec, time per field method and peak memory for each page and parser, compares pages/sec with a
+saved baseline and checks every parsed docket against its golden json, exiting with 1 on a regression or mismatch
+
+    python -m benchmarks.parser_benchmark
+    python -m benchmarks.parser_benchmark --parser table-walk --iterations 20
+    python -m benchmarks.parser_benchmark --save-baseline
+    python -m benchmarks.parser_benchmark --update-golden
+    python -m benchmarks.parser_benchmark --generate-corpus
+
+Recorded docket reports can be added to the corpus as `<name>.html` or `<name>.html.gz`, followed by
+`--update-golden`, golden json is gzipped alongside gzipped pages
+"""
+import argparse
+import functools
+import gzip
+import inspect
+import json
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+from scrapy.http import HtmlResponse
+
+from benchmarks.synthetic_pages import case_id_for, docket_report_html
+from docket_scraper.items import docket_to_dict
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+CORPUS_DIR = Path(__file__).parent / 'corpus'
+BASELINE_FILE = Path(__file__).parent / 'baseline.json'
+DOCKET_URL_T = 'https://courtconnect.courts.delaware.gov/cc/cconnect/ck_public_qry_doct.cp_dktrpt_docket_report?' \
+               'case_id={}'
+
+# name: (parties, entries, gzipped) of the generated docket reports
+GENERATED_PAGES = {
+    'small': (2, 5, False),
+    'typical': (8, 60, False),
+    'large': (300, 3000, True),
+}
+
+
+def read_text(path):
+    return gzip.decompress(path.read_bytes()).decode() if path.suffix == '.gz' else path.read_text()
+
+
+def write_text(path, text):
+    if path.suffix == '.gz':
+        path.write_bytes(gzip.compress(text.encode(), mtime=0))
+    else:
+        path.write_text(text)
+
+
+def generate_corpus():
+    CORPUS_DIR.mkdir(exist_ok=True)
+    for number, (name, (parties_count, entries_count, gzipped)) in enumerate(GENERATED_PAGES.items(), start=1):
+        html = docket_report_html(case_id_for(number), parties_count, entries_count)
+        write_text(CORPUS_DIR / (f'{name}.html.gz' if gzipped else f'{name}.html'), html)
+
+
+def load_corpus():
+    """Maps the name of every saved page to its response and golden json path"""
+    corpus = {}
+    for path in sorted(CORPUS_DIR.glob('*.html*')):
+        name, _, suffix = path.name.partition('.html')
+        response = HtmlResponse(DOCKET_URL_T.format(name), body=read_text(path).encode(), encoding='utf-8')
+        corpus[name] = response, CORPUS_DIR / f'{name}.json{suffix}'
+
+    return corpus
+
+
+def to_json(docket):
+    return json.dumps(docket_to_dict(docket), indent=2, default=lambda value: value.isoformat()) + '\n'
+
+
+def timed_fields(parse_spider, field_times):
+    """Wraps the field methods of the parse spider instance to add up their time in `field_times`"""
+
+    def timed(name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                field_times[name] += time.perf_counter() - started_at
+            return timed_generator(name, result) if inspect.isgenerator(result) else result
+        return wrapper
+
+    def timed_generator(name, generator):
+        # the time of a generator method is spent producing its values, not calling it
+        while True:
+            started_at = time.perf_counter()
+            try:
+                value = next(generator)
+            except StopIteration:
+                return
+            finally:
+                field_times[name] += time.perf_counter() - started_at
+            yield value
+
+    for name in dir(parse_spider):
+        if name not in ('parse', 'iter_parse') and name.startswith(('parse_', 'walk_', 'link_', 'make_')):
+            setattr(parse_spider, name, timed(name, getattr(parse_spider, name)))
+
+    return parse_spider
+
+
+def benchmark_page(parse_spider_cls, response, iterations):
+    field_times = defaultdict(float)
+    parse_spider = timed_fields(parse_spider_cls(), field_times)
+
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        docket = parse_spider.parse(response)
+    elapsed = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    parse_spider_cls().parse(response)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return docket, {
+        'pages_per_sec': iterations / elapsed,
+        'mean_ms': elapsed / iterations * 1000,
+        'peak_memory_kb': peak_memory / 1024,
+        'fields_ms': {name: seconds / iterations * 1000 for name, seconds in sorted(field_times.items())},
+    }
+
+
+def print_results(parser, page, results, baseline_results):
+    baseline = baseline_results.get(parser, {}).get(page)
+    change = ''
+    if baseline:
+        change = f' ({results["pages_per_sec"] / baseline["pages_per_sec"] - 1:+.0%} vs baseline)'
+
+    print(f'{parser:<12} {page:<12} {results["pages_per_sec"]:>10.1f} pages/sec{change}, '
+          f'{results["mean_ms"]:.2f} ms/page, peak memory {results["peak_memory_kb"]:.0f} KB')
+    for name, field_ms in results['fields_ms'].items():
+        print(f'{"":<26}{name:<28}{field_ms:>10.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--parser', choices=sorted(CourtConnectCrawlSpider.parse_spiders), action='append')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='fraction of the baseline pages/sec a parser may lose before failing')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--update-golden', action='store_true')
+    parser.add_argument('--generate-corpus', action='store_true')
+    args = parser.parse_args()
+
+    if args.generate_corpus:
+        generate_corpus()
+
+    corpus = load_corpus()
+    baseline_results = json.loads(BASELINE_FILE.read_text()) if BASELINE_FILE.exists() else {}
+
+    failures = []
+    updated_golden = set()
+    all_results = {}
+    for parser_name in args.parser or sorted(CourtConnectCrawlSpider.parse_spiders):
+        parse_spider_cls = type(CourtConnectCrawlSpider.parse_spiders[parser_name])
+        all_results[parser_name] = {}
+
+        for page, (response, golden_file) in corpus.items():
+            docket, results = benchmark_page(parse_spider_cls, response, args.iterations)
+            all_results[parser_name][page] = results
+            print_results(parser_name, page, results, baseline_results)
+
+            # the first parser writes the golden json, the next ones are checked against it
+            if args.update_golden and page not in updated_golden:
+                write_text(golden_file, to_json(docket))
+                updated_golden.add(page)
+            elif not golden_file.exists():
+                failures.append(f'{page}: no golden json, run with --update-golden')
+            elif read_text(golden_file) != to_json(docket):
+                failures.append(f'{parser_name} {page}: parsed docket differs from {golden_file.name}')
+
+            baseline = baseline_results.get(parser_name, {}).get(page)
+            if baseline and results['pages_per_sec'] < baseline['pages_per_sec'] * (1 - args.max_regression):
+                failures.append(f'{parser_name} {page}: {results["pages_per_sec"]:.1f} pages/sec, '
+                                f'baseline {baseline["pages_per_sec"]:.1f} pages/sec')
+
+    if args.save_baseline:
+        BASELINE_FILE.write_text(json.dumps(all_results, indent=2) + '\n')
+
+    for failure in failures:
+        print(f'FAILED {failure}')
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Local stand-in for the court connect site serving synthetic last name searches, paginated with `PageNo`,
+and docket reports of thousands of generated cases, with configurable latency and rate of 503s
+
+It also works as an http proxy, so crawlers requesting `http://courtconnect.courts.delaware.gov/...` through
+`http_proxy=http://localhost:<port>` reach it with their allowed domains and url processing unchanged
+
+    python -m benchmarks.stand_in_server --cases 5000 --latency 0.2 --error-rate 0.05
+
+`/stats` returns the requests served so far as json
+"""
+import argparse
+import bisect
+import json
+import math
+import random
+from collections import Counter
+from urllib.parse import parse_qs, urlparse
+
+from twisted.internet import reactor, task
+from twisted.web import resource, server
+
+from benchmarks.synthetic_pages import (
+    STATUSES, case_id_for, docket_report_html, random_last_name, search_results_html, FIRST_NAMES
+)
+
+
+class StandInSite(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, cases_count, page_size=25, latency=0.0, error_rate=0.0, max_parties=20, max_entries=200,
+                 seed=0):
+        super(StandInSite, self).__init__()
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.counters = Counter()
+        self.served_dockets = set()
+
+        # (searchable name, case id, party name, status, parties, entries) sorted by name for prefix searches
+        self.cases = {}
+        listings = []
+        for number in range(1, cases_count + 1):
+            case_id = case_id_for(number)
+            last_name = random_last_name(self.rng)
+            name = f'{last_name}, {self.rng.choice(FIRST_NAMES)}'
+            parties = self.rng.randint(2, max_parties)
+            entries = min(max_entries, int(self.rng.paretovariate(1.2) * 10))
+            self.cases[case_id] = (parties, entries)
+            listings.append((last_name.lower(), case_id, name, self.rng.choice(STATUSES)))
+
+        self.listings = sorted(listings)
+        self.listing_names = [listing[0] for listing in self.listings]
+
+    def render_GET(self, request):
+        url = urlparse(request.uri.decode())
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path.endswith('/stats'):
+            request.setHeader(b'content-type', b'application/json')
+            return json.dumps(self.stats()).encode()
+
+        self.counters['requests'] += 1
+        delay = self.rng.uniform(0, 2 * self.latency) if self.latency else 0
+        task.deferLater(reactor, delay, self.respond, request, url.path, params)
+        return server.NOT_DONE_YET
+
+    def respond(self, request, path, params):
+        if self.rng.random() < self.error_rate:
+            self.counters['responses/503'] += 1
+            request.setResponseCode(503)
+            body = b'<HTML><BODY>Service Temporarily Unavailable</BODY></HTML>'
+        elif path.endswith('cp_personcase_srch_details'):
+            self.counters['responses/search'] += 1
+            body = self.render_search(params).encode()
+        elif path.endswith('cp_dktrpt_docket_report') and params.get('case_id') in self.cases:
+            self.counters['responses/docket_report'] += 1
+            self.served_dockets.add(params['case_id'])
+            parties, entries = self.cases[params['case_id']]
+            body = docket_report_html(params['case_id'], parties, entries).encode()
+        else:
+            self.counters['responses/404'] += 1
+            request.setResponseCode(404)
+            body = b'<HTML><BODY>Not Found</BODY></HTML>'
+
+        if not request._disconnected:
+            request.setHeader(b'content-type', b'text/html; charset=utf-8')
+            request.write(body)
+            request.finish()
+
+    def render_search(self, params):
+        last_name = params.get('last_name', '').lower()
+        partial = 'partial_ind' in params
+        page = int(params.get('PageNo', 1))
+
+        start = bisect.bisect_left(self.listing_names, last_name)
+        end = bisect.bisect_right(self.listing_names, last_name + '￿' if partial else last_name)
+        listings = self.listings[start:end]
+
+        pages_count = max(1, math.ceil(len(listings) / self.page_size))
+        page_listings = listings[(page - 1) * self.page_size:page * self.page_size]
+        cases = [(case_id, name, status) for _, case_id, name, status in page_listings]
+        return search_results_html(params.get('last_name', ''), page, cases, pages_count, partial=partial)
+
+    def stats(self):
+        return {
+            'cases': len(self.cases),
+            'served_dockets': len(self.served_dockets),
+            **self.counters,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cases', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--latency', type=float, default=0.0, help='mean seconds before a response is sent')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of responses that are 503s')
+    parser.add_argument('--max-parties', type=int, default=20)
+    parser.add_argument('--max-entries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    site = StandInSite(
+        args.cases, page_size=args.page_size, latency=args.latency, error_rate=args.error_rate,
+        max_parties=args.max_parties, max_entries=args.max_entries, seed=args.seed
+    )
+    reactor.listenTCP(args.port, server.Site(site))
+    print(f'Serving {args.cases} cases on port {args.port}', flush=True)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
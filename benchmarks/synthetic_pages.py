@@ -0,0 +1,143 @@
+"""
+Synthetic court connect pages laid out like the docket reports and search results of the real site,
+generated deterministically from a seed so benchmarks and load tests need no network
+"""
+import random
+from datetime import datetime, timedelta
+from html import escape
+from urllib.parse import quote
+
+LAST_NAMES = [
+    'SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS', 'RODRIGUEZ', 'MARTINEZ',
+    'HERNANDEZ', 'LOPEZ', 'GONZALEZ', 'WILSON', 'ANDERSON', 'THOMAS', 'TAYLOR', 'MOORE', 'JACKSON', 'MARTIN',
+    "O'BRIEN", 'DE LA CRUZ', 'VAN DYKE', 'ABBOTT', 'ZIMMERMAN', 'QUINN', 'YOUNG', 'KING', 'ELLIS', 'UNDERWOOD',
+]
+FIRST_NAMES = ['JOHN', 'MARY', 'JAMES', 'PATRICIA', 'ROBERT', 'JENNIFER', 'MICHAEL', 'LINDA', 'DAVID', 'SUSAN']
+PARTY_TYPES = ['PLAINTIFF', 'DEFENDANT', 'ATTORNEY FOR PLAINTIFF', 'ATTORNEY FOR DEFENDANT', 'INTERESTED PARTY']
+CASE_TYPES = ['DEBT/BREACH OF CONTRACT', 'PERSONAL INJURY AUTO', 'MORTGAGE', 'MECHANICS LIEN', 'APPEAL']
+STATUSES = ['CLOSED - JUDGMENT ENTERED', 'OPEN - ACTIVE', 'CLOSED - DISMISSED', 'OPEN - STAYED']
+LAST_NAME_SYLLABLES = [
+    'AB', 'AL', 'AN', 'BAR', 'BEL', 'BRO', 'CAR', 'CO', 'DA', 'DEN', 'EL', 'ER', 'FA', 'FOR', 'GAR', 'GO', 'HAR',
+    'HEN', 'IN', 'JA', 'KA', 'KEL', 'LA', 'LEE', 'MAR', 'MC', 'MO', 'NEL', 'NO', 'OL', 'PA', 'PER', 'QUI', 'RA',
+    'ROB', 'SA', 'SON', 'STE', 'TA', 'TON', 'UL', 'VAN', 'WAL', 'WIL', 'XA', 'YO', 'ZI',
+]
+ENTRY_DESCRIPTIONS = [
+    'COMPLAINT FILED', 'SUMMONS ISSUED', 'ANSWER TO COMPLAINT', 'MOTION TO DISMISS', 'NOTICE OF SERVICE',
+    'ORDER', 'STIPULATION OF DISMISSAL', 'JUDGMENT', 'LETTER', 'PRAECIPE',
+]
+
+SEARCH_URL = '/cc/cconnect/ck_public_qry_cpty.cp_personcase_srch_details'
+DOCKET_FRAMES_URL = '/cc/cconnect/ck_public_qry_doct.cp_dktrpt_frames'
+
+
+def ordinal(day):
+    return 'th' if 11 <= day <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+
+
+def case_id_for(number):
+    return f'N{number % 23:02d}C-{number % 12 + 1:02d}-{number:05d} CLS'
+
+
+def random_last_name(rng):
+    return ''.join(rng.choice(LAST_NAME_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def party_name(rng):
+    return f'{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}'
+
+
+def docket_report_html(case_id, parties_count, entries_count, seed=0):
+    rng = random.Random(f'{case_id}-{seed}')
+    filing_date = datetime(2000, 1, 1) + timedelta(days=rng.randrange(8000))
+
+    parties = []
+    for sequence in range(1, parties_count + 1):
+        name = party_name(rng)
+        parties.append(name if name not in parties else f'{name} {sequence}')
+
+    rows = []
+    for sequence, name in enumerate(parties, start=1):
+        associates = ', '.join(str(rng.randint(1, parties_count)) for _ in range(rng.choice([0, 0, 1, 2])))
+        end_date = (filing_date + timedelta(days=rng.randrange(900))).strftime('%d-%b-%Y').upper() \
+            if rng.random() < 0.2 else ''
+        address = '<BR>'.join([f'{rng.randint(1, 999)} MAIN ST', 'WILMINGTON DE 19801']) \
+            if rng.random() < 0.8 else 'Unavailable'
+        aliases = 'none' if rng.random() < 0.9 else escape(party_name(rng))
+        rows.append(
+            f'<TR VALIGN="top"><TD>{sequence}</TD><TD>{associates}</TD><TD>{end_date}</TD>'
+            f'<TD>{rng.choice(PARTY_TYPES)}</TD><TD>@{100000 + sequence}</TD>'
+            f'<TD><A HREF="ck_public_qry_cpty.cp_personcase_details_idx?id=@{100000 + sequence}">'
+            f'{escape(name)}</A></TD></TR>\n'
+            f'<TR VALIGN="top" ALIGN="left"><TD><B>Address:</B></TD><TD>{address}</TD>'
+            f'<TD><B>Aliases:</B></TD><TD>{aliases}</TD></TR>\n'
+        )
+    parties_html = ''.join(rows)
+
+    rows = []
+    entry_date = filing_date
+    for _ in range(entries_count):
+        entry_date += timedelta(minutes=rng.randrange(60 * 24 * 5))
+        filed_at = entry_date.strftime('%d-%b-%Y').upper() + '<BR>' + entry_date.strftime('%I:%M %p') \
+            if rng.random() < 0.95 else ''
+        party = escape(rng.choice(parties)) + ',' if rng.random() < 0.7 else ''
+        monetary = f'${rng.randint(1, 99999)}.{rng.randint(0, 99):02d}' if rng.random() < 0.1 else ''
+        content = ' '.join(rng.choice(ENTRY_DESCRIPTIONS).lower() for _ in range(rng.randint(3, 30)))
+        content = content if rng.random() < 0.9 else 'None.'
+        rows.append(
+            f'<TR VALIGN="top"><TD NOWRAP>{filed_at}</TD><TD>{rng.choice(ENTRY_DESCRIPTIONS)}</TD>'
+            f'<TD>{party}</TD><TD>{monetary}</TD></TR>\n'
+            f'<TR><TD>&nbsp;</TD><TD COLSPAN="3">{content}</TD></TR>\n'
+        )
+    entries_html = ''.join(rows)
+
+    filing_day = filing_date.day
+    filing_date_text = filing_date.strftime(f'%A , %B {filing_day}{ordinal(filing_day)}, %Y')
+    title = f'{escape(parties[0])} VS {escape(parties[-1])}' if parties else 'UNKNOWN'
+    start_date = filing_date.strftime('%d-%b-%Y').upper()
+
+    return f'''<HTML><HEAD><TITLE>Docket Report</TITLE></HEAD><BODY>
+<A NAME="selection"></A>
+<TABLE WIDTH="100%">
+<TR><TD><B>Case ID:</B></TD><TD>{case_id}</TD></TR>
+<TR><TD><B>Docket Start Date:</B></TD><TD>{start_date}</TD></TR>
+<TR><TD><B>Docket Ending Date:</B></TD><TD></TD></TR>
+</TABLE>
+<A NAME="description"></A>
+<TABLE WIDTH="100%">
+<TR><TD><B>Case ID:</B></TD><TD>{case_id} - {title}</TD></TR>
+<TR><TD><B>Filing Date:</B></TD><TD>{filing_date_text}</TD></TR>
+<TR><TD><B>Type:</B></TD><TD>{rng.choice(CASE_TYPES)}</TD></TR>
+<TR><TD><B>Status:</B></TD><TD>{rng.choice(STATUSES)}</TD></TR>
+</TABLE>
+<A NAME="parties"></A>
+<TABLE WIDTH="100%">
+<TR><TH>Seq #</TH><TH>Assoc</TH><TH>End Date</TH><TH>Type</TH><TH>ID</TH><TH>Name</TH></TR>
+{parties_html}</TABLE>
+<A NAME="dockets"></A>
+<TABLE WIDTH="100%">
+<TR><TH>Filing Date</TH><TH>Description</TH><TH>Name</TH><TH>Monetary</TH></TR>
+{entries_html}</TABLE>
+</BODY></HTML>
+'''
+
+
+def search_results_html(last_name, page, cases, pages_count, partial=True):
+    """A page of last name search results, `cases` are (case id, party name, status) tuples"""
+    rows = ''.join(
+        f'<TR><TD><A HREF="{DOCKET_FRAMES_URL}?backto=P&case_id={escape(case_id)}&begin_date=&end_date=">'
+        f'{escape(case_id)}</A></TD><TD>{escape(name)}</TD><TD>{escape(status)}</TD></TR>\n'
+        for case_id, name, status in cases
+    )
+
+    pagination = ''
+    if page < pages_count:
+        partial_ind = 'partial_ind=checked&' if partial else ''
+        pagination = f'<A HREF="{SEARCH_URL}?backto=P&{partial_ind}last_name={quote(last_name)}' \
+                     f'&case_type=ALL&PageNo={page + 1}">Next -></A>'
+
+    return f'''<HTML><BODY>
+<TABLE><TR><TH>Case ID</TH><TH>Name</TH><TH>Status</TH></TR>
+{rows}</TABLE>
+{pagination}
+</BODY></HTML>
+'''
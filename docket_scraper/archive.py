@@ -0,0 +1,155 @@
+import gzip
+import json
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+SEGMENT_SUFFIX = '.warc.gz'
+INDEX_SUFFIX = '.idx'
+
+
+@dataclass(slots=True)
+class ArchivedResponse:
+    item_id: str
+    url: str
+    encoding: str
+    body: bytes
+    archived_at: str
+
+
+def warc_record(response):
+    headers = [
+        'WARC/1.0',
+        'WARC-Type: resource',
+        f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>',
+        f'WARC-Date: {response.archived_at}',
+        f'WARC-Target-URI: {response.url}',
+        f'WARC-Item-ID: {response.item_id}',
+        f'Content-Type: text/html; charset={response.encoding}',
+        f'Content-Length: {len(response.body)}',
+    ]
+    return '\r\n'.join(headers).encode() + b'\r\n\r\n' + response.body + b'\r\n\r\n'
+
+
+def parse_warc_records(data):
+    """Yields the archived responses of the uncompressed warc records in `data`"""
+    position = 0
+    while position < len(data):
+        headers_end = data.index(b'\r\n\r\n', position)
+        header_lines = data[position:headers_end].decode().split('\r\n')[1:]
+        headers = dict(line.split(': ', 1) for line in header_lines)
+
+        body_start = headers_end + 4
+        body_end = body_start + int(headers['Content-Length'])
+        position = body_end + 4
+
+        yield ArchivedResponse(
+            item_id=headers['WARC-Item-ID'],
+            url=headers['WARC-Target-URI'],
+            encoding=headers['Content-Type'].partition('charset=')[2] or 'utf-8',
+            body=data[body_start:body_end],
+            archived_at=headers['WARC-Date'],
+        )
+
+
+class ResponseArchiveWriter:
+    """
+    Appends responses to warc segment files, compressing each batch of `batch_size` responses as one gzip member,
+    and indexes every response by item id in a json lines file next to its segment
+    """
+
+    def __init__(self, directory, prefix, batch_size=50, segment_size=100 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        self.segment_number = 0
+        self.segment_path = None
+        self.batch = []
+
+    def add(self, item_id, url, body, encoding):
+        archived_at = datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+        self.batch.append(ArchivedResponse(item_id, url, encoding, body, archived_at))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+
+        batch, self.batch = self.batch, []
+        member = gzip.compress(b''.join(warc_record(response) for response in batch))
+
+        segment_path = self.current_segment_path()
+        with segment_path.open('ab') as segment:
+            offset = segment.tell()
+            segment.write(member)
+
+        index_lines = [
+            json.dumps({'item_id': response.item_id, 'offset': offset, 'length': len(member),
+                        'archived_at': response.archived_at}) + '\n'
+            for response in batch
+        ]
+        with segment_path.with_suffix('').with_suffix(INDEX_SUFFIX).open('a') as index:
+            index.writelines(index_lines)
+
+    def current_segment_path(self):
+        if self.segment_path is None or self.segment_path.stat().st_size >= self.segment_size:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.segment_number += 1
+            self.segment_path = self.directory / f'{self.prefix}-{self.segment_number:05}{SEGMENT_SUFFIX}'
+            self.segment_path.touch()
+
+        return self.segment_path
+
+
+class ResponseArchive:
+    """Reads the responses archived by `ResponseArchiveWriter` in a directory, the latest one of every item id"""
+
+    def __init__(self, directory, prefix=''):
+        self.directory = Path(directory)
+        self.prefix = prefix
+
+    def index(self):
+        """Maps every item id to the segment path, gzip member offset and length of its latest response"""
+        latest = {}
+        for index_path in sorted(self.directory.glob(f'{self.prefix}*{INDEX_SUFFIX}')):
+            segment_path = index_path.with_suffix(SEGMENT_SUFFIX)
+            with index_path.open() as index:
+                for line in index:
+                    entry = json.loads(line)
+                    if entry['item_id'] not in latest or latest[entry['item_id']][0] <= entry['archived_at']:
+                        latest[entry['item_id']] = entry['archived_at'], segment_path, entry['offset'], entry['length']
+
+        return {item_id: entry[1:] for item_id, entry in latest.items()}
+
+    def get(self, item_id):
+        segment_path, offset, length = self.index()[item_id]
+        for response in reversed(self.read_member(segment_path, offset, length)):
+            if response.item_id == item_id:
+                return response
+
+    def __iter__(self):
+        """Streams the latest response of every item id, reading each gzip member at most once"""
+        members = defaultdict(set)
+        for item_id, (segment_path, offset, length) in self.index().items():
+            members[segment_path, offset, length].add(item_id)
+
+        yielded = set()
+        for (segment_path, offset, length), item_ids in sorted(members.items()):
+            # a batch may hold an item twice, only the last of them is yielded
+            for response in reversed(self.read_member(segment_path, offset, length)):
+                if response.item_id in item_ids and response.item_id not in yielded:
+                    yielded.add(response.item_id)
+                    yield response
+
+    def __len__(self):
+        return len(self.index())
+
+    @staticmethod
+    def read_member(segment_path, offset, length):
+        with segment_path.open('rb') as segment:
+            segment.seek(offset)
+            return list(parse_warc_records(gzip.decompress(segment.read(length))))
@@ -0,0 +1,204 @@
+import hashlib
+import math
+
+# redis strings, and so bitmaps, are limited to 512MB
+MAX_BIT_SIZE = 2 ** 32
+
+# starts the next slice unless another crawler has already started it
+ADD_SLICE_SCRIPT = """
+local slices = tonumber(redis.call('hget', KEYS[1], 'slices') or '1')
+if slices == tonumber(ARGV[1]) then
+    redis.call('hset', KEYS[1], 'slices', slices + 1)
+end
+"""
+
+# checks the value in every slice and sets its bits in the last one atomically, so two crawlers adding the same value
+# at once never both find it new. Returns the count of the last slice once added, 0 if the value was in a slice
+# already, or minus the slice count when the caller knows of another count of slices
+ADD_SCRIPT = """
+local slices = tonumber(redis.call('hget', KEYS[1], 'slices') or '1')
+if slices ~= tonumber(ARGV[1]) then
+    return -slices
+end
+
+local position = 3
+local offsets = {}
+for index = 1, slices do
+    local offsets_count = tonumber(ARGV[position])
+    local found = true
+    offsets = {}
+    for i = 1, offsets_count do
+        offsets[i] = ARGV[position + i]
+        if found and redis.call('getbit', KEYS[index + 1], offsets[i]) == 0 then
+            found = false
+        end
+    end
+    if found then
+        return 0
+    end
+    position = position + offsets_count + 1
+end
+
+for _, offset in ipairs(offsets) do
+    redis.call('setbit', KEYS[slices + 1], offset, 1)
+end
+local count = redis.call('hincrby', KEYS[1], 'count:' .. (slices - 1), 1)
+
+local ttl = tonumber(ARGV[2])
+if ttl > 0 then
+    for index = 1, slices + 1 do
+        redis.call('expire', KEYS[index], ttl)
+    end
+end
+return count
+"""
+
+
+class RedisBloomFilter(object):
+    """Bloom filter kept in a redis bitmap, shared by every process connected to the same redis"""
+
+    def __init__(self, server, key, capacity, error_rate):
+        self.server = server
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        bit_size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.bit_size = min(MAX_BIT_SIZE, bit_size)
+        self.hash_count = max(1, round(self.bit_size / capacity * math.log(2)))
+
+    def offsets(self, value):
+        if isinstance(value, str):
+            value = value.encode()
+
+        # double hashing, k offsets out of two 64 bit halves of one digest
+        digest = hashlib.sha1(value).digest()
+        hash_1 = int.from_bytes(digest[:8], 'big')
+        hash_2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(hash_1 + i * hash_2) % self.bit_size for i in range(self.hash_count)]
+
+    def add(self, value):
+        """Adds the value and returns True if it was not in the filter already"""
+        pipe = self.server.pipeline(transaction=True)
+        for offset in self.offsets(value):
+            pipe.setbit(self.key, offset, 1)
+        return not all(pipe.execute())
+
+    def __contains__(self, value):
+        pipe = self.server.pipeline(transaction=False)
+        for offset in self.offsets(value):
+            pipe.getbit(self.key, offset)
+        return all(pipe.execute())
+
+    def clear(self):
+        self.server.delete(self.key)
+
+    def stats(self):
+        pipe = self.server.pipeline(transaction=False)
+        pipe.bitcount(self.key)
+        pipe.strlen(self.key)
+        set_bits, memory_bytes = pipe.execute()
+
+        return {
+            'key': self.key,
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'bit_size': self.bit_size,
+            'hash_count': self.hash_count,
+            'fill_ratio': set_bits / self.bit_size,
+            'memory_bytes': memory_bytes,
+            'estimated_memory_bytes': math.ceil(self.bit_size / 8),
+        }
+
+
+class RedisScalableBloomFilter(object):
+    """
+    Bloom filter growing by a new, larger redis bitmap each time the last one is filled to its capacity,
+    the error rate of every new bitmap is tightened so the overall false positive rate stays under `error_rate`
+    """
+    growth_factor = 2
+    tightening_ratio = 0.5
+
+    def __init__(self, server, key, initial_capacity, error_rate, ttl=None):
+        self.server = server
+        self.key = key
+        self.meta_key = f'{key}:meta'
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.ttl = ttl
+        self.bloom_filters = []
+        self.add_slice = server.register_script(ADD_SLICE_SCRIPT)
+        self.add_script = server.register_script(ADD_SCRIPT)
+
+    def get_bloom_filter(self, index):
+        while len(self.bloom_filters) <= index:
+            slice_index = len(self.bloom_filters)
+            self.bloom_filters.append(RedisBloomFilter(
+                self.server,
+                key=f'{self.key}:{slice_index}',
+                capacity=self.initial_capacity * self.growth_factor ** slice_index,
+                error_rate=self.error_rate * (1 - self.tightening_ratio) * self.tightening_ratio ** slice_index
+            ))
+
+        return self.bloom_filters[index]
+
+    def slice_count(self):
+        return int(self.server.hget(self.meta_key, 'slices') or 1)
+
+    def add(self, value):
+        """Adds the value and returns True if it was not in the filter already"""
+        bloom_filters = self.bloom_filters or [self.get_bloom_filter(0)]
+
+        args = [len(bloom_filters), self.ttl or 0]
+        for bloom_filter in bloom_filters:
+            offsets = bloom_filter.offsets(value)
+            args += [len(offsets), *offsets]
+        count = self.add_script(keys=[self.meta_key, *(bloom_filter.key for bloom_filter in bloom_filters)], args=args)
+
+        if count < 0:
+            # another crawler has started a new slice since, or the filter was cleared
+            del self.bloom_filters[-count:]
+            self.get_bloom_filter(-count - 1)
+            return self.add(value)
+
+        if count >= bloom_filters[-1].capacity:
+            self.add_slice(keys=[self.meta_key], args=[len(bloom_filters)])
+
+        return count > 0
+
+    def __contains__(self, value):
+        return any(value in self.get_bloom_filter(index) for index in range(self.slice_count()))
+
+    def __len__(self):
+        meta = self.server.hgetall(self.meta_key)
+        return sum(
+            int(value) for field, value in meta.items()
+            if (field.decode() if isinstance(field, bytes) else field).startswith('count:')
+        )
+
+    def stats(self):
+        meta = {
+            (field.decode() if isinstance(field, bytes) else field): int(value)
+            for field, value in self.server.hgetall(self.meta_key).items()
+        }
+        slices = []
+        for index in range(self.slice_count()):
+            slice_stats = self.get_bloom_filter(index).stats()
+            slice_stats['count'] = meta.get(f'count:{index}', 0)
+            slices.append(slice_stats)
+
+        return {
+            'key': self.key,
+            'error_rate': self.error_rate,
+            'ttl': self.server.ttl(self.meta_key),
+            'count': sum(slice_stats['count'] for slice_stats in slices),
+            'capacity': sum(slice_stats['capacity'] for slice_stats in slices),
+            'memory_bytes': sum(slice_stats['memory_bytes'] for slice_stats in slices),
+            'estimated_memory_bytes': sum(slice_stats['estimated_memory_bytes'] for slice_stats in slices),
+            'slices': slices,
+        }
+
+    def clear(self):
+        keys = [self.get_bloom_filter(index).key for index in range(self.slice_count())]
+        self.server.delete(self.meta_key, *keys)
+        self.bloom_filters = []
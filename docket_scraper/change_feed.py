@@ -0,0 +1,146 @@
+"""
+Change feed of the dockets scraped, published to a redis stream by `RedisChangeFeedPipeline` and read by consumer
+groups, each consumer resuming from the events it has not acknowledged yet
+
+    python -m docket_scraper.change_feed --group analytics --consumer analytics-1
+"""
+import argparse
+import hashlib
+import json
+import sys
+
+from redis.exceptions import ResponseError
+from scrapy.utils.project import get_project_settings
+from scrapy_redis.connection import get_redis_from_settings
+
+from docket_scraper.incremental import CRAWL_FIELDS, docket_content_hash
+
+CHANGE_FEED_STREAM_KEY = '%(spider)s:changes'
+CHANGE_FEED_FIELD_HASHES_KEY = '%(spider)s:docket-field-hashes'
+
+
+def field_hashes(docket_dict):
+    """Short hashes of the content fields of a docket dict, by field name"""
+    return {
+        field: hashlib.sha1(
+            json.dumps(value, sort_keys=True, separators=(',', ':'), default=lambda value: value.isoformat()).encode()
+        ).hexdigest()[:8]
+        for field, value in docket_dict.items() if field not in CRAWL_FIELDS
+    }
+
+
+class RedisChangeFeed(object):
+    """
+    Publishes an event per docket to a redis stream capped at about `maxlen` events: its case id, crawling job id,
+    content hash, whether it is new, changed or unchanged since any crawl last published it and its changed fields,
+    found by comparing the field hashes of every docket kept in a redis hash
+    """
+
+    def __init__(self, server, stream_key, field_hashes_key, maxlen):
+        self.server = server
+        self.stream_key = stream_key
+        self.field_hashes_key = field_hashes_key
+        self.maxlen = maxlen
+
+    def publish(self, crawling_job_id, docket_dicts):
+        """Publishes the events of a batch of dockets in two round trips, returns the count of each change"""
+        if not docket_dicts:
+            return {}
+
+        last_hashes = self.server.hmget(self.field_hashes_key, [docket['id'] for docket in docket_dicts])
+
+        counts = {'change_feed/new': 0, 'change_feed/changed': 0, 'change_feed/unchanged': 0}
+        new_hashes = {}
+        pipe = self.server.pipeline(transaction=False)
+        for docket, last_hash in zip(docket_dicts, last_hashes):
+            hashes = field_hashes(docket)
+            last_hash = json.loads(last_hash) if last_hash else None
+
+            if last_hash is None:
+                change, changed_fields = 'new', sorted(hashes)
+            else:
+                changed_fields = sorted(field for field, value in hashes.items() if last_hash.get(field) != value)
+                change = 'changed' if changed_fields else 'unchanged'
+
+            counts[f'change_feed/{change}'] += 1
+            new_hashes[docket['id']] = json.dumps(hashes, separators=(',', ':'))
+            pipe.xadd(self.stream_key, {
+                'id': docket['id'],
+                'job': str(crawling_job_id),
+                'hash': docket_content_hash(docket),
+                'change': change,
+                'fields': ','.join(changed_fields),
+            }, maxlen=self.maxlen, approximate=True)
+
+        pipe.hset(self.field_hashes_key, mapping=new_hashes)
+        pipe.execute()
+        return counts
+
+
+class ChangeFeedConsumer(object):
+    """
+    Reads the change feed as a consumer of a consumer group, events read but not acknowledged are read again
+    first when the consumer restarts
+    """
+
+    def __init__(self, server, stream_key, group, consumer, start_id='0'):
+        self.server = server
+        self.stream_key = stream_key
+        self.group = group
+        self.consumer = consumer
+        self.start_id = start_id
+
+    def create_group(self):
+        try:
+            # a new group reads the stream from `start_id`, '0' for every event still in the stream, '$' for new ones
+            self.server.xgroup_create(self.stream_key, self.group, id=self.start_id, mkstream=True)
+        except ResponseError as error:
+            if 'BUSYGROUP' not in str(error):
+                raise
+
+    def read(self, count=100, block=5000):
+        """Yields the (event id, event) pairs of the consumer, the pending ones first, waiting for new ones"""
+        self.create_group()
+
+        # '0' and then the id of the last pending event read, until every pending event is read, then '>'
+        cursor = '0'
+        while True:
+            pending = cursor != '>'
+            streams = self.server.xreadgroup(
+                self.group, self.consumer, {self.stream_key: cursor}, count=count, block=None if pending else block
+            )
+            events = streams[0][1] if streams else []
+            if pending:
+                cursor = events[-1][0] if events else '>'
+
+            for event_id, fields in events:
+                yield event_id, {key.decode(): value.decode() for key, value in fields.items()}
+
+    def ack(self, *event_ids):
+        self.server.xack(self.stream_key, self.group, *event_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spider', default='court-connect-crawl')
+    parser.add_argument('--group', required=True)
+    parser.add_argument('--consumer', required=True)
+    parser.add_argument('--from-start', action='store_true',
+                        help='a new group reads every event still in the stream instead of only new ones')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    stream_key = settings.get('CHANGE_FEED_STREAM_KEY', CHANGE_FEED_STREAM_KEY) % {'spider': args.spider}
+    consumer = ChangeFeedConsumer(
+        get_redis_from_settings(settings), stream_key, args.group, args.consumer,
+        start_id='0' if args.from_start else '$'
+    )
+
+    for event_id, event in consumer.read():
+        sys.stdout.write(json.dumps({'event_id': event_id.decode(), **event}) + '\n')
+        sys.stdout.flush()
+        consumer.ack(event_id)
+
+
+if __name__ == '__main__':
+    main()
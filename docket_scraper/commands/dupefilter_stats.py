@@ -0,0 +1,28 @@
+import json
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy_redis.connection import get_redis_from_settings
+
+from docket_scraper.dupefilter import get_bloom_dupefilter_key, get_bloom_filter
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '<spider> <crawling_job_id>'
+
+    def short_desc(self):
+        return 'Print fill ratio and memory of the bloom dupefilter of a crawling job'
+
+    def run(self, args, opts):
+        if len(args) != 2:
+            raise UsageError()
+
+        spider_name, crawling_job_id = args
+        key = get_bloom_dupefilter_key(self.settings, spider_name, crawling_job_id)
+        bloom_filter = get_bloom_filter(get_redis_from_settings(self.settings), self.settings, key)
+
+        print(json.dumps(bloom_filter.stats(), indent=4))
@@ -0,0 +1,113 @@
+import itertools
+import logging
+import os
+from datetime import datetime
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import DropItem, UsageError
+from scrapy.pipelines import ItemPipelineManager
+from scrapy.utils.conf import arglist_to_dict
+from scrapy.utils.log import failure_to_exc_info
+from twisted.internet import defer, threads
+
+from docket_scraper.archive import ResponseArchive
+from docket_scraper.parse_pool import parse_page, worker_pool
+
+logger = logging.getLogger(__name__)
+
+
+def parse_archived_response(archived_response):
+    """Returns the item id, the parsed item or None and the error of the archived response"""
+    try:
+        item, _ = parse_page(archived_response.url, archived_response.body, archived_response.encoding)
+    except Exception as error:
+        return archived_response.item_id, None, repr(error)
+
+    item.crawled_at = datetime.fromisoformat(archived_response.archived_at.rstrip('Z'))
+    return archived_response.item_id, item, None
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+
+    def syntax(self):
+        return '[options] <spider>'
+
+    def short_desc(self):
+        return 'Parse the archived responses of a spider again and write the items through the item pipelines'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('-a', dest='spargs', action='append', default=[], metavar='NAME=VALUE',
+                            help='set spider argument (may be repeated)')
+        parser.add_argument('--archive-dir', help='directory of the archive, RESPONSE_ARCHIVE_DIR by default')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='parsing processes')
+        parser.add_argument('--chunk-size', type=int, default=20, help='responses sent to a process at once')
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            opts.spargs = arglist_to_dict(opts.spargs)
+        except ValueError:
+            raise UsageError('Invalid -a value, use -a NAME=VALUE', print_help=False)
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+
+        spidercls = self.crawler_process.spider_loader.load(args[0])
+        crawler = self.crawler_process.create_crawler(spidercls)
+        spider = spidercls.from_crawler(crawler, **opts.spargs)
+        crawler.spider = spider
+
+        archive = ResponseArchive(
+            opts.archive_dir or self.settings.get('RESPONSE_ARCHIVE_DIR', 'archive'), prefix=f'{spider.name}-'
+        )
+
+        from twisted.internet import reactor
+        finished = self.reparse(crawler, spider, archive, opts)
+        finished.addErrback(lambda failure: logger.error('Re-parse failed', exc_info=failure_to_exc_info(failure)))
+        finished.addBoth(lambda _: reactor.stop())
+        reactor.run()
+
+    @defer.inlineCallbacks
+    def reparse(self, crawler, spider, archive, opts):
+        stats = crawler.stats
+        pipelines = ItemPipelineManager.from_crawler(crawler)
+        stats.open_spider(spider)
+        yield pipelines.open_spider(spider)
+        logger.info(f'Re-parsing {len(archive)} archived responses with {opts.processes} processes')
+
+        archived_responses = iter(archive)
+        window_size = opts.processes * opts.chunk_size * 4
+        executor = worker_pool(opts.processes, type(spider), opts.spargs.get('parser'))
+
+        def parse_window():
+            window = list(itertools.islice(archived_responses, window_size))
+            return list(executor.map(parse_archived_response, window, chunksize=opts.chunk_size))
+
+        try:
+            results = yield threads.deferToThread(parse_window)
+            while results:
+                # the next window is parsed while the items of this one go through the pipelines
+                next_results = threads.deferToThread(parse_window)
+
+                for item_id, item, error in results:
+                    if error:
+                        stats.inc_value('reparse/failed', spider=spider)
+                        logger.error(f'Failed to parse the archived response of {item_id}: {error}')
+                        continue
+
+                    for output in spider.split_item(item) if spider.split_items else [item]:
+                        try:
+                            yield pipelines.process_item(output, spider)
+                        except DropItem:
+                            stats.inc_value('reparse/dropped', spider=spider)
+                        else:
+                            stats.inc_value('reparse/items', spider=spider)
+
+                results = yield next_results
+        finally:
+            yield threads.deferToThread(executor.shutdown)
+            yield pipelines.close_spider(spider)
+            stats.close_spider(spider, 'finished')
@@ -0,0 +1,53 @@
+import json
+from datetime import datetime
+
+# scores are the redis time at which a request is due, so every crawler compares them to the same clock
+SCHEDULE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+return redis.call('ZADD', KEYS[1], now + tonumber(ARGV[1]), ARGV[2])
+"""
+
+CLAIM_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[1]))
+for _, request in ipairs(due) do
+    redis.call('ZREM', KEYS[1], request)
+end
+return due
+"""
+
+
+class RedisDelayedRetries(object):
+    """
+    Requests waiting to be retried in a redis sorted set scored by the time they are due, claimed by any crawler
+    once due, and the requests given up on in a dead letter list
+    """
+
+    def __init__(self, server, key, dead_letter_key):
+        self.server = server
+        self.key = key
+        self.dead_letter_key = dead_letter_key
+        self.schedule_script = server.register_script(SCHEDULE_SCRIPT)
+        self.claim_script = server.register_script(CLAIM_SCRIPT)
+
+    def schedule(self, encoded_request, delay):
+        self.schedule_script(keys=[self.key], args=[delay, encoded_request])
+
+    def claim_due(self, count):
+        """Removes and returns at most `count` due requests, a request is claimed by a single crawler"""
+        return self.claim_script(keys=[self.key], args=[count])
+
+    def dead_letter(self, url, reason, attempts, crawler_id):
+        self.server.lpush(self.dead_letter_key, json.dumps({
+            'url': url,
+            'reason': reason,
+            'attempts': attempts,
+            'crawler_id': crawler_id,
+            'failed_at': datetime.utcnow().isoformat(timespec='seconds'),
+        }))
+
+    def __len__(self):
+        return self.server.zcard(self.key)
@@ -0,0 +1,200 @@
+"""
+Consolidates the `job-*` collections of the crawls into one indexed collection holding the latest version of every
+docket, and queries it by case id, party id or name, filing date range and status
+
+    python -m docket_scraper.docket_store consolidate
+    python -m docket_scraper.docket_store query --party-name 'SMITH, J*' --fields id,title,status
+"""
+import argparse
+import json
+import re
+import sys
+from datetime import datetime
+
+import pymongo
+from pymongo import ReplaceOne
+from scrapy.utils.project import get_project_settings
+
+JOB_COLLECTION_RE = re.compile(r'^job-(?P<crawling_job_id>.+?)(?P<part>-parties|-entries)?$')
+PART_KINDS = ('parties', 'entries')
+
+INDEXES = [
+    pymongo.IndexModel('id', unique=True),
+    pymongo.IndexModel('parties.id'),
+    pymongo.IndexModel('parties.name'),
+    pymongo.IndexModel('filing_date'),
+    pymongo.IndexModel('status'),
+]
+
+
+class DocketStore:
+    """Collection of the latest version of every docket crawled, indexed for the lookups of `find`"""
+
+    def __init__(self, db, collection='dockets', consolidated_jobs_collection='consolidated-jobs', batch_size=1000):
+        self.db = db
+        self.collection = db[collection]
+        self.consolidated_jobs = db[consolidated_jobs_collection]
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_settings(cls, settings):
+        client = pymongo.MongoClient(settings.get('MONGO_URI'))
+        return cls(
+            client[settings.get('MONGO_DATABASE')],
+            collection=settings.get('MONGO_CONSOLIDATED_COLLECTION', 'dockets'),
+            consolidated_jobs_collection=settings.get('MONGO_CONSOLIDATED_JOBS_COLLECTION', 'consolidated-jobs'),
+        )
+
+    def create_indexes(self):
+        self.collection.create_indexes(INDEXES)
+
+    def job_collections(self):
+        """Names of the docket collections of the crawling jobs, without their split parties and entries"""
+        return sorted(
+            name for name in self.db.list_collection_names()
+            if (match := JOB_COLLECTION_RE.match(name)) and not match['part']
+        )
+
+    def consolidate(self, job_collections=None, force=False, log=print):
+        """
+        Merges the dockets of the job collections into the store, keeping the latest crawled version of every case,
+        job collections already consolidated are skipped unless `force` is set
+        """
+        self.create_indexes()
+        consolidated = {job['collection'] for job in self.consolidated_jobs.find({}, {'collection': 1})}
+
+        for name in job_collections or self.job_collections():
+            if name in consolidated and not force:
+                log(f'Skipping {name}, already consolidated')
+                continue
+
+            counts = self.consolidate_job(name)
+            self.consolidated_jobs.replace_one(
+                {'collection': name},
+                {'collection': name, 'consolidated_at': datetime.utcnow(), **counts},
+                upsert=True,
+            )
+            log(f'Consolidated {name}: {counts["dockets"]} dockets, {counts["written"]} newer than the store')
+
+    def consolidate_job(self, name):
+        counts = {'dockets': 0, 'written': 0}
+        batch = []
+        for document in self.db[name].find({}, {'_id': 0, 'content_hash': 0}, batch_size=self.batch_size):
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                self.write_batch(name, batch, counts)
+                batch = []
+
+        if batch:
+            self.write_batch(name, batch, counts)
+        return counts
+
+    def write_batch(self, name, documents, counts):
+        counts['dockets'] += len(documents)
+        self.join_parts(name, documents)
+
+        # the latest of the dockets of a case in the batch, then only if it is newer than the stored one
+        latest = {}
+        for document in documents:
+            if document['id'] not in latest or is_newer(document, latest[document['id']]):
+                latest[document['id']] = document
+
+        stored = {
+            document['id']: document
+            for document in self.collection.find({'id': {'$in': list(latest)}}, {'_id': 0, 'id': 1, 'crawled_at': 1})
+        }
+        replacements = [
+            ReplaceOne({'id': case_id}, document, upsert=True)
+            for case_id, document in latest.items()
+            if case_id not in stored or is_newer(document, stored[case_id])
+        ]
+        if replacements:
+            self.collection.bulk_write(replacements, ordered=False)
+        counts['written'] += len(replacements)
+
+    def join_parts(self, name, documents):
+        """Puts the parties and entries of split dockets, kept in the sibling collections of the job, back in them"""
+        split_documents = {document['id']: document for document in documents if 'parties' not in document}
+        if not split_documents:
+            return
+
+        for kind in PART_KINDS:
+            parts = {case_id: [] for case_id in split_documents}
+            cursor = self.db[f'{name}-{kind}'].find({'docket_id': {'$in': list(split_documents)}}, {'_id': 0})
+            for part in cursor.sort([('docket_id', 1), ('index', 1)]):
+                parts[part.pop('docket_id')].append(part)
+
+            for case_id, document in split_documents.items():
+                for part in parts[case_id]:
+                    del part['index']
+                document[kind] = parts[case_id]
+
+    def find(self, case_id=None, party_id=None, party_name=None, filed_from=None, filed_to=None, status=None,
+             fields=None, limit=0):
+        """
+        Streams the dockets matching every given filter, with only `fields` if given. A party name ending with `*`
+        is matched as a prefix, which the `parties.name` index serves too
+        """
+        query = {}
+        if case_id:
+            query['id'] = case_id
+        if party_id:
+            query['parties.id'] = party_id
+        if party_name:
+            if party_name.endswith('*'):
+                query['parties.name'] = {'$regex': '^' + re.escape(party_name[:-1])}
+            else:
+                query['parties.name'] = party_name
+        if filed_from or filed_to:
+            query['filing_date'] = {}
+            if filed_from:
+                query['filing_date']['$gte'] = filed_from
+            if filed_to:
+                query['filing_date']['$lte'] = filed_to
+        if status:
+            query['status'] = status
+
+        projection = {'_id': 0, **dict.fromkeys(fields, 1)} if fields else {'_id': 0}
+        return self.collection.find(query, projection, limit=limit, batch_size=self.batch_size)
+
+
+def is_newer(document, other):
+    return (document.get('crawled_at') or datetime.min) >= (other.get('crawled_at') or datetime.min)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    consolidate_parser = subparsers.add_parser('consolidate', help='merge job collections into the docket store')
+    consolidate_parser.add_argument('jobs', nargs='*', metavar='COLLECTION',
+                                    help='job collections to merge, every job-* collection by default')
+    consolidate_parser.add_argument('--force', action='store_true', help='merge jobs already consolidated again')
+
+    query_parser = subparsers.add_parser('query', help='print the matching dockets as json lines')
+    query_parser.add_argument('--id', dest='case_id')
+    query_parser.add_argument('--party-id')
+    query_parser.add_argument('--party-name', help='exact name, or a prefix ending with *')
+    query_parser.add_argument('--filed-from', type=datetime.fromisoformat, help='YYYY-MM-DD')
+    query_parser.add_argument('--filed-to', type=datetime.fromisoformat, help='YYYY-MM-DD')
+    query_parser.add_argument('--status')
+    query_parser.add_argument('--fields', type=lambda fields: fields.split(','), help='comma separated fields')
+    query_parser.add_argument('--limit', type=int, default=0)
+
+    args = parser.parse_args()
+    store = DocketStore.from_settings(get_project_settings())
+
+    if args.command == 'consolidate':
+        store.consolidate(args.jobs, force=args.force)
+        return
+
+    dockets = store.find(
+        case_id=args.case_id, party_id=args.party_id, party_name=args.party_name, filed_from=args.filed_from,
+        filed_to=args.filed_to, status=args.status, fields=args.fields, limit=args.limit,
+    )
+    for docket in dockets:
+        sys.stdout.write(json.dumps(docket, default=str) + '\n')
+
+
+if __name__ == '__main__':
+    main()
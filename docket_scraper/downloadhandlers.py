@@ -0,0 +1,64 @@
+from scrapy.core.downloader.handlers.http11 import (
+    HTTP11DownloadHandler, ScrapyAgent, ScrapyProxyAgent, TunnelingAgent
+)
+from twisted.web.client import Agent
+
+
+class IdentityAgentMixin(object):
+    """Keeps the persistent connections of every identity apart in the connection pool"""
+
+    identity = None
+
+    def _requestWithEndpoint(self, key, endpoint, *args, **kwargs):
+        if self.identity is not None:
+            key = (*key, self.identity)
+        return super(IdentityAgentMixin, self)._requestWithEndpoint(key, endpoint, *args, **kwargs)
+
+
+class IdentityAgent(IdentityAgentMixin, Agent):
+    pass
+
+
+class IdentityProxyAgent(IdentityAgentMixin, ScrapyProxyAgent):
+    pass
+
+
+class IdentityTunnelingAgent(IdentityAgentMixin, TunnelingAgent):
+    pass
+
+
+class IdentityScrapyAgent(ScrapyAgent):
+    _Agent = IdentityAgent
+    _ProxyAgent = IdentityProxyAgent
+    _TunnelingAgent = IdentityTunnelingAgent
+
+    def _get_agent(self, request, timeout):
+        agent = super(IdentityScrapyAgent, self)._get_agent(request, timeout)
+        agent.identity = request.meta.get('identity')
+        return agent
+
+
+class IdentityHTTP11DownloadHandler(HTTP11DownloadHandler):
+    """
+    HTTP/1.1 download handler reusing the keep-alive connections of a request identity, set in the `identity`
+    request meta by `RandomUserAgentMiddleware`, only for the requests of that identity, so a server sees every
+    connection speak with a single user agent. Requests without an identity share the connections as usual
+
+    Built on the private agents of Scrapy's HTTP/1.1 handler, so crawl spiders install it only with
+    USER_AGENT_IDENTITIES set
+    """
+
+    def __init__(self, settings, crawler=None):
+        super(IdentityHTTP11DownloadHandler, self).__init__(settings, crawler)
+        self._pool.maxPersistentPerHost = settings.getint('USER_AGENT_IDENTITY_CONNECTIONS', 1)
+
+    def download_request(self, request, spider):
+        agent = IdentityScrapyAgent(
+            contextFactory=self._contextFactory,
+            pool=self._pool,
+            maxsize=getattr(spider, 'download_maxsize', self._default_maxsize),
+            warnsize=getattr(spider, 'download_warnsize', self._default_warnsize),
+            fail_on_dataloss=self._fail_on_dataloss,
+            crawler=self._crawler,
+        )
+        return agent.download_request(request)
@@ -0,0 +1,56 @@
+import time
+
+from scrapy_redis.connection import get_redis_from_settings
+from scrapy_redis.dupefilter import RFPDupeFilter
+
+from docket_scraper.bloomfilter import RedisScalableBloomFilter
+
+BLOOM_DUPEFILTER_KEY = '%(spider)s:%(crawling_job_id)s:bloom-dupefilter'
+
+
+def get_bloom_dupefilter_key(settings, spider_name, crawling_job_id):
+    dupefilter_key = settings.get('BLOOM_DUPEFILTER_KEY', BLOOM_DUPEFILTER_KEY)
+    return dupefilter_key % {'spider': spider_name, 'crawling_job_id': crawling_job_id}
+
+
+def get_bloom_filter(server, settings, key):
+    return RedisScalableBloomFilter(
+        server,
+        key=key,
+        initial_capacity=settings.getint('BLOOM_DUPEFILTER_INITIAL_CAPACITY', 1000000),
+        error_rate=settings.getfloat('BLOOM_DUPEFILTER_ERROR_RATE', 0.0001),
+        ttl=settings.getint('BLOOM_DUPEFILTER_TTL') or None
+    )
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """
+    Redis based request duplicates filter keeping request fingerprints in a scalable bloom filter,
+    bounded in memory at the cost of taking an unseen request as seen with BLOOM_DUPEFILTER_ERROR_RATE probability
+    """
+
+    def __init__(self, server, key, bloom_filter, debug=False):
+        super(BloomDupeFilter, self).__init__(server, key, debug=debug)
+        self.bloom_filter = bloom_filter
+
+    @classmethod
+    def from_settings(cls, settings):
+        server = get_redis_from_settings(settings)
+        key = get_bloom_dupefilter_key(settings, 'dupefilter', int(time.time()))
+        return cls(server, key, get_bloom_filter(server, settings, key), debug=settings.getbool('DUPEFILTER_DEBUG'))
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        server = get_redis_from_settings(settings)
+        key = get_bloom_dupefilter_key(settings, spider.name, getattr(spider, 'crawling_job_id', None))
+        return cls(server, key, get_bloom_filter(server, settings, key), debug=settings.getbool('DUPEFILTER_DEBUG'))
+
+    def request_seen(self, request):
+        return not self.bloom_filter.add(self.request_fingerprint(request))
+
+    def __len__(self):
+        return len(self.bloom_filter)
+
+    def clear(self):
+        self.bloom_filter.clear()
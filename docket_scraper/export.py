@@ -0,0 +1,215 @@
+import gzip
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from docket_scraper.items import CensusItem, DocketPartItem, docket_part_to_dict, item_to_dict, iter_docket_parts
+
+MANIFEST_NAME = 'manifest.jsonl'
+IN_PROGRESS_SUFFIX = '.in-progress'
+
+TABLE_SCHEMAS = {
+    'dockets': pa.schema([
+        ('url', pa.string()),
+        ('id', pa.string()),
+        ('start_date', pa.string()),
+        ('end_date', pa.string()),
+        ('title', pa.string()),
+        ('filing_date', pa.timestamp('us')),
+        ('type', pa.string()),
+        ('status', pa.string()),
+        ('parties_count', pa.int32()),
+        ('entries_count', pa.int32()),
+        ('crawling_job_id', pa.string()),
+        ('crawler_id', pa.string()),
+        ('spider_name', pa.string()),
+        ('crawled_at', pa.timestamp('us')),
+    ]),
+    'parties': pa.schema([
+        ('docket_id', pa.string()),
+        ('index', pa.int32()),
+        ('associates', pa.list_(pa.string())),
+        ('end_date', pa.timestamp('us')),
+        ('type', pa.string()),
+        ('id', pa.string()),
+        ('name', pa.string()),
+        ('address', pa.string()),
+        ('aliases', pa.string()),
+    ]),
+    'entries': pa.schema([
+        ('docket_id', pa.string()),
+        ('index', pa.int32()),
+        ('filing_date', pa.timestamp('us')),
+        ('description', pa.string()),
+        ('party', pa.string()),
+        ('monetary', pa.string()),
+        ('content', pa.string()),
+    ]),
+    'census': pa.schema([
+        ('url', pa.string()),
+        ('id', pa.string()),
+        ('title', pa.string()),
+        ('filing_date', pa.timestamp('us')),
+        ('type', pa.string()),
+        ('status', pa.string()),
+        ('crawling_job_id', pa.string()),
+        ('crawler_id', pa.string()),
+        ('spider_name', pa.string()),
+        ('crawled_at', pa.timestamp('us')),
+    ]),
+}
+
+
+def item_rows(item):
+    """
+    Yields the (table, row) pairs of a docket, its parties and entries, of a part of a split docket or of a census item
+    """
+    if isinstance(item, DocketPartItem):
+        yield item.kind, docket_part_to_dict(item)
+        return
+    if isinstance(item, CensusItem):
+        yield 'census', item_to_dict(item)
+        return
+
+    docket_row = item_to_dict(item)
+    del docket_row['parties'], docket_row['entries']
+    # whole dockets carry their parts, split ones only their counts
+    docket_row['parties_count'] = item.parties_count or len(item.parties)
+    docket_row['entries_count'] = item.entries_count or len(item.entries)
+    yield 'dockets', docket_row
+
+    for part in iter_docket_parts(item):
+        yield part.kind, docket_part_to_dict(part)
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class ParquetTableWriter:
+    suffix = '.parquet'
+
+    def __init__(self, path, schema):
+        self.file = open(path, 'wb')
+        self.writer = pq.ParquetWriter(self.file, schema, compression='zstd')
+        self.schema = schema
+
+    def write(self, rows):
+        # every write is a row group of its own
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+
+class JsonLinesTableWriter:
+    suffix = '.jsonl.gz'
+
+    def __init__(self, path, schema):
+        self.file = open(path, 'wb')
+        self.gzip_file = gzip.GzipFile(fileobj=self.file, mode='wb')
+
+    def write(self, rows):
+        lines = ''.join(json.dumps(row, default=json_default) + '\n' for row in rows)
+        self.gzip_file.write(lines.encode())
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.gzip_file.close()
+        self.file.close()
+
+
+TABLE_WRITERS = {
+    'parquet': ParquetTableWriter,
+    'jsonl': JsonLinesTableWriter,
+}
+
+
+class TableFile:
+    def __init__(self, writer, path, number):
+        self.writer = writer
+        self.path = path
+        self.number = number
+        self.rows = 0
+        self.created_at = datetime.utcnow()
+
+
+class DocketExport:
+    """
+    Writes the dockets, parties and entries tables of a crawler in files rolled every `max_file_rows` rows or
+    `max_file_size` bytes, `{directory}/{table}/{crawler_id}-{n:05}.parquet` or `.jsonl.gz`
+
+    A file is written under an `.in-progress` name and renamed once closed, then listed in the `manifest.jsonl`
+    of the directory, shared by every crawler of a crawling job
+    """
+
+    def __init__(self, directory, crawler_id, file_format='parquet', max_file_rows=1000000,
+                 max_file_size=128 * 1024 * 1024):
+        if file_format not in TABLE_WRITERS:
+            raise ValueError(f'Unknown export format "{file_format}", expected one of {sorted(TABLE_WRITERS)}')
+
+        self.directory = Path(directory)
+        self.crawler_id = crawler_id
+        self.file_format = file_format
+        self.writer_cls = TABLE_WRITERS[file_format]
+        self.max_file_rows = max_file_rows
+        self.max_file_size = max_file_size
+        self.files = {}
+        self.file_numbers = dict.fromkeys(TABLE_SCHEMAS, 0)
+
+    def write(self, table_rows):
+        """Writes the rows of every table, a dict of table name to rows"""
+        for table, rows in table_rows.items():
+            if not rows:
+                continue
+
+            table_file = self.files.get(table) or self.open_file(table)
+            table_file.writer.write(rows)
+            table_file.rows += len(rows)
+
+            if table_file.rows >= self.max_file_rows or table_file.writer.size() >= self.max_file_size:
+                self.close_file(table)
+
+    def open_file(self, table):
+        self.file_numbers[table] += 1
+        number = self.file_numbers[table]
+        table_directory = self.directory / table
+        table_directory.mkdir(parents=True, exist_ok=True)
+
+        path = table_directory / f'{self.crawler_id}-{number:05}{self.writer_cls.suffix}'
+        writer = self.writer_cls(path.with_name(path.name + IN_PROGRESS_SUFFIX), TABLE_SCHEMAS[table])
+        self.files[table] = TableFile(writer, path, number)
+        return self.files[table]
+
+    def close_file(self, table):
+        table_file = self.files.pop(table)
+        table_file.writer.close()
+        os.replace(table_file.path.with_name(table_file.path.name + IN_PROGRESS_SUFFIX), table_file.path)
+
+        with (self.directory / MANIFEST_NAME).open('a') as manifest:
+            manifest.write(json.dumps({
+                'table': table,
+                'path': str(table_file.path.relative_to(self.directory)),
+                'format': self.file_format,
+                'rows': table_file.rows,
+                'bytes': table_file.path.stat().st_size,
+                'crawler_id': self.crawler_id,
+                'created_at': table_file.created_at.isoformat(timespec='seconds'),
+                'closed_at': datetime.utcnow().isoformat(timespec='seconds'),
+            }) + '\n')
+
+    def close(self):
+        for table in list(self.files):
+            self.close_file(table)
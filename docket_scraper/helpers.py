@@ -1,4 +1,7 @@
 import re
+from collections import defaultdict
+
+from lxml import etree
 
 
 def reset_cookies(request, response):
@@ -24,3 +27,74 @@ def strip_text(text_or_list):
             stripped_texts.append(stripped_text)
 
     return stripped_texts
+
+
+own_texts = etree.XPath('text()')
+descendant_texts = etree.XPath('.//text()')
+element_string = etree.XPath('string()')
+
+
+def element_children(element):
+    return [child for child in element if isinstance(child.tag, str)]
+
+
+def next_element_sibling(element):
+    sibling = element.getnext()
+    while sibling is not None and not isinstance(sibling.tag, str):
+        sibling = sibling.getnext()
+    return sibling
+
+
+def previous_element_sibling(element):
+    sibling = element.getprevious()
+    while sibling is not None and not isinstance(sibling.tag, str):
+        sibling = sibling.getprevious()
+    return sibling
+
+
+def find_anchor_tables(root, names):
+    """Maps each anchor name to the tables placed right after it, i.e. `[NAME="name"] + table`"""
+    tables = {name: [] for name in names}
+    for element in root.iter():
+        name = element.get('name') if isinstance(element.tag, str) else None
+        if name not in tables:
+            continue
+
+        sibling = next_element_sibling(element)
+        if sibling is not None and sibling.tag == 'table':
+            tables[name].append(sibling)
+
+    return tables
+
+
+def index_label_cells(tables):
+    """Pairs the text of every td with the own text of the td following it, in document order"""
+    label_cells = []
+    for table in tables:
+        for cell in table.iter('td'):
+            value_cell = next_element_sibling(cell)
+            if value_cell is None or value_cell.tag != 'td':
+                continue
+            label_cells.append((element_string(cell), own_texts(value_cell)))
+
+    return label_cells
+
+
+def label_cell_texts(label_cells, label):
+    """Stripped texts of the cells next to labels containing `label`, i.e. `td:contains(label) + td::text`"""
+    texts = []
+    for cell_label, cell_texts in label_cells:
+        if label in cell_label:
+            texts.extend(cell_texts)
+
+    return strip_text(texts)
+
+
+def index_row_cells(row):
+    """Maps each column number of a row to the stripped texts of its td, i.e. `td:nth-child(column) ::text`"""
+    row_cells = defaultdict(list)
+    for column, cell in enumerate(element_children(row), start=1):
+        if cell.tag == 'td':
+            row_cells[column] = strip_text(descendant_texts(cell))
+
+    return row_cells
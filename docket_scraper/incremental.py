@@ -0,0 +1,44 @@
+import hashlib
+import json
+
+from scrapy_redis.connection import get_redis_from_settings
+
+CLOSED_LISTINGS_KEY = '%(spider)s:closed-listings'
+CRAWL_FIELDS = ['crawling_job_id', 'crawler_id', 'spider_name', 'crawled_at']
+
+
+def docket_content_hash(docket_dict):
+    """Stable hash of a docket dict, leaving out the fields describing the crawl that fetched it"""
+    docket_dict = {key: value for key, value in docket_dict.items() if key not in CRAWL_FIELDS}
+    content = json.dumps(docket_dict, sort_keys=True, separators=(',', ':'), default=lambda value: value.isoformat())
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def listing_hash(texts):
+    return hashlib.sha1('\n'.join(texts).encode()).hexdigest()
+
+
+class ClosedListings(object):
+    """
+    Listing rows of closed dockets as of their last crawl, shared by all crawls of a spider,
+    a closed docket whose listing row has not changed since is not fetched again
+    """
+
+    def __init__(self, server, key):
+        self.server = server
+        self.key = key
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        key = settings.get('CLOSED_LISTINGS_KEY', CLOSED_LISTINGS_KEY) % {'spider': spider.name}
+        return cls(get_redis_from_settings(settings), key)
+
+    def is_unchanged(self, item_id, row_hash):
+        last_row_hash = self.server.hget(self.key, item_id)
+        if isinstance(last_row_hash, bytes):
+            last_row_hash = last_row_hash.decode()
+        return last_row_hash == row_hash
+
+    def add(self, item_id, row_hash):
+        self.server.hset(self.key, item_id, row_hash)
@@ -4,40 +4,97 @@
 # https://docs.scrapy.org/en/latest/topics/items.html
 
 from dataclasses import dataclass, field
+from datetime import datetime
 from typing import Union, List
 
-import scrapy
 
-
-@dataclass
+@dataclass(slots=True)
 class PartyItem:
-    end_date: Union[str, None]
-    type: str
+    associates: List[Union[str, None]]
+    end_date: Union[datetime, None]
+    type: Union[str, None]
     id: Union[str, None]
     name: Union[str, None]
     address: Union[str, None]
     aliases: Union[str, None]
-    associates: List[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class EntryItem:
-    filing_date: Union[str, None]
+    filing_date: Union[datetime, None]
     description: Union[str, None]
     party: Union[str, None]
     monetary: Union[str, None]
     content: Union[str, None]
 
 
-@dataclass
+@dataclass(slots=True)
 class DocketItem:
     url: str
     id: str
     start_date: Union[str, None]
     end_date: Union[str, None]
     title: str
-    filing_date: str
+    filing_date: datetime
     type: str
     status: str
     parties: List[PartyItem] = field(default_factory=list)
     entries: List[EntryItem] = field(default_factory=list)
+    # set on split dockets only, whole dockets carry their parties and entries
+    parties_count: Union[int, None] = None
+    entries_count: Union[int, None] = None
+    crawling_job_id: Union[str, None] = None
+    crawler_id: Union[str, None] = None
+    spider_name: Union[str, None] = None
+    crawled_at: Union[datetime, None] = None
+
+
+@dataclass(slots=True)
+class CensusItem:
+    """The header fields of a docket, all a census crawl keeps of a case"""
+    url: str
+    id: str
+    title: Union[str, None]
+    filing_date: Union[datetime, None]
+    type: Union[str, None]
+    status: Union[str, None]
+    crawling_job_id: Union[str, None] = None
+    crawler_id: Union[str, None] = None
+    spider_name: Union[str, None] = None
+    crawled_at: Union[datetime, None] = None
+
+
+@dataclass(slots=True)
+class DocketPartItem:
+    """A party or entry of a docket, stored apart from the docket when dockets are split"""
+    docket_id: str
+    kind: str
+    index: int
+    part: Union[PartyItem, EntryItem]
+
+
+PART_KINDS = {PartyItem: 'parties', EntryItem: 'entries'}
+
+
+def iter_docket_parts(docket):
+    for kind, parts in (('parties', docket.parties), ('entries', docket.entries)):
+        for index, part in enumerate(parts):
+            yield DocketPartItem(docket_id=docket.id, kind=kind, index=index, part=part)
+
+
+def item_to_dict(item):
+    return {name: getattr(item, name) for name in item.__slots__}
+
+
+def docket_to_dict(docket):
+    """Plain dict of the docket and its parties and entries, built without copying any field value"""
+    docket_dict = item_to_dict(docket)
+    docket_dict['parties'] = [item_to_dict(party) for party in docket.parties]
+    docket_dict['entries'] = [item_to_dict(entry) for entry in docket.entries]
+    if docket.parties_count is None:
+        del docket_dict['parties_count'], docket_dict['entries_count']
+    return docket_dict
+
+
+def docket_part_to_dict(docket_part):
+    return {'docket_id': docket_part.docket_id, 'index': docket_part.index, **item_to_dict(docket_part.part)}
@@ -0,0 +1,251 @@
+"""
+Runs `--workers` crawler processes of a spider on this host, one per core by default, sharing a crawling job through
+redis. Once the start urls, request queue and delayed retries of the spider have stayed empty for `--idle-time`
+seconds, the workers are shut down gracefully, finishing their requests and flushing their pipelines, and their
+crawl stats are added up
+
+    python -m docket_scraper.launcher --crawling-job-id $(date +%s)
+    python -m docket_scraper.launcher --workers 8 --idle-time 120 -s PARSE_POOL_PROCESSES=0 -a incremental=true
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from scrapy.utils.project import get_project_settings
+from scrapy_redis import defaults
+from scrapy_redis.connection import get_redis_from_settings
+
+from docket_scraper.metrics import CRAWL_STATS_KEY
+from docket_scraper.queue import REQUEST_TYPES, request_type_key
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+KEY_LENGTHS = {
+    b'list': 'llen',
+    b'set': 'scard',
+    b'zset': 'zcard',
+}
+
+
+def pending_work_keys(settings, spider_name):
+    """Redis keys of the work left in a crawl of the spider, by name"""
+    keys = {
+        'start_urls': settings.get('REDIS_START_URLS_KEY', defaults.START_URLS_KEY) % {'name': spider_name},
+        'delayed_retries': settings.get('DELAYED_RETRY_KEY', '%(spider)s:delayed_retries') % {'spider': spider_name},
+    }
+    queue_key = settings.get('SCHEDULER_QUEUE_KEY', defaults.SCHEDULER_QUEUE_KEY) % {'spider': spider_name}
+    keys['requests'] = queue_key
+    for request_type in REQUEST_TYPES:
+        keys[f'requests/{request_type}'] = request_type_key(queue_key, request_type)
+    return keys
+
+
+def pending_work(server, keys):
+    """Maps the keys of `pending_work_keys` to the length of their list, set or sorted set, 0 if missing"""
+    pipe = server.pipeline()
+    for key in keys.values():
+        pipe.type(key)
+    key_types = dict(zip(keys, pipe.execute()))
+
+    counted = [name for name in keys if key_types[name] in KEY_LENGTHS]
+    pipe = server.pipeline()
+    for name in counted:
+        getattr(pipe, KEY_LENGTHS[key_types[name]])(keys[name])
+    return {**dict.fromkeys(keys, 0), **dict(zip(counted, pipe.execute()))}
+
+
+def worker_command(spider_name, crawling_job_id, spider_arguments, settings, loglevel, logfile=None):
+    command = [
+        sys.executable, '-m', 'scrapy', 'crawl', spider_name, '-a', f'crawling_job_id={crawling_job_id}',
+        '--loglevel', loglevel,
+    ]
+    for argument in spider_arguments:
+        command += ['-a', argument]
+    for setting in settings:
+        command += ['-s', setting]
+    if logfile:
+        command += ['--logfile', str(logfile)]
+    return command
+
+
+def start_workers(args, settings):
+    workers = []
+    metrics_port = int(settings.getlist('METRICS_PORT', [9410])[0])
+    for number in range(args.workers):
+        # the launcher adds up the final crawl stats the workers write to redis
+        worker_settings = [*args.settings, 'CRAWL_STATS_ENABLED=true']
+        # a port of its own for every worker, however many cores the host has
+        if settings.getbool('METRICS_ENABLED'):
+            worker_settings.append(f'METRICS_PORT={metrics_port + number}')
+
+        logfile = None
+        if args.log_dir:
+            Path(args.log_dir).mkdir(parents=True, exist_ok=True)
+            logfile = Path(args.log_dir) / f'{args.crawling_job_id}-worker-{number}.log'
+
+        command = worker_command(
+            args.spider, args.crawling_job_id, args.spider_arguments, worker_settings, args.loglevel, logfile
+        )
+        # a session of its own, so a ctrl-c reaches the launcher only and the workers are drained by it
+        workers.append(subprocess.Popen(command, start_new_session=True))
+    return workers
+
+
+def wait_until_idle(server, keys, workers, idle_time, poll_interval, stopping):
+    """
+    Returns once the pending work stayed empty for `idle_time` seconds, the countdown starting only after some work
+    was seen so the workers are not stopped before the start urls are seeded, or once every worker exited or
+    `stopping` is set
+    """
+    seen_work = False
+    idle_since = None
+    while not stopping.is_set():
+        if all(worker.poll() is not None for worker in workers):
+            print('Every worker exited')
+            return
+
+        work = pending_work(server, keys)
+        if any(work.values()):
+            seen_work = True
+            idle_since = None
+        elif seen_work:
+            idle_since = idle_since or time.monotonic()
+            if time.monotonic() - idle_since >= idle_time:
+                print(f'No pending work for {idle_time}s, draining the workers')
+                return
+
+        stopping.wait(poll_interval)
+
+
+def drain_workers(workers, timeout):
+    """
+    Asks every worker to shut down gracefully, a second interrupt makes scrapy stop without waiting for its requests
+    and pipelines, sent only to the workers not done after `timeout` seconds, which are killed 30s later
+    """
+    for worker in workers:
+        if worker.poll() is None:
+            worker.send_signal(signal.SIGINT)
+
+    deadline = time.monotonic() + timeout
+    for worker in workers:
+        try:
+            worker.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            pass
+
+    for worker in workers:
+        if worker.poll() is None:
+            print(f'Worker {worker.pid} not drained after {timeout}s, forcing its shutdown')
+            worker.send_signal(signal.SIGINT)
+            try:
+                worker.wait(30)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+                worker.wait()
+
+
+def add_up_stats(worker_stats):
+    """
+    Adds up the numeric crawl stats of the workers, taking the largest of the `max` ones, the earliest start time
+    and the latest finish time, and counts their finish reasons
+    """
+    total = {}
+    finish_reasons = Counter()
+    for stats in worker_stats:
+        for stat, value in stats.items():
+            if stat == 'start_time':
+                total[stat] = min(total.get(stat, value), value)
+            elif stat == 'finish_time':
+                total[stat] = max(total.get(stat, value), value)
+            elif stat == 'finish_reason':
+                finish_reasons[value] += 1
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                if any(part == 'max' or part.startswith('max_') for part in stat.split('/')):
+                    total[stat] = max(total.get(stat, value), value)
+                else:
+                    total[stat] = total.get(stat, 0) + value
+
+    total['finish_reasons'] = dict(finish_reasons)
+    return dict(sorted(total.items()))
+
+
+class StoppingEvent(object):
+    """Set by SIGINT and SIGTERM, waited on between polls of the pending work"""
+
+    def __init__(self):
+        self.stopped = False
+
+    def set(self, signum=None, frame=None):
+        if not self.stopped:
+            print('Interrupted, draining the workers')
+        self.stopped = True
+
+    def is_set(self):
+        return self.stopped
+
+    def wait(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stopped and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spider', default=CourtConnectCrawlSpider.name)
+    parser.add_argument('--crawling-job-id', default=str(int(time.time())))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='crawler processes, one per core by default')
+    parser.add_argument('--idle-time', type=float, default=60,
+                        help='seconds the pending work stays empty before the workers are drained')
+    parser.add_argument('--poll-interval', type=float, default=5, help='seconds between checks of the pending work')
+    parser.add_argument('--drain-timeout', type=float, default=300,
+                        help='seconds the workers get to finish their requests and flush their pipelines')
+    parser.add_argument('--log-dir', help='write the log of every worker to a file of this directory')
+    parser.add_argument('--loglevel', default='INFO')
+    parser.add_argument('-a', dest='spider_arguments', action='append', default=[], metavar='NAME=VALUE',
+                        help='spider argument passed through to every worker')
+    parser.add_argument('-s', dest='settings', action='append', default=[], metavar='NAME=VALUE',
+                        help='setting passed through to every worker')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    settings.setdict(dict(setting.split('=', 1) for setting in args.settings), priority='cmdline')
+    server = get_redis_from_settings(settings)
+    keys = pending_work_keys(settings, args.spider)
+    stats_key = settings.get('CRAWL_STATS_KEY', CRAWL_STATS_KEY) % {
+        'spider': args.spider, 'crawling_job_id': args.crawling_job_id
+    }
+
+    stopping = StoppingEvent()
+    signal.signal(signal.SIGINT, stopping.set)
+    signal.signal(signal.SIGTERM, stopping.set)
+
+    print(f'Starting {args.workers} workers of {args.spider}, crawling job {args.crawling_job_id}')
+    started_at = time.monotonic()
+    workers = start_workers(args, settings)
+    try:
+        wait_until_idle(server, keys, workers, args.idle_time, args.poll_interval, stopping)
+    finally:
+        drain_workers(workers, args.drain_timeout)
+    elapsed = time.monotonic() - started_at
+
+    worker_stats = [json.loads(stats) for stats in server.hvals(stats_key)] if stats_key else []
+    stats = add_up_stats(worker_stats)
+    print(json.dumps(stats, indent=4))
+    print(f'workers:        {args.workers}, {len(worker_stats)} reported their stats')
+    print(f'exit codes:     {[worker.returncode for worker in workers]}')
+    print(f'pending work:   {pending_work(server, keys)}')
+    print(f'elapsed:        {elapsed:.1f} s')
+    print(f'items:          {stats.get("item_scraped_count", 0)}')
+    print(f'items/sec:      {stats.get("item_scraped_count", 0) / max(elapsed, 1e-9):.1f}')
+    if any(worker.returncode for worker in workers):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+import json
+import time
+
+from prometheus_client import CollectorRegistry, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, SummaryMetricFamily
+from prometheus_client.twisted import MetricsResource
+from redis.exceptions import RedisError
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.pipelines import ItemPipelineManager
+from scrapy.utils.reactor import listen_tcp
+from scrapy_redis.connection import get_redis_from_settings
+from twisted.internet import defer, task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+LABELS = ['crawler_id', 'crawling_job_id']
+CALLBACK_TIMING_STAT = 'timing/callback/%(name)s/%(field)s'
+PIPELINE_TIMING_STAT = 'timing/pipeline/%(name)s/%(field)s'
+CRAWL_STATS_KEY = '%(spider)s:%(crawling_job_id)s:crawl-stats'
+
+
+def record_timing(stats, stat, name, seconds, spider):
+    stats.inc_value(stat % {'name': name, 'field': 'count'}, spider=spider)
+    stats.inc_value(stat % {'name': name, 'field': 'seconds'}, seconds, spider=spider)
+
+
+class TimedItemPipelineManager(ItemPipelineManager):
+    """
+    Item pipeline manager adding up the time items spend in every pipeline in the crawl stats. It wraps the methods
+    Scrapy's private `_add_middleware` registers, so crawl spiders use it only with METRICS_ENABLED
+    """
+
+    def _add_middleware(self, pipe):
+        super(TimedItemPipelineManager, self)._add_middleware(pipe)
+        if hasattr(pipe, 'process_item'):
+            self.methods['process_item'][-1] = self.timed(type(pipe).__name__, pipe.process_item)
+
+    @staticmethod
+    def timed(name, process_item):
+        def timed_process_item(item, spider):
+            started_at = time.perf_counter()
+            result = process_item(item, spider)
+
+            def record(result):
+                seconds = time.perf_counter() - started_at
+                record_timing(spider.crawler.stats, PIPELINE_TIMING_STAT, name, seconds, spider)
+                return result
+
+            # pipelines returning a Deferred are timed until it fires, e.g. MongoDBPipeline holding items back
+            if isinstance(result, defer.Deferred):
+                return result.addBoth(record)
+            return record(result)
+
+        return timed_process_item
+
+
+class CrawlCollector(object):
+    """
+    Collects the crawl stats and the sizes of the redis start urls, request queue and dupefilter of a crawler from a
+    snapshot taken on the reactor thread by `take_snapshot`, since prometheus scrapes run in the wsgi threadpool
+    """
+
+    def __init__(self, crawler, labels):
+        self.crawler = crawler
+        self.labels = labels
+        self.items_per_second = 0
+        self.stats = {}
+        self.redis_sizes = {}
+
+    def take_snapshot(self):
+        self.stats = dict(self.crawler.stats.get_stats())
+        self.redis_sizes = self.get_redis_sizes()
+
+    def get_redis_sizes(self):
+        spider = self.crawler.spider
+        engine_slot = self.crawler.engine and self.crawler.engine.slot
+        if not spider or not engine_slot:
+            return {}
+
+        sizes = {}
+        if spider.settings.getbool('REDIS_START_URLS_AS_SET'):
+            sizes['start_urls'] = spider.server.scard(spider.redis_key)
+        else:
+            sizes['start_urls'] = spider.server.llen(spider.redis_key)
+
+        scheduler = engine_slot.scheduler
+        if hasattr(scheduler.queue, 'depths'):
+            sizes['requests'] = dict(scheduler.queue.depths())
+        else:
+            sizes['requests'] = len(scheduler.queue)
+
+        if spider.settings.getbool('DELAYED_RETRY_ENABLED'):
+            keys = {'spider': spider.name}
+            sizes['delayed_retries'] = spider.server.zcard(spider.settings.get('DELAYED_RETRY_KEY') % keys)
+            sizes['dead_letters'] = spider.server.llen(spider.settings.get('DELAYED_RETRY_DEAD_LETTER_KEY') % keys)
+
+        dupefilter = scheduler.df
+        if hasattr(dupefilter, '__len__'):
+            sizes['dupefilter'] = len(dupefilter)
+        else:
+            sizes['dupefilter'] = dupefilter.server.scard(dupefilter.key)
+        return sizes
+
+    def collect(self):
+        label_names, label_values = list(self.labels), list(self.labels.values())
+        stats = self.stats
+
+        def gauge(name, documentation, value, extra_labels=None):
+            metric = GaugeMetricFamily(name, documentation, labels=label_names + list(extra_labels or {}))
+            metric.add_metric(label_values + list((extra_labels or {}).values()), value)
+            return metric
+
+        def counter(name, documentation, prefix, label):
+            metric = CounterMetricFamily(name, documentation, labels=label_names + [label])
+            for stat, value in stats.items():
+                if stat.startswith(prefix):
+                    metric.add_metric(label_values + [stat[len(prefix):]], value)
+            return metric
+
+        def summary(name, documentation, stat, label):
+            metric = SummaryMetricFamily(name, documentation, labels=label_names + [label])
+            prefix, _, suffix = (stat % {'name': '\0', 'field': 'count'}).partition('\0')
+            for count_stat, count in stats.items():
+                if count_stat.startswith(prefix) and count_stat.endswith(suffix):
+                    timed_name = count_stat[len(prefix):-len(suffix)]
+                    seconds = stats.get(stat % {'name': timed_name, 'field': 'seconds'}, 0)
+                    metric.add_metric(label_values + [timed_name], count_value=count, sum_value=seconds)
+            return metric
+
+        yield gauge('docket_scraper_items_per_second', 'Items scraped per second', self.items_per_second)
+        items = CounterMetricFamily('docket_scraper_items_scraped', 'Items scraped', labels=label_names)
+        items.add_metric(label_values, stats.get('item_scraped_count', 0))
+        yield items
+        yield counter('docket_scraper_responses', 'Responses by http status',
+                      'downloader/response_status_count/', 'status')
+        yield counter('docket_scraper_retries', 'Retried requests by reason', 'retry/reason_count/', 'reason')
+        yield summary('docket_scraper_callback_seconds', 'Time spent in spider callbacks on the reactor thread',
+                      CALLBACK_TIMING_STAT, 'callback')
+        yield summary('docket_scraper_pipeline_seconds', 'Time items spent in every item pipeline',
+                      PIPELINE_TIMING_STAT, 'pipeline')
+
+        # every other numeric stat as is, e.g. mongodb/*, rate_limit/*, parse_pool/* and seen_items/*
+        other_stats = GaugeMetricFamily('docket_scraper_stat', 'Numeric crawl stats', labels=label_names + ['stat'])
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                other_stats.add_metric(label_values + [stat], value)
+        yield other_stats
+
+        yield from self.collect_redis(gauge)
+
+    def collect_redis(self, gauge):
+        sizes = self.redis_sizes
+        if not sizes:
+            return
+
+        yield gauge('docket_scraper_redis_start_urls', 'Start urls waiting in redis', sizes['start_urls'])
+
+        if isinstance(sizes['requests'], dict):
+            requests = GaugeMetricFamily('docket_scraper_redis_requests',
+                                         'Requests waiting in the redis scheduler queue by request type',
+                                         labels=list(self.labels) + ['type'])
+            for request_type, depth in sizes['requests'].items():
+                requests.add_metric(list(self.labels.values()) + [request_type], depth)
+            yield requests
+        else:
+            yield gauge('docket_scraper_redis_requests', 'Requests waiting in the redis scheduler queue',
+                        sizes['requests'])
+
+        if 'delayed_retries' in sizes:
+            yield gauge('docket_scraper_redis_delayed_retries', 'Requests waiting in redis for their delayed retry',
+                        sizes['delayed_retries'])
+            yield gauge('docket_scraper_redis_dead_letters', 'Requests given up on after their delayed retries',
+                        sizes['dead_letters'])
+
+        yield gauge('docket_scraper_redis_dupefilter', 'Request fingerprints in the redis dupefilter',
+                    sizes['dupefilter'])
+
+
+class PrometheusMetrics(object):
+    """
+    Serves the metrics of a crawler in the prometheus format on a port of METRICS_PORT, labelled by its crawler id
+    and crawling job id: download latency, time in callbacks and pipelines, responses, retries, items per second,
+    every numeric crawl stat and the sizes of its redis queues
+    """
+
+    def __init__(self, crawler, port_range, host, items_rate_interval, snapshot_interval):
+        self.crawler = crawler
+        self.port_range = port_range
+        self.host = host
+        self.items_rate_interval = items_rate_interval
+        self.snapshot_interval = snapshot_interval
+        self.registry = CollectorRegistry()
+        self.download_latency_histogram = Histogram(
+            'docket_scraper_download_latency_seconds', 'Seconds from sending a request to receiving its response',
+            LABELS, registry=self.registry, buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 180)
+        )
+        self.download_latency = None
+        self.collector = None
+        self.listener = None
+        self.items_rate_task = None
+        self.snapshot_task = None
+        self.last_item_count = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+
+        extension = cls(
+            crawler,
+            port_range=settings.getlist('METRICS_PORT', [9410, 9420]),
+            host=settings.get('METRICS_HOST', '0.0.0.0'),
+            items_rate_interval=settings.getfloat('METRICS_ITEMS_RATE_INTERVAL', 30),
+            snapshot_interval=settings.getfloat('METRICS_SNAPSHOT_INTERVAL', 5),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        labels = {
+            'crawler_id': getattr(spider, 'crawler_id', ''),
+            'crawling_job_id': getattr(spider, 'crawling_job_id', ''),
+        }
+        self.download_latency = self.download_latency_histogram.labels(**labels)
+        self.collector = CrawlCollector(self.crawler, labels)
+        self.registry.register(self.collector)
+
+        root = Resource()
+        root.putChild(b'metrics', MetricsResource(registry=self.registry))
+        self.listener = listen_tcp([int(port) for port in self.port_range], self.host, Site(root))
+        spider.logger.info(f'Serving metrics on http://{self.host}:{self.listener.getHost().port}/metrics')
+
+        self.items_rate_task = task.LoopingCall(self.update_items_rate)
+        self.items_rate_task.start(self.items_rate_interval, now=False)
+        # the stats and redis sizes are read on the reactor thread only, scrapes are served from the latest snapshot
+        self.snapshot_task = task.LoopingCall(self.take_snapshot)
+        self.snapshot_task.start(self.snapshot_interval, now=True)
+
+    def spider_closed(self, spider):
+        for looping_call in (self.items_rate_task, self.snapshot_task):
+            if looping_call and looping_call.running:
+                looping_call.stop()
+        if self.listener:
+            return self.listener.stopListening()
+
+    def response_received(self, response, request, spider):
+        if self.download_latency and 'download_latency' in request.meta:
+            self.download_latency.observe(request.meta['download_latency'])
+
+    def take_snapshot(self):
+        # a failing redis keeps the previous snapshot instead of stopping the looping call
+        try:
+            self.collector.take_snapshot()
+        except RedisError as error:
+            self.crawler.spider.logger.warning(f'Unable to take a metrics snapshot: {error}')
+
+    def update_items_rate(self):
+        item_count = self.crawler.stats.get_value('item_scraped_count', 0)
+        self.collector.items_per_second = (item_count - self.last_item_count) / self.items_rate_interval
+        self.last_item_count = item_count
+
+
+class RedisCrawlStats(object):
+    """
+    Writes the final crawl stats of a crawler to the CRAWL_STATS_KEY redis hash of its crawling job, by crawler id,
+    where the launcher adds up the stats of its workers
+    """
+
+    def __init__(self, crawler, server, key, ttl):
+        self.crawler = crawler
+        self.server = server
+        self.key = key
+        self.ttl = ttl
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CRAWL_STATS_ENABLED') or not settings.get('CRAWL_STATS_KEY'):
+            raise NotConfigured
+
+        extension = cls(
+            crawler,
+            get_redis_from_settings(settings),
+            key=settings.get('CRAWL_STATS_KEY'),
+            ttl=settings.getint('CRAWL_STATS_TTL', 7 * 24 * 60 * 60),
+        )
+        # connected after the core stats extension, so `finish_time` and `finish_reason` are set by then
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_closed(self, spider):
+        key = self.key % {'spider': spider.name, 'crawling_job_id': getattr(spider, 'crawling_job_id', '')}
+        stats = json.dumps(self.crawler.stats.get_stats(), default=str)
+
+        pipe = self.server.pipeline()
+        pipe.hset(key, getattr(spider, 'crawler_id', spider.name), stats)
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
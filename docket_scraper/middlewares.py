@@ -3,9 +3,26 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import importlib
+import json
+import os
+import random
+import time
+
 from random_user_agent.params import SoftwareName, HardwareType, Popularity
 from random_user_agent.user_agent import UserAgent
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.request import request_from_dict
+from scrapy_redis.connection import get_redis_from_settings
+from twisted.internet import defer, reactor, task
+from twisted.internet.error import TimeoutError, TCPTimedOutError
+
+from docket_scraper.archive import ResponseArchiveWriter
+from docket_scraper.delayed_retry import RedisDelayedRetries
+from docket_scraper.metrics import CALLBACK_TIMING_STAT, record_timing
+from docket_scraper.ratelimit import RedisTokenBucket
 
 
 # useful for handling different item types with a single interface
@@ -106,6 +123,13 @@ class DocketScraperDownloaderMiddleware:
 
 
 class RandomUserAgentMiddleware(object):
+    """
+    Sets a random user agent of a pool on every request. The pool is filtered from the user agents of
+    `random_user_agent` once and cached in USER_AGENT_CACHE_PATH, later crawlers with the same filters load it as is
+
+    With USER_AGENT_IDENTITIES set, requests are spread over that many identities instead, each one a user agent
+    of the pool with its own persistent connections, see `IdentityHTTP11DownloadHandler`
+    """
     useragent_limit = 100
     fixed_user_agent_onstart = False
 
@@ -119,9 +143,9 @@ class RandomUserAgentMiddleware(object):
         Popularity.POPULAR.value
     ]
 
-    def __init__(self, browsers=[], hardwares=[], popularity=[], limit=None):
-        self.user_agent_rotator = UserAgent(software_names=browsers, hardware_types=hardwares,
-                                            popularity=popularity, limit=limit)
+    def __init__(self, user_agents, identities=0):
+        self.user_agents = user_agents
+        self.identities = user_agents[:identities]
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -131,19 +155,24 @@ class RandomUserAgentMiddleware(object):
         limit = getattr(crawler.spider, "useragent_limit", cls.useragent_limit)
         fixed_on_start = getattr(crawler.spider, 'fixed_user_agent_onstart', cls.fixed_user_agent_onstart)
 
-        user_agent_middleware = cls(browsers=browsers, hardwares=hardwares, popularity=popularity, limit=limit)
+        user_agents = load_user_agent_pool(
+            crawler.settings.get('USER_AGENT_CACHE_PATH'),
+            {'software_names': browsers, 'hardware_types': hardwares, 'popularity': popularity, 'limit': limit},
+            crawler.spider,
+        )
+        user_agent_middleware = cls(user_agents, identities=crawler.settings.getint('USER_AGENT_IDENTITIES'))
         user_agent_middleware.log_configurations(crawler.spider, browsers, hardwares, popularity, limit, fixed_on_start)
 
         return user_agent_middleware
 
     def log_configurations(self, spider, browsers, hardware, popularity, limit, fixed_on_start):
-        user_agents = [ua["user_agent"] for ua in self.user_agent_rotator.get_user_agents()]
-        spider.log(f"List of User Agents = {user_agents}")
+        spider.log(f"User agents in the pool: {len(self.user_agents)}")
         spider.log(f"useragent_browsers: {browsers}")
         spider.log(f"useragent_hardware: {hardware}")
         spider.log(f"useragent_popularity: {popularity}")
         spider.log(f"useragent_limit: {limit}")
         spider.log(f"fixed_user_agent_onstart: {fixed_on_start}")
+        spider.log(f"user agent identities: {len(self.identities)}")
 
     def get_specific_spider_user_agent(self, spider):
         user_agent_attr = getattr(spider, "user_agent", None)
@@ -171,9 +200,293 @@ class RandomUserAgentMiddleware(object):
         if is_fixed:
             spider_user_agent = getattr(spider, "fixed_user_agent", None)
             if spider_user_agent is None:
-                spider_user_agent = self.user_agent_rotator.get_random_user_agent()
+                spider_user_agent = random.choice(self.user_agents)
                 setattr(spider, "fixed_user_agent", spider_user_agent)
             request.headers["User-Agent"] = spider_user_agent
 
+        elif self.identities:
+            # a retried request keeps its identity
+            identity = request.meta.setdefault('identity', random.randrange(len(self.identities)))
+            request.headers["User-Agent"] = self.identities[identity]
+
         else:
-            request.headers["User-Agent"] = self.user_agent_rotator.get_random_user_agent()
+            request.headers["User-Agent"] = random.choice(self.user_agents)
+
+
+def load_user_agent_pool(path, filters, spider):
+    """Returns the user agents matching the filters, from the pool cached in `path` when it was built with them"""
+    if path and os.path.exists(path):
+        with open(path) as pool_file:
+            pool = json.load(pool_file)
+        if pool['filters'] == filters:
+            return pool['user_agents']
+
+    user_agents = [
+        user_agent['user_agent']
+        for user_agent in UserAgent(
+            software_names=filters['software_names'], hardware_types=filters['hardware_types'],
+            popularity=filters['popularity'], limit=filters['limit']
+        ).get_user_agents()
+    ]
+    if not user_agents:
+        raise NotConfigured(f'No user agent matches {filters}')
+
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w') as pool_file:
+                json.dump({'filters': filters, 'user_agents': user_agents}, pool_file, indent=2)
+        except OSError as error:
+            spider.logger.warning(f'Unable to cache the user agent pool in {path}: {error}')
+
+    return user_agents
+
+
+class RedisRateLimitMiddleware(object):
+    """
+    Limits the rate of requests to a domain across all crawlers through a token bucket shared in redis,
+    raising the rate while responses are clean and backing off sharply on 503s and timeouts
+    """
+    congestion_http_codes = [429, 503]
+    congestion_exceptions = (TimeoutError, TCPTimedOutError, defer.TimeoutError)
+
+    def __init__(self, token_bucket, stats):
+        self.token_bucket = token_bucket
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('RATE_LIMIT_ENABLED'):
+            raise NotConfigured
+
+        token_bucket = RedisTokenBucket(
+            get_redis_from_settings(settings),
+            key=settings.get('RATE_LIMIT_KEY', 'rate-limit:%(bucket)s'),
+            initial_rate=settings.getfloat('RATE_LIMIT_INITIAL_RATE', 2),
+            min_rate=settings.getfloat('RATE_LIMIT_MIN_RATE', 0.5),
+            max_rate=settings.getfloat('RATE_LIMIT_MAX_RATE', 16),
+            burst=settings.getfloat('RATE_LIMIT_BURST', 1),
+            increase=settings.getfloat('RATE_LIMIT_INCREASE', 0.01),
+            decrease_factor=settings.getfloat('RATE_LIMIT_DECREASE_FACTOR', 0.5),
+            decrease_cooldown=settings.getfloat('RATE_LIMIT_DECREASE_COOLDOWN', 5),
+        )
+        return cls(token_bucket, crawler.stats)
+
+    def process_request(self, request, spider):
+        wait = self.token_bucket.acquire(urlparse_cached(request).netloc)
+        if wait <= 0:
+            return None
+
+        self.stats.inc_value('rate_limit/delayed_requests', spider=spider)
+        self.stats.inc_value('rate_limit/wait_time', wait, spider=spider)
+        return task.deferLater(reactor, wait, lambda: None)
+
+    def process_response(self, request, response, spider):
+        if response.status in self.congestion_http_codes:
+            self.adjust_rate(request, spider, congested=True)
+        elif response.status < 400:
+            self.adjust_rate(request, spider, congested=False)
+
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, self.congestion_exceptions):
+            self.adjust_rate(request, spider, congested=True)
+
+    def adjust_rate(self, request, spider, congested):
+        rate = self.token_bucket.adjust(urlparse_cached(request).netloc, congested)
+        self.stats.set_value('rate_limit/rate', rate, spider=spider)
+        if congested:
+            self.stats.inc_value('rate_limit/congestion_signals', spider=spider)
+
+
+class DelayedRetryMiddleware(object):
+    """
+    Moves the requests that got a 503 or timed out to a redis sorted set shared by all crawlers instead of retrying
+    them right away, due after an exponential backoff with jitter, so retries neither take the download slots of
+    the crawler during 503 storms nor get lost when it stops. Due requests are claimed by any crawler and scheduled
+    again, requests failing DELAYED_RETRY_MAX_TIMES times go to a dead letter list
+    """
+    retry_http_codes = [503]
+    retry_exceptions = (TimeoutError, TCPTimedOutError, defer.TimeoutError)
+
+    def __init__(self, crawler, delayed_retries, serializer, max_times, base_delay, max_delay, poll_interval,
+                 claim_count):
+        self.crawler = crawler
+        self.delayed_retries = delayed_retries
+        self.serializer = serializer
+        self.max_times = max_times
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.claim_count = claim_count
+        self.stats = crawler.stats
+        self.poll_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DELAYED_RETRY_ENABLED'):
+            raise NotConfigured
+
+        spider_name = crawler.spidercls.name
+        delayed_retries = RedisDelayedRetries(
+            get_redis_from_settings(settings),
+            key=settings.get('DELAYED_RETRY_KEY', '%(spider)s:delayed_retries') % {'spider': spider_name},
+            dead_letter_key=settings.get('DELAYED_RETRY_DEAD_LETTER_KEY', '%(spider)s:dead_letter') % {
+                'spider': spider_name
+            },
+        )
+        middleware = cls(
+            crawler,
+            delayed_retries,
+            # requests are stored like in the scheduler queue
+            importlib.import_module(settings.get('SCHEDULER_SERIALIZER', 'scrapy_redis.picklecompat')),
+            max_times=settings.getint('DELAYED_RETRY_MAX_TIMES', 8),
+            base_delay=settings.getfloat('DELAYED_RETRY_BASE_DELAY', 5),
+            max_delay=settings.getfloat('DELAYED_RETRY_MAX_DELAY', 600),
+            poll_interval=settings.getfloat('DELAYED_RETRY_POLL_INTERVAL', 1),
+            claim_count=settings.getint('DELAYED_RETRY_CLAIM_COUNT', 50),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.poll_task = task.LoopingCall(self.schedule_due_requests, spider)
+        self.poll_task.start(self.poll_interval)
+
+    def spider_closed(self, spider):
+        if self.poll_task and self.poll_task.running:
+            self.poll_task.stop()
+
+    def process_response(self, request, response, spider):
+        if response.status in self.retry_http_codes and not request.meta.get('dont_retry'):
+            self.delay_retry(request, str(response.status), spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, self.retry_exceptions) and not request.meta.get('dont_retry'):
+            self.delay_retry(request, type(exception).__name__, spider)
+
+    def delay_retry(self, request, reason, spider):
+        attempts = request.meta.get('delayed_retry_times', 0) + 1
+        if attempts > self.max_times:
+            self.delayed_retries.dead_letter(request.url, reason, attempts - 1, getattr(spider, 'crawler_id', None))
+            self.stats.inc_value('delayed_retry/dead_letter', spider=spider)
+            raise IgnoreRequest(f'Gave up retrying {request.url} after {attempts - 1} delayed retries ({reason})')
+
+        retry_request = request.replace(dont_filter=True)
+        retry_request.meta['delayed_retry_times'] = attempts
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+
+        self.delayed_retries.schedule(self.serializer.dumps(retry_request.to_dict(spider=spider)), delay)
+        self.stats.inc_value('delayed_retry/scheduled', spider=spider)
+        self.stats.inc_value(f'delayed_retry/reason_count/{reason}', spider=spider)
+        raise IgnoreRequest(f'Retrying {request.url} in {delay:.1f}s, delayed retry {attempts} ({reason})')
+
+    def schedule_due_requests(self, spider):
+        try:
+            encoded_requests = self.delayed_retries.claim_due(self.claim_count)
+        except Exception as error:
+            spider.logger.warning(f'Failed to claim the due delayed retries: {error!r}')
+            return
+
+        for encoded_request in encoded_requests:
+            request = request_from_dict(self.serializer.loads(encoded_request), spider=spider)
+            self.crawler.engine.crawl(request)
+            self.stats.inc_value('delayed_retry/rescheduled', spider=spider)
+
+
+class ResponseArchiveMiddleware(object):
+    """
+    Archives the body of every item response in compressed warc segments indexed by item id,
+    so fixed parsers can be applied to past crawls with `scrapy reparse` instead of crawling again
+    """
+
+    def __init__(self, directory, batch_size, segment_size, stats):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        self.stats = stats
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('RESPONSE_ARCHIVE_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(
+            settings.get('RESPONSE_ARCHIVE_DIR', 'archive'),
+            batch_size=settings.getint('RESPONSE_ARCHIVE_BATCH_SIZE', 50),
+            segment_size=settings.getint('RESPONSE_ARCHIVE_SEGMENT_SIZE', 100 * 1024 * 1024),
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        # segments are named after the crawler so crawlers sharing the directory never write to the same file
+        self.writer = ResponseArchiveWriter(
+            self.directory, f'{spider.name}-{spider.crawler_id}', self.batch_size, self.segment_size
+        )
+
+    def spider_closed(self, spider):
+        self.writer.flush()
+
+    def process_response(self, request, response, spider):
+        item_id = spider.parse_request_item_id(request)
+        # item pages cut after their header by census crawls could not be parsed whole again
+        if item_id and response.status == 200 and 'download_stopped' not in response.flags:
+            self.writer.add(item_id, response.url, response.body, response.encoding)
+            self.stats.inc_value('archive/responses', spider=spider)
+            self.stats.inc_value('archive/bytes', len(response.body), spider=spider)
+
+        return response
+
+
+class CallbackTimingMiddleware(object):
+    """Adds up the time spider callbacks take on the reactor thread per callback in the crawl stats, with metrics on"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        name = self.callback_name(response, spider)
+        seconds = 0
+        iterator = iter(result)
+        try:
+            while True:
+                # only the time spent producing the output is the callback's, not the time spent consuming it
+                started_at = time.perf_counter()
+                try:
+                    output = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - started_at
+                yield output
+        finally:
+            record_timing(self.stats, CALLBACK_TIMING_STAT, name, seconds, spider)
+
+    @staticmethod
+    def callback_name(response, spider):
+        if response.request is None:
+            return 'parse'
+
+        callback = response.request.callback
+        # crawl spider rules all call back `_callback`, which calls the callback of the rule
+        rule_index = response.meta.get('rule')
+        if getattr(callback, '__name__', None) == '_callback' and rule_index is not None:
+            callback = spider._rules[rule_index].callback
+        return getattr(callback, '__name__', 'parse')
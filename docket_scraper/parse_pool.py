@@ -0,0 +1,95 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy import signals
+from scrapy.http import HtmlResponse
+from twisted.internet import defer, reactor, threads
+
+# parse spider of the worker process, set by `init_worker`
+worker_parse_spider = None
+
+
+def init_worker(spidercls, parser=None):
+    global worker_parse_spider
+    worker_parse_spider = spidercls.parse_spiders[parser] if parser else spidercls.parse_spider
+
+
+def worker_pool(processes, spidercls, parser=None):
+    """
+    Process pool whose workers parse with the parse spider of the spider class, spawned rather than forked since
+    a fork of the crawler copies the locks held by the threads of twisted, pymongo and redis at that moment
+    """
+    return ProcessPoolExecutor(
+        processes, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker,
+        initargs=(spidercls, parser)
+    )
+
+
+def parse_page(url, body, encoding):
+    """Returns the item parsed from the page by the parse spider of the worker and the seconds it took"""
+    started_at = time.perf_counter()
+    item = worker_parse_spider.parse(HtmlResponse(url, body=body, encoding=encoding))
+    return item, time.perf_counter() - started_at
+
+
+class ParsePool(object):
+    """
+    Parses item responses in worker processes off the reactor thread, with at most `max_pending` responses
+    sent to the workers at once, the next ones wait for a free slot
+    """
+
+    def __init__(self, spidercls, parser, processes, max_pending, stats, spider):
+        self.executor = worker_pool(processes, spidercls, parser)
+        self.processes = processes
+        self.slots = defer.DeferredSemaphore(max_pending)
+        self.stats = stats
+        self.spider = spider
+        self.started_at = time.monotonic()
+        self.busy_time = 0
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        parse_pool = cls(
+            type(spider),
+            spider.parser,
+            processes=settings.getint('PARSE_POOL_PROCESSES'),
+            max_pending=settings.getint('PARSE_POOL_MAX_PENDING', 32),
+            stats=spider.crawler.stats,
+            spider=spider,
+        )
+        spider.crawler.signals.connect(parse_pool.close, signal=signals.spider_closed)
+        return parse_pool
+
+    def parse(self, response):
+        """Returns a Deferred firing with the item parsed from the response and the seconds parsing took"""
+        return self.slots.run(self.submit, response.url, response.body, response.encoding)
+
+    def submit(self, url, body, encoding):
+        deferred = defer.Deferred()
+        future = self.executor.submit(parse_page, url, body, encoding)
+        future.add_done_callback(lambda done: reactor.callFromThread(self.parsed, done, deferred))
+        self.stats.max_value('parse_pool/max_in_flight', self.slots.limit - self.slots.tokens, spider=self.spider)
+        self.stats.max_value('parse_pool/max_waiting', len(self.slots.waiting), spider=self.spider)
+        return deferred
+
+    def parsed(self, future, deferred):
+        error = future.exception()
+        if error:
+            self.stats.inc_value('parse_pool/failed', spider=self.spider)
+            deferred.errback(error)
+            return
+
+        item, parse_time = future.result()
+        self.busy_time += parse_time
+        elapsed = time.monotonic() - self.started_at
+        self.stats.inc_value('parse_pool/parsed', spider=self.spider)
+        self.stats.set_value('parse_pool/busy_time', round(self.busy_time, 3), spider=self.spider)
+        self.stats.set_value('parse_pool/utilisation', round(self.busy_time / (elapsed * self.processes), 4),
+                             spider=self.spider)
+        deferred.callback((item, parse_time))
+
+    def close(self, spider):
+        # waiting for the workers to exit would block the reactor
+        return threads.deferToThread(self.executor.shutdown, cancel_futures=True)
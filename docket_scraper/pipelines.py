@@ -5,57 +5,476 @@
 
 
 # useful for handling different item types with a single interface
-import copy
+import time
+from collections import defaultdict
 from datetime import datetime
+from pathlib import Path
 
 import pymongo
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from scrapy_redis.connection import get_redis_from_settings
+from twisted.internet import defer, task, threads
+
+from docket_scraper import signals
+from docket_scraper.change_feed import CHANGE_FEED_FIELD_HASHES_KEY, CHANGE_FEED_STREAM_KEY, RedisChangeFeed
+from docket_scraper.export import DocketExport, item_rows
+from docket_scraper.incremental import docket_content_hash
+from docket_scraper.items import CensusItem, DocketPartItem, docket_part_to_dict, docket_to_dict, item_to_dict
+
+DUPLICATE_KEY_ERROR = 11000
 
 
 class AttachCrawlFieldsPipeline(object):
     def process_item(self, item, spider):
-        item = dict(item)
-        item['crawling_job_id'] = spider.crawling_job_id
-        item['crawler_id'] = spider.crawler_id
-        item['spider_name'] = spider.name
-        item['crawled_at'] = datetime.utcnow().isoformat()
+        if isinstance(item, DocketPartItem):
+            return item
+
+        adapter = ItemAdapter(item)
+        adapter['crawling_job_id'] = spider.crawling_job_id
+        adapter['crawler_id'] = spider.crawler_id
+        adapter['spider_name'] = spider.name
+        # re-parsed items keep the time their archived response was crawled at
+        adapter['crawled_at'] = adapter.get('crawled_at') or datetime.utcnow()
         return item
 
 
 class MongoDBPipeline:
+    """
+    Inserts a document per docket, one at a time on the reactor thread or, with MONGO_BATCH_SIZE set,
+    buffered and written in unordered bulk inserts from a worker thread
+
+    Incremental crawls upsert the dockets in a collection shared by all crawls of a spider instead,
+    writing only the dockets whose content hash has changed
+
+    Parties and entries of split dockets go to the `-parties` and `-entries` sibling collections of the dockets,
+    in the same batches, and census crawls insert their census items in a `census-*` collection of their own
+
+    Once the buffer is full and MONGO_MAX_PENDING_FLUSHES bulk inserts are in flight, every item waits for one of them
+    to finish, so memory stays bounded however fast dockets are parsed
 
-    def __init__(self, mongo_uri, mongo_db):
+    Batches are written again MONGO_WRITE_RETRIES times when the connection fails, documents rejected by the server
+    are logged and counted in `mongodb/failed_documents` while the rest of their batch is written
+    """
+
+    def __init__(self, mongo_uri, mongo_db, stats=None, batch_size=0, flush_interval=0, max_pending_flushes=2,
+                 dockets_collection='dockets-%(spider)s', census_collection='census-%(crawling_job_id)s',
+                 write_retries=3, write_retry_delay=1):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
+        self.dockets_collection = dockets_collection
+        self.census_collection = census_collection
+        self.stats = stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_retries = write_retries
+        self.write_retry_delay = write_retry_delay
+        self.flush_slots = defer.DeferredSemaphore(max_pending_flushes)
+        self.pending_flushes = set()
+        self.buffer = []
+        # the items of the buffered documents, signalled as stored once their documents are written
+        self.buffered_items = []
+        # Deferreds of the items waiting for a flush slot while the buffer is full
+        self.held_items = []
+        self.flush_loop = None
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(
             mongo_uri=crawler.settings.get('MONGO_URI'),
-            mongo_db=crawler.settings.get('MONGO_DATABASE')
+            mongo_db=crawler.settings.get('MONGO_DATABASE'),
+            stats=crawler.stats,
+            batch_size=crawler.settings.getint('MONGO_BATCH_SIZE', 0),
+            flush_interval=crawler.settings.getfloat('MONGO_FLUSH_INTERVAL', 0),
+            max_pending_flushes=crawler.settings.getint('MONGO_MAX_PENDING_FLUSHES', 2),
+            dockets_collection=crawler.settings.get('MONGO_DOCKETS_COLLECTION', 'dockets-%(spider)s'),
+            census_collection=crawler.settings.get('MONGO_CENSUS_COLLECTION', 'census-%(crawling_job_id)s'),
+            write_retries=crawler.settings.getint('MONGO_WRITE_RETRIES', 3),
+            write_retry_delay=crawler.settings.getfloat('MONGO_WRITE_RETRY_DELAY', 1),
         )
 
     def open_spider(self, spider):
         self.client = pymongo.MongoClient(self.mongo_uri)
         self.db = self.client[self.mongo_db]
 
+        self.incremental = getattr(spider, 'incremental', False)
+        if self.incremental:
+            self.collection = self.db[self.dockets_collection % {'spider': spider.name}]
+            self.collection.create_index('id', unique=True)
+        elif getattr(spider, 'census', False):
+            self.collection = self.db[
+                self.census_collection % {'spider': spider.name, 'crawling_job_id': spider.crawling_job_id}
+            ]
+        else:
+            self.collection = self.db[f'job-{spider.crawling_job_id}']
+
+        self.split = getattr(spider, 'split_items', False)
+        if self.split:
+            for kind in ('parties', 'entries'):
+                self.db[f'{self.collection.name}-{kind}'].create_index('docket_id')
+
+        if self.batch_size and self.flush_interval:
+            self.flush_loop = task.LoopingCall(self.flush_when_free, spider)
+            self.flush_loop.start(self.flush_interval, now=False)
+
+    @defer.inlineCallbacks
     def close_spider(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+
+        self.flush(spider)
+        while self.pending_flushes:
+            yield defer.DeferredList(list(self.pending_flushes))
         self.client.close()
 
     def process_item(self, item, spider):
-        payload = copy.deepcopy(dict(item))
+        collection_document = self.to_document(item)
 
-        payload['crawled_at'] = datetime.fromisoformat(payload['crawled_at'])
-        payload['filing_date'] = datetime.fromisoformat(payload['filing_date'])
+        if not self.batch_size:
+            counts, failures = self.write_documents([collection_document])
+            self.record_write(counts, failures, spider)
+            if not failures:
+                spider.crawler.signals.send_catch_log(signals.item_stored, item=item, spider=spider)
+            return item
 
-        for entry in payload['entries']:
-            if not entry['filing_date']:
-                continue
-            entry['filing_date'] = datetime.fromisoformat(entry['filing_date'])
+        return self.buffer_document(collection_document, item, spider)
+
+    def buffer_document(self, collection_document, item, spider):
+        if len(self.buffer) >= self.batch_size:
+            # the buffer is full and every flush slot busy, the item waits for a free slot so no more than
+            # MONGO_MAX_PENDING_FLUSHES + 1 batches are held in memory
+            held = defer.Deferred()
+            self.held_items.append(held)
+            return held.addCallback(lambda _: self.buffer_document(collection_document, item, spider))
+
+        self.buffer.append(collection_document)
+        self.buffered_items.append(item)
+        if len(self.buffer) >= self.batch_size and self.flush_slots.tokens:
+            self.flush(spider)
+        return item
+
+    def flush_when_free(self, spider):
+        # a partially filled buffer waits for the next interval rather than queueing behind the busy slots
+        if self.flush_slots.tokens:
+            self.flush(spider)
+
+    def flush(self, spider):
+        if not self.buffer:
+            return defer.succeed(None)
+
+        documents, self.buffer = self.buffer, []
+        items, self.buffered_items = self.buffered_items, []
+
+        flushed = self.flush_slots.run(threads.deferToThread, self.flush_documents, documents)
+        flushed.addCallbacks(
+            self.record_flush, self.log_flush_failure,
+            callbackArgs=(spider, documents, items), errbackArgs=(spider, len(documents))
+        )
+        self.pending_flushes.add(flushed)
+        flushed.addBoth(self.flush_done, flushed, spider)
+        return flushed
+
+    def flush_documents(self, documents):
+        started_at = time.monotonic()
+        for attempt in range(self.write_retries + 1):
+            try:
+                counts, failures = self.write_documents(documents)
+                break
+            except ConnectionFailure:
+                if attempt == self.write_retries:
+                    raise
+                # the documents inserted before the failure are reported as duplicates by the next attempt
+                time.sleep(self.write_retry_delay * 2 ** attempt)
+        return len(documents), time.monotonic() - started_at, counts, failures
 
-        for party in payload['parties']:
-            if not party['end_date']:
+    def write_documents(self, collection_documents):
+        """
+        Writes the (collection name, document) pairs, inserting the documents of each collection in bulk, and returns
+        the counts for the crawl stats and the (document, error message) pairs of the documents the server rejected
+        """
+        if self.incremental:
+            return self.upsert_changed_documents([document for _, document in collection_documents])
+
+        documents = defaultdict(list)
+        for collection_name, document in collection_documents:
+            documents[collection_name].append(document)
+
+        counts = defaultdict(int)
+        failures = []
+        for collection_name, batch in documents.items():
+            try:
+                self.db[collection_name].insert_many(batch, ordered=False)
+            except BulkWriteError as error:
+                for write_error in error.details['writeErrors']:
+                    if write_error['code'] == DUPLICATE_KEY_ERROR:
+                        counts['mongodb/duplicate_documents'] += 1
+                    else:
+                        failures.append((batch[write_error['index']], write_error['errmsg']))
+        return counts, failures
+
+    def upsert_changed_documents(self, documents):
+        content_hashes = {
+            document['id']: document['content_hash']
+            for document in self.collection.find(
+                {'id': {'$in': [document['id'] for document in documents]}}, {'id': 1, 'content_hash': 1}
+            )
+        }
+
+        counts = {'incremental/new': 0, 'incremental/changed': 0, 'incremental/unchanged': 0}
+        upserts = []
+        upserted_documents = []
+        for document in documents:
+            if document['id'] not in content_hashes:
+                counts['incremental/new'] += 1
+            elif content_hashes[document['id']] != document['content_hash']:
+                counts['incremental/changed'] += 1
+            else:
+                counts['incremental/unchanged'] += 1
                 continue
-            party['end_date'] = datetime.fromisoformat(party['end_date'])
 
-        self.db[f'job-{spider.crawling_job_id}'].insert_one(payload)
+            upserts.append(ReplaceOne({'id': document['id']}, document, upsert=True))
+            upserted_documents.append(document)
+
+        failures = []
+        if upserts:
+            try:
+                self.collection.bulk_write(upserts, ordered=False)
+            except BulkWriteError as error:
+                for write_error in error.details['writeErrors']:
+                    failures.append((upserted_documents[write_error['index']], write_error['errmsg']))
+
+        return counts, failures
+
+    def record_flush(self, result, spider, documents, items):
+        documents_count, latency, counts, failures = result
+        if self.stats:
+            self.stats.inc_value('mongodb/batches')
+            self.stats.inc_value('mongodb/documents', documents_count - len(failures))
+            self.stats.inc_value('mongodb/batch_latency_total', latency)
+            self.stats.max_value('mongodb/batch_latency_max', latency)
+            self.stats.set_value('mongodb/batch_latency_last', latency)
+        self.record_write(counts, failures, spider)
+
+        failed_documents = {id(document) for document, _ in failures}
+        for (_, document), item in zip(documents, items):
+            if id(document) not in failed_documents:
+                spider.crawler.signals.send_catch_log(signals.item_stored, item=item, spider=spider)
+
+    def record_write(self, counts, failures, spider):
+        if self.stats:
+            for key, count in counts.items():
+                self.stats.inc_value(key, count)
+            if failures:
+                self.stats.inc_value('mongodb/failed_documents', len(failures))
+        for document, message in failures:
+            spider.logger.error(f'Unable to insert the document of {document.get("id") or document.get("docket_id")}: '
+                                f'{message}')
+
+    def log_flush_failure(self, failure, spider, documents_count):
+        if self.stats:
+            self.stats.inc_value('mongodb/failed_documents', documents_count)
+        spider.logger.error(f'Unable to insert a batch of {documents_count} documents: {failure.getErrorMessage()}')
+
+    def flush_done(self, result, flushed, spider):
+        self.pending_flushes.discard(flushed)
+        # the slot is free again, the buffer filled meanwhile is written and the held items buffered
+        if len(self.buffer) >= self.batch_size:
+            self.flush(spider)
+        held_items, self.held_items = self.held_items, []
+        for held in held_items:
+            held.callback(None)
+        return result
+
+    def to_document(self, item):
+        """Returns the name of the collection of the item and its document"""
+        if isinstance(item, DocketPartItem):
+            return f'{self.collection.name}-{item.kind}', docket_part_to_dict(item)
+        if isinstance(item, CensusItem):
+            return self.collection.name, item_to_dict(item)
+
+        document = docket_to_dict(item)
+        if self.split:
+            # only the counts of the parties and entries stay in a split docket
+            del document['parties'], document['entries']
+        if self.incremental:
+            document['content_hash'] = docket_content_hash(document)
+        return self.collection.name, document
+
+
+class ColumnarExportPipeline:
+    """
+    Streams dockets into the dockets, parties and entries tables of rolling parquet or gzipped json lines files
+    in `EXPORT_DIR/{crawling_job_id}`, alongside MongoDBPipeline or in place of it
+
+    Rows are buffered and written every EXPORT_BATCH_SIZE items from a worker thread, items are held back while
+    the previous batch is still being written
+    """
+
+    def __init__(self, directory, file_format, batch_size, max_file_rows, max_file_size, stats=None):
+        self.directory = Path(directory)
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.max_file_rows = max_file_rows
+        self.max_file_size = max_file_size
+        self.stats = stats
+        self.write_lock = defer.DeferredLock()
+        self.buffer = defaultdict(list)
+        self.buffered_items = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('EXPORT_ENABLED'):
+            raise NotConfigured
+
+        return cls(
+            directory=settings.get('EXPORT_DIR', 'exports'),
+            file_format=settings.get('EXPORT_FORMAT', 'parquet'),
+            batch_size=settings.getint('EXPORT_BATCH_SIZE', 500),
+            max_file_rows=settings.getint('EXPORT_MAX_FILE_ROWS', 1000000),
+            max_file_size=settings.getint('EXPORT_MAX_FILE_SIZE', 128 * 1024 * 1024),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        self.export = DocketExport(
+            self.directory / str(spider.crawling_job_id),
+            spider.crawler_id,
+            file_format=self.file_format,
+            max_file_rows=self.max_file_rows,
+            max_file_size=self.max_file_size,
+        )
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        yield self.flush(spider)
+        yield self.write_lock.run(threads.deferToThread, self.export.close)
+
+    def process_item(self, item, spider):
+        for table, row in item_rows(item):
+            self.buffer[table].append(row)
+        self.buffered_items += 1
+
+        if self.buffered_items < self.batch_size:
+            return item
+
+        writing = self.write_lock.locked
+        flushed = self.flush(spider)
+        if not writing:
+            return item
+
+        # the previous batch is still being written, hold the item until this one is
+        return flushed.addCallback(lambda _: item)
+
+    def flush(self, spider):
+        if not self.buffered_items:
+            return defer.succeed(None)
+
+        table_rows, self.buffer, self.buffered_items = dict(self.buffer), defaultdict(list), 0
+
+        flushed = self.write_lock.run(threads.deferToThread, self.export.write, table_rows)
+        flushed.addCallbacks(self.record_flush, self.log_flush_failure,
+                             callbackArgs=(table_rows,), errbackArgs=(spider, table_rows))
+        return flushed
+
+    def record_flush(self, result, table_rows):
+        if self.stats:
+            self.stats.inc_value('export/batches')
+            for table, rows in table_rows.items():
+                self.stats.inc_value(f'export/rows/{table}', len(rows))
+
+    def log_flush_failure(self, failure, spider, table_rows):
+        rows_count = sum(len(rows) for rows in table_rows.values())
+        if self.stats:
+            self.stats.inc_value('export/failed_rows', rows_count)
+        spider.logger.error(f'Unable to export a batch of {rows_count} rows: {failure.getErrorMessage()}')
+
+
+class RedisChangeFeedPipeline:
+    """
+    Publishes an event per docket to the change feed stream in redis, buffered and published every
+    CHANGE_FEED_BATCH_SIZE dockets or CHANGE_FEED_FLUSH_INTERVAL seconds from a worker thread
+    """
+
+    def __init__(self, change_feed, batch_size, flush_interval, stats=None):
+        self.change_feed = change_feed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.pending_flushes = set()
+        self.buffer = []
+        self.flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CHANGE_FEED_ENABLED'):
+            raise NotConfigured
+
+        keys = {'spider': crawler.spidercls.name}
+        change_feed = RedisChangeFeed(
+            get_redis_from_settings(settings),
+            stream_key=settings.get('CHANGE_FEED_STREAM_KEY', CHANGE_FEED_STREAM_KEY) % keys,
+            field_hashes_key=settings.get('CHANGE_FEED_FIELD_HASHES_KEY', CHANGE_FEED_FIELD_HASHES_KEY) % keys,
+            maxlen=settings.getint('CHANGE_FEED_MAXLEN', 1000000),
+        )
+        return cls(
+            change_feed,
+            batch_size=settings.getint('CHANGE_FEED_BATCH_SIZE', 100),
+            flush_interval=settings.getfloat('CHANGE_FEED_FLUSH_INTERVAL', 1),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        self.split = getattr(spider, 'split_items', False)
+        self.flush_loop = task.LoopingCall(self.flush, spider)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+
+        self.flush(spider)
+        yield defer.DeferredList(list(self.pending_flushes))
+
+    def process_item(self, item, spider):
+        # census items lack the parties and entries the last published dockets are compared on
+        if isinstance(item, (DocketPartItem, CensusItem)):
+            return item
+
+        docket = docket_to_dict(item)
+        if self.split:
+            # the parts of split dockets are published as their counts, like they are stored
+            del docket['parties'], docket['entries']
+        self.buffer.append(docket)
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush(spider)
         return item
+
+    def flush(self, spider):
+        if not self.buffer:
+            return
+
+        dockets, self.buffer = self.buffer, []
+        flushed = threads.deferToThread(self.change_feed.publish, spider.crawling_job_id, dockets)
+        flushed.addCallbacks(self.record_counts, self.log_flush_failure, errbackArgs=(spider, len(dockets)))
+        self.pending_flushes.add(flushed)
+        flushed.addBoth(self.discard_pending_flush, flushed)
+
+    def record_counts(self, counts):
+        if self.stats:
+            for key, count in counts.items():
+                self.stats.inc_value(key, count)
+
+    def log_flush_failure(self, failure, spider, dockets_count):
+        if self.stats:
+            self.stats.inc_value('change_feed/failed', dockets_count)
+        spider.logger.error(f'Unable to publish the events of {dockets_count} dockets: {failure.getErrorMessage()}')
+
+    def discard_pending_flush(self, result, flushed):
+        self.pending_flushes.discard(flushed)
+        return result
@@ -0,0 +1,241 @@
+import cProfile
+import gzip
+import json
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+from scrapy_redis.connection import get_redis_from_settings
+from twisted.internet import reactor, task, threads
+
+from docket_scraper import parse_pool
+from docket_scraper.parse_pool import worker_pool
+from docket_scraper.signals import item_response_parsed
+
+PROFILING_KEY = '%(spider)s:profiling'
+
+
+def safe_file_name(name):
+    return re.sub(r'[^\w-]+', '_', name).strip('_')
+
+
+def profile_page(url, body, encoding, directory, name, record):
+    """Parses a slow page again under cProfile in the profiling process, saving its profile, the page and its record"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    profiler = cProfile.Profile()
+    profiler.runcall(parse_pool.worker_parse_spider.parse, HtmlResponse(url, body=body, encoding=encoding))
+    profiler.dump_stats(directory / f'{name}.pstats')
+
+    (directory / f'{name}.html.gz').write_bytes(gzip.compress(body))
+    with (directory / 'index.jsonl').open('a') as index:
+        index.write(json.dumps(record) + '\n')
+
+
+class SlowPages(object):
+    """
+    Saves the item responses parsed slower than SLOW_PAGES_THRESHOLD seconds, with a cProfile dump of parsing them
+    again and their url, body size, party and entry counts in `index.jsonl`, at most SLOW_PAGES_MAX of them per crawl
+
+    Pages are parsed again in a process of their own, so profiling them does not hold up the reactor thread
+    """
+
+    def __init__(self, directory, threshold, max_pages, stats):
+        self.directory = Path(directory)
+        self.threshold = threshold
+        self.max_pages = max_pages
+        self.stats = stats
+        self.saved_pages = 0
+        self.executor = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('SLOW_PAGES_ENABLED'):
+            raise NotConfigured
+
+        extension = cls(
+            settings.get('SLOW_PAGES_DIR', 'slow-pages'),
+            threshold=settings.getfloat('SLOW_PAGES_THRESHOLD', 2),
+            max_pages=settings.getint('SLOW_PAGES_MAX', 100),
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(extension.item_response_parsed, signal=item_response_parsed)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_closed(self, spider):
+        # the pages already handed to the profiling process are still saved
+        if self.executor:
+            return threads.deferToThread(self.executor.shutdown)
+
+    def item_response_parsed(self, item, response, parse_time, spider):
+        self.stats.max_value('parse_time/max', parse_time, spider=spider)
+        if parse_time < self.threshold:
+            return
+
+        self.stats.inc_value('slow_pages/count', spider=spider)
+        if self.saved_pages >= self.max_pages:
+            return
+
+        self.saved_pages += 1
+        self.save(item, response, parse_time, spider)
+
+    def save(self, item, response, parse_time, spider):
+        name = safe_file_name(getattr(item, 'id', None) or spider.parse_request_item_id(response.request))
+        record = {
+            'url': response.url,
+            'body_size': len(response.body),
+            'parties': getattr(item, 'parties_count', None) or len(getattr(item, 'parties', None) or ()),
+            'entries': getattr(item, 'entries_count', None) or len(getattr(item, 'entries', None) or ()),
+            'parse_time': round(parse_time, 4),
+            'crawler_id': getattr(spider, 'crawler_id', None),
+            'saved_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'profile': f'{name}.pstats',
+            'page': f'{name}.html.gz',
+        }
+
+        if not self.executor:
+            self.executor = worker_pool(1, type(spider), getattr(spider, 'parser', None))
+        future = self.executor.submit(
+            profile_page, response.url, response.body, response.encoding, str(self.directory), name, record
+        )
+        future.add_done_callback(lambda done: reactor.callFromThread(self.saved, done, record, spider))
+
+    def saved(self, future, record, spider):
+        if future.exception():
+            self.stats.inc_value('slow_pages/failed', spider=spider)
+            spider.logger.error(f'Failed to profile the slow page {record["url"]}: {future.exception()!r}')
+            return
+
+        spider.logger.warning(
+            f'Parsing {record["url"]} took {record["parse_time"]:.2f}s, saved it to {self.directory}/{record["page"]}'
+        )
+
+
+class StackSampler(object):
+    """Samples the stack of a thread every `interval` seconds from a daemon thread, counting the collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.started_at = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        """Writes the stacks in the collapsed format of flamegraph.pl and speedscope"""
+        with open(path, 'w') as collapsed:
+            collapsed.writelines(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of the reactor thread while profiling is on, switched on and off at runtime by SIGUSR1 or by
+    setting and deleting the PROFILING_KEY redis key of the spider for all its crawlers, writing a collapsed stack
+    file in PROFILING_DIR every time it is switched off
+    """
+
+    def __init__(self, server, key, directory, interval, poll_interval):
+        self.server = server
+        self.key = key
+        self.directory = Path(directory)
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.switched_by_signal = False
+        self.switched_by_key = False
+        self.sampler = None
+        self.poll_task = None
+        self.spider = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROFILING_ENABLED'):
+            raise NotConfigured
+
+        extension = cls(
+            get_redis_from_settings(settings),
+            key=settings.get('PROFILING_KEY', PROFILING_KEY),
+            directory=settings.get('PROFILING_DIR', 'profiles'),
+            interval=settings.getfloat('PROFILING_INTERVAL', 0.01),
+            poll_interval=settings.getfloat('PROFILING_POLL_INTERVAL', 5),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.key = self.key % {'spider': spider.name}
+
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.switch_by_signal)
+
+        self.poll_task = task.LoopingCall(self.poll_key)
+        self.poll_task.start(self.poll_interval)
+
+    def spider_closed(self, spider):
+        if self.poll_task.running:
+            self.poll_task.stop()
+        self.switched_by_signal = self.switched_by_key = False
+        self.update()
+
+    def switch_by_signal(self, signum, frame):
+        self.switched_by_signal = not self.switched_by_signal
+        reactor.callFromThread(self.update)
+
+    def poll_key(self):
+        try:
+            self.switched_by_key = bool(self.server.exists(self.key))
+        except Exception as error:
+            self.spider.logger.warning(f'Failed to read the profiling key "{self.key}": {error!r}')
+            return
+
+        self.update()
+
+    def update(self):
+        profiling = self.switched_by_signal or self.switched_by_key
+        if profiling and not self.sampler:
+            self.sampler = StackSampler(threading.get_ident(), self.interval)
+            self.sampler.start()
+            self.spider.logger.info('Sampling profiler started')
+        elif not profiling and self.sampler:
+            self.sampler.stop()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            crawler_id = getattr(self.spider, 'crawler_id', self.spider.name)
+            started_at = datetime.utcfromtimestamp(self.sampler.started_at).strftime('%Y%m%dT%H%M%S')
+            path = self.directory / f'{crawler_id}-{started_at}.collapsed'
+            self.sampler.dump(path)
+            self.sampler = None
+            self.spider.logger.info(f'Sampling profiler stopped, stacks written to {path}')
@@ -0,0 +1,109 @@
+from scrapy_redis.queue import Base, PriorityQueue
+
+DOCKETS = 'dockets'
+LISTINGS = 'listings'
+REQUEST_TYPES = (DOCKETS, LISTINGS)
+
+
+# pops the next request of the first of KEYS that is not empty, the last one only if ARGV[1] is 1, returning the
+# position of its key, 0 if none was popped, the request and the depths of every key before it was popped
+POP_SCRIPT = """
+local depths = {}
+for index, key in ipairs(KEYS) do
+    depths[index] = redis.call('zcard', key)
+end
+
+local popped = 0
+for index = 1, #KEYS do
+    if depths[index] > 0 and (index < #KEYS or ARGV[1] == '1') then
+        popped = index
+        break
+    end
+end
+
+local data = ''
+if popped > 0 then
+    data = redis.call('zrange', KEYS[popped], 0, 0)[1]
+    redis.call('zremrangebyrank', KEYS[popped], 0, 0)
+end
+local result = {popped, data}
+for index, depth in ipairs(depths) do
+    result[index + 2] = depth
+end
+return result
+"""
+
+
+def request_type_key(key, request_type):
+    return f'{key}:{request_type}'
+
+
+class DocketFirstQueue(Base):
+    """
+    Redis queue keeping docket requests and listing requests (search pages and their pagination) in priority queues
+    of their own, so dockets found are scraped before more listing pages are explored
+
+    Dockets are popped whenever any is queued, a listing request only once none is, and then only while fewer than
+    SCHEDULER_DOCKETS_HIGH_WATER_MARK docket requests are in progress in the crawler (not queued in redis), so a
+    listing is requested as the docket backlog runs down and held back while it is still above the mark. A mark of 0
+    pops listings only when no docket is in progress at all
+
+    Requests persisted in the single priority queue of the scheduler key by earlier crawls are popped first, so
+    a crawl resumed after an upgrade drains them before the split queues
+    """
+
+    def __init__(self, server, spider, key, serializer=None):
+        super(DocketFirstQueue, self).__init__(server, spider, key, serializer)
+        self.queues = {
+            request_type: PriorityQueue(server, spider, request_type_key(self.key, request_type), serializer)
+            for request_type in REQUEST_TYPES
+        }
+        self.high_water_mark = spider.settings.getint('SCHEDULER_DOCKETS_HIGH_WATER_MARK', 8)
+        self.stats = spider.crawler.stats
+        # the legacy queue, then the dockets and the listings, checked and popped in one round trip
+        self.pop_keys = [self.key, *(queue.key for queue in self.queues.values())]
+        self.pop_script = server.register_script(POP_SCRIPT)
+
+    def request_type(self, request):
+        return DOCKETS if self.spider.parse_request_item_id(request) else LISTINGS
+
+    def depths(self):
+        """Maps every request type to the number of its pending requests"""
+        pipe = self.server.pipeline()
+        for queue in self.queues.values():
+            pipe.zcard(queue.key)
+        return dict(zip(self.queues, pipe.execute()))
+
+    def dockets_in_progress(self):
+        engine_slot = self.spider.crawler.engine and self.spider.crawler.engine.slot
+        if not engine_slot:
+            return 0
+        return sum(1 for request in engine_slot.inprogress if self.request_type(request) == DOCKETS)
+
+    def __len__(self):
+        pipe = self.server.pipeline()
+        for key in self.pop_keys:
+            pipe.zcard(key)
+        return sum(pipe.execute())
+
+    def push(self, request):
+        self.queues[self.request_type(request)].push(request)
+
+    def pop(self, timeout=0):
+        in_progress = self.dockets_in_progress()
+        pop_listings = in_progress == 0 or in_progress < self.high_water_mark
+        popped, data, _, *depths = self.pop_script(keys=self.pop_keys, args=[int(pop_listings)])
+
+        for request_type, depth in zip(self.queues, depths):
+            self.stats.set_value(f'scheduler/depth/{request_type}', depth, spider=self.spider)
+            self.stats.max_value(f'scheduler/max_depth/{request_type}', depth, spider=self.spider)
+
+        if popped:
+            return self._decode_request(data)
+
+        if depths[-1]:
+            self.stats.inc_value('scheduler/listings_held_back', spider=self.spider)
+        return None
+
+    def clear(self):
+        self.server.delete(self.key, *(queue.key for queue in self.queues.values()))
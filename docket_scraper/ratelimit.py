@@ -0,0 +1,78 @@
+# rates are requests per second, numbers are returned as strings as redis truncates lua numbers to integers
+ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'rate')
+local rate = tonumber(bucket[3]) or tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local tokens = math.min(burst, (tonumber(bucket[1]) or burst) + (now - (tonumber(bucket[2]) or now)) * rate)
+
+-- the token is reserved right away, a negative balance is the wait of the requests queued before this one
+tokens = tokens - 1
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return tostring(wait)
+"""
+
+ADJUST_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'rate', 'decreased_at')
+local rate = tonumber(bucket[1]) or tonumber(ARGV[1])
+
+if ARGV[7] == '1' then
+    if now - (tonumber(bucket[2]) or 0) >= tonumber(ARGV[6]) then
+        rate = math.max(tonumber(ARGV[2]), rate * tonumber(ARGV[5]))
+        redis.call('HSET', KEYS[1], 'decreased_at', now)
+    end
+else
+    rate = math.min(tonumber(ARGV[3]), rate + tonumber(ARGV[4]))
+end
+
+redis.call('HSET', KEYS[1], 'rate', rate)
+return tostring(rate)
+"""
+
+
+class RedisTokenBucket(object):
+    """
+    Token bucket kept in redis and shared by every crawler requesting the same domain, its rate is adjusted
+    with AIMD, raised by `increase` on every clean response and multiplied by `decrease_factor` on congestion,
+    at most once per `decrease_cooldown` seconds so a burst of failures of the same moment backs off once
+    """
+
+    def __init__(self, server, key, initial_rate, min_rate, max_rate, burst=1, increase=0.01, decrease_factor=0.5,
+                 decrease_cooldown=5, ttl=3600):
+        self.server = server
+        self.key = key
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.ttl = ttl
+        self.acquire_script = server.register_script(ACQUIRE_SCRIPT)
+        self.adjust_script = server.register_script(ADJUST_SCRIPT)
+
+    def acquire(self, bucket):
+        """Reserves a token and returns the seconds to wait before using it"""
+        key = self.key % {'bucket': bucket}
+        return float(self.acquire_script(keys=[key], args=[self.initial_rate, self.burst, self.ttl]))
+
+    def adjust(self, bucket, congested):
+        """Raises or lowers the rate of the bucket and returns its new rate"""
+        key = self.key % {'bucket': bucket}
+        args = [
+            self.initial_rate, self.min_rate, self.max_rate, self.increase, self.decrease_factor,
+            self.decrease_cooldown, int(congested)
+        ]
+        return float(self.adjust_script(keys=[key], args=args))
@@ -0,0 +1,112 @@
+"""
+Serializer of the scrapy_redis scheduler queue (SCHEDULER_SERIALIZER) storing the requests of CourtConnect
+docket reports and listing pages as small tagged tuples instead of pickled request dicts
+
+A request of a known shape is stored as `(tag, url_key, priority, overrides)`, the url after the prefix of its
+shape, e.g. the `case_id` of a docket or the search params of a listing page, and only the fields that differ from
+the shape, e.g. the depth, retry times or listing hash in the meta. Every other request is stored as its whole dict
+
+Requests queued by earlier crawls with scrapy_redis.picklecompat, the default serializer, are loaded with it
+"""
+import pickle
+from urllib.parse import unquote
+
+from scrapy_redis import picklecompat
+
+BASE_URL = 'https://courtconnect.courts.delaware.gov/cc/cconnect/'
+DOCKET_REPORT_URL = BASE_URL + 'ck_public_qry_doct.cp_dktrpt_docket_report?case_id='
+LISTING_URL = BASE_URL + 'ck_public_qry_cpty.cp_personcase_srch_details?'
+
+REQUEST_DEFAULTS = {
+    'callback': '_callback',
+    'errback': '_errback',
+    'headers': {},
+    'method': 'GET',
+    'body': b'',
+    'cookies': {},
+    'encoding': 'utf-8',
+    'dont_filter': False,
+    'flags': [],
+    'cb_kwargs': {},
+}
+
+# tag: url prefix and meta of the requests of a rule of `CourtConnectCrawlSpider`
+REQUEST_SHAPES = {
+    'd': (DOCKET_REPORT_URL, {'rule': 0, 'dont_merge_cookies': True}),
+    'l': (LISTING_URL, {'rule': 1, 'dont_merge_cookies': True}),
+}
+
+
+def request_shape(url):
+    for tag, (url_prefix, meta) in REQUEST_SHAPES.items():
+        if url.startswith(url_prefix):
+            return tag, url_prefix, meta
+    return None, None, None
+
+
+def compact_request(request_dict):
+    """Returns the compact tuple of a request dict, or the dict itself if it has no known shape"""
+    tag, url_prefix, shape_meta = request_shape(request_dict['url'])
+    if tag is None:
+        return request_dict
+
+    overrides = {
+        field: value for field, value in request_dict.items()
+        if field in REQUEST_DEFAULTS and value != REQUEST_DEFAULTS[field]
+    }
+
+    meta = request_dict['meta']
+    # a docket without a link text would get one rebuilt from the url
+    has_shape_meta = all(meta.get(key) == value for key, value in shape_meta.items())
+    if has_shape_meta and (tag != 'd' or 'link_text' in meta):
+        extra_meta = {key: value for key, value in meta.items() if key not in shape_meta}
+        # the link text of a docket is its case id, rebuilt from the url
+        if tag == 'd' and extra_meta.get('link_text') == unquote(request_dict['url'][len(url_prefix):]):
+            del extra_meta['link_text']
+        if extra_meta:
+            overrides['+meta'] = extra_meta
+    else:
+        overrides['meta'] = meta
+
+    return tag, request_dict['url'][len(url_prefix):], request_dict['priority'], overrides
+
+
+def is_compact_request(loaded):
+    return isinstance(loaded, tuple) and len(loaded) == 4 and loaded[0] in REQUEST_SHAPES
+
+
+def expand_request(compact):
+    """Returns the request dict of a compact tuple"""
+    if isinstance(compact, dict):
+        return compact
+
+    tag, url_key, priority, overrides = compact
+    url_prefix, shape_meta = REQUEST_SHAPES[tag]
+
+    request_dict = {field: overrides.get(field, value) for field, value in REQUEST_DEFAULTS.items()}
+    request_dict['url'] = url_prefix + url_key
+    request_dict['priority'] = priority
+
+    if 'meta' in overrides:
+        request_dict['meta'] = overrides['meta']
+    else:
+        request_dict['meta'] = dict(shape_meta, **overrides.get('+meta', {}))
+        if tag == 'd' and 'link_text' not in request_dict['meta']:
+            request_dict['meta']['link_text'] = unquote(url_key)
+
+    return request_dict
+
+
+def dumps(request_dict):
+    return pickle.dumps(compact_request(request_dict), protocol=-1)
+
+
+def loads(data):
+    loaded = picklecompat.loads(data)
+    if is_compact_request(loaded):
+        return expand_request(loaded)
+
+    # a request dict of scrapy_redis.picklecompat, queued by a crawl of an earlier version or of another shape
+    if not isinstance(loaded, dict):
+        raise ValueError(f'Unable to load a queued request of type {type(loaded).__name__}')
+    return loaded
@@ -0,0 +1,62 @@
+from scrapy_redis.connection import get_redis_from_settings
+
+from docket_scraper.bloomfilter import RedisBloomFilter
+
+SEEN_ITEMS_KEY = '%(spider)s:%(crawling_job_id)s:seen_items'
+
+
+def get_seen_items_key(spider):
+    seen_items_key = spider.settings.get('SEEN_ITEMS_KEY', SEEN_ITEMS_KEY)
+    return seen_items_key % {'spider': spider.name, 'crawling_job_id': spider.crawling_job_id}
+
+
+class RedisSeenItems(object):
+    """Exact set of seen item ids, shared by all crawlers of a crawling job"""
+
+    def __init__(self, server, key):
+        self.server = server
+        self.key = key
+
+    @classmethod
+    def from_spider(cls, spider):
+        return cls(get_redis_from_settings(spider.settings), key=get_seen_items_key(spider))
+
+    def add(self, item_id):
+        """Returns True if the item id was not seen before"""
+        return self.server.sadd(self.key, item_id) == 1
+
+    def __contains__(self, item_id):
+        return bool(self.server.sismember(self.key, item_id))
+
+    def clear(self):
+        self.server.delete(self.key)
+
+
+class BloomSeenItems(object):
+    """
+    Memory bounded set of seen item ids, an unseen item may be taken as seen with
+    a probability of SEEN_ITEMS_BLOOM_ERROR_RATE once SEEN_ITEMS_BLOOM_CAPACITY ids are added
+    """
+
+    def __init__(self, bloom_filter):
+        self.bloom_filter = bloom_filter
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        bloom_filter = RedisBloomFilter(
+            get_redis_from_settings(settings),
+            key=get_seen_items_key(spider),
+            capacity=settings.getint('SEEN_ITEMS_BLOOM_CAPACITY', 1000000),
+            error_rate=settings.getfloat('SEEN_ITEMS_BLOOM_ERROR_RATE', 0.0001)
+        )
+        return cls(bloom_filter)
+
+    def add(self, item_id):
+        return self.bloom_filter.add(item_id)
+
+    def __contains__(self, item_id):
+        return item_id in self.bloom_filter
+
+    def clear(self):
+        self.bloom_filter.clear()
@@ -0,0 +1,47 @@
+import time
+from collections import Counter
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+from docket_scraper.helpers import strip_text
+
+translator = HTMLTranslator()
+
+
+class CompiledSelectors(object):
+    """
+    Css queries by name, translated to xpath and compiled once, evaluated on the lxml tree parsel has already parsed
+    for a response, or on an element of it, counting the hits, misses and time of every query
+    """
+
+    def __init__(self, css_queries):
+        self.css_queries = dict(css_queries)
+        self.xpaths = {name: etree.XPath(translator.css_to_xpath(css)) for name, css in self.css_queries.items()}
+        self.hits = Counter()
+        self.misses = Counter()
+        self.seconds = Counter()
+
+    def select(self, node, name):
+        """Elements or strings matched by the query on a response or an element, like `.css(query)`"""
+        root = node.selector.root if hasattr(node, 'selector') else node
+
+        started_at = time.perf_counter()
+        results = self.xpaths[name](root)
+        self.seconds[name] += time.perf_counter() - started_at
+
+        (self.hits if results else self.misses)[name] += 1
+        return results
+
+    def texts(self, node, name):
+        """Stripped texts matched by a `::text` query, like `strip_text(.css(query).extract())`"""
+        return strip_text(self.select(node, name))
+
+    def stats(self):
+        """Yields the (stat, value) pairs of the counters of every query evaluated"""
+        for name in self.css_queries:
+            if not self.hits[name] and not self.misses[name]:
+                continue
+            yield f'selectors/{name}/hits', self.hits[name]
+            yield f'selectors/{name}/misses', self.misses[name]
+            yield f'selectors/{name}/seconds', round(self.seconds[name], 6)
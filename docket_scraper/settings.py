@@ -11,6 +11,7 @@ BOT_NAME = 'docket_scraper'
 
 SPIDER_MODULES = ['docket_scraper.spiders']
 NEWSPIDER_MODULE = 'docket_scraper.spiders'
+COMMANDS_MODULE = 'docket_scraper.commands'
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 # USER_AGENT = 'docket_scraper (+http://www.yourdomain.com)'
@@ -44,27 +45,112 @@ DOWNLOAD_DELAY = 0.5
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 SPIDER_MIDDLEWARES = {
-    'docket_scraper.middlewares.RandomUserAgentMiddleware': 600,
+    # closest to the spider, so the output of the other middlewares is not timed as the callback's, METRICS_ENABLED only
+    'docket_scraper.middlewares.CallbackTimingMiddleware': 990,
 }
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    'docket_scraper.middlewares.DocketScraperDownloaderMiddleware': 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    # before UserAgentMiddleware, which keeps the user agent already set
+    'docket_scraper.middlewares.RandomUserAgentMiddleware': 400,
+    # sees 503s before RetryMiddleware turns them into retries
+    'docket_scraper.middlewares.RedisRateLimitMiddleware': 580,
+    # takes 503s and timeouts over from RetryMiddleware, after the rate limit has seen them
+    'docket_scraper.middlewares.DelayedRetryMiddleware': 570,
+    # archives responses after HttpCompressionMiddleware has decompressed them
+    'docket_scraper.middlewares.ResponseArchiveMiddleware': 560,
+}
+
+# User agents RandomUserAgentMiddleware picks from, filtered from `random_user_agent` once by the useragent_*
+# spider attributes and loaded from this file by every crawler with the same filters, relative to the working directory
+USER_AGENT_CACHE_PATH = 'cache/user_agents.json'
+# Spread requests over this many user agent identities, each with its own keep-alive connections, 0 to pick a
+# random user agent for every request. Crawl spiders download http and https with IdentityHTTP11DownloadHandler
+# only when it is set
+USER_AGENT_IDENTITIES = 0
+# Idle keep-alive connections kept per identity and host
+USER_AGENT_IDENTITY_CONNECTIONS = 1
+
+# Retry 503s and timeouts from a redis sorted set shared by all crawlers, after DELAYED_RETRY_BASE_DELAY * 2 ^ n
+# seconds (n the retries so far, at most DELAYED_RETRY_MAX_DELAY, with jitter), requests failing more than
+# DELAYED_RETRY_MAX_TIMES times are pushed to DELAYED_RETRY_DEAD_LETTER_KEY
+DELAYED_RETRY_ENABLED = False
+DELAYED_RETRY_KEY = '%(spider)s:delayed_retries'
+DELAYED_RETRY_DEAD_LETTER_KEY = '%(spider)s:dead_letter'
+DELAYED_RETRY_MAX_TIMES = 8
+DELAYED_RETRY_BASE_DELAY = 5
+DELAYED_RETRY_MAX_DELAY = 600
+# Seconds between two claims of the due requests, and the most requests a crawler claims at once
+DELAYED_RETRY_POLL_INTERVAL = 1
+DELAYED_RETRY_CLAIM_COUNT = 50
+
+# Keep the docket report responses in gzipped warc segments to re-parse them with `scrapy reparse <spider>`
+RESPONSE_ARCHIVE_ENABLED = False
+RESPONSE_ARCHIVE_DIR = 'archive'
+# Responses compressed together in one gzip member of a segment
+RESPONSE_ARCHIVE_BATCH_SIZE = 50
+# Bytes after which a crawler starts a new segment
+RESPONSE_ARCHIVE_SEGMENT_SIZE = 100 * 1024 * 1024
+
+# Rate of requests per second to a domain shared by all crawlers through redis, raised by RATE_LIMIT_INCREASE on
+# every clean response and multiplied by RATE_LIMIT_DECREASE_FACTOR on 503s and timeouts
+RATE_LIMIT_ENABLED = False
+RATE_LIMIT_INITIAL_RATE = 4
+RATE_LIMIT_MIN_RATE = 0.5
+RATE_LIMIT_MAX_RATE = 16
+RATE_LIMIT_BURST = 2
+RATE_LIMIT_INCREASE = 0.01
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+# Seconds before backing off again, so a burst of 503s from the same moment halves the rate once
+RATE_LIMIT_DECREASE_COOLDOWN = 5
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-# }
+EXTENSIONS = {
+    'docket_scraper.metrics.PrometheusMetrics': 500,
+    'docket_scraper.profiling.SlowPages': 500,
+    'docket_scraper.profiling.SamplingProfiler': 500,
+    'docket_scraper.metrics.RedisCrawlStats': 500,
+}
 
+# Serve the metrics of every crawler in the prometheus format on http://<crawler>:<port>/metrics, on the first free
+# port of METRICS_PORT. Crawl spiders then add up the time spent in callbacks and item pipelines in the crawl stats too,
+# the item pipelines timed by docket_scraper.metrics.TimedItemPipelineManager as their ITEM_PROCESSOR
+METRICS_ENABLED = False
+METRICS_PORT = [9410, 9420]
+METRICS_HOST = '0.0.0.0'
+# Seconds over which the items per second metric is measured
+METRICS_ITEMS_RATE_INTERVAL = 30
+# Seconds between the snapshots of the crawl stats and redis sizes the metrics are served from
+METRICS_SNAPSHOT_INTERVAL = 5
+# Write the final crawl stats of every crawler to this redis hash of its crawling job, kept for CRAWL_STATS_TTL seconds,
+# switched on for its workers by the launcher
+CRAWL_STATS_ENABLED = False
+CRAWL_STATS_KEY = '%(spider)s:%(crawling_job_id)s:crawl-stats'
+CRAWL_STATS_TTL = 7 * 24 * 60 * 60
+# Save the item responses parsed slower than SLOW_PAGES_THRESHOLD seconds with a cProfile dump of their parsing
+SLOW_PAGES_ENABLED = False
+SLOW_PAGES_THRESHOLD = 2
+SLOW_PAGES_DIR = 'slow-pages'
+SLOW_PAGES_MAX = 100
+# Sample the stacks of a crawler while `kill -USR1 <pid>` switched it on or the PROFILING_KEY redis key is set,
+# writing them to PROFILING_DIR when switched off
+PROFILING_ENABLED = False
+PROFILING_KEY = '%(spider)s:profiling'
+PROFILING_DIR = 'profiles'
+# Seconds between stack samples
+PROFILING_INTERVAL = 0.01
+# Seconds between checks of the redis key
+PROFILING_POLL_INTERVAL = 5
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     # 'docket_scraper.pipelines.DocketScraperPipeline': 300,
     'docket_scraper.pipelines.AttachCrawlFieldsPipeline': 300,
     'docket_scraper.pipelines.MongoDBPipeline': 500,
+    'docket_scraper.pipelines.RedisChangeFeedPipeline': 510,
+    'docket_scraper.pipelines.ColumnarExportPipeline': 550,
     # 'scrapy_redis.pipelines.RedisPipeline': 400,
 }
 
@@ -91,9 +177,79 @@ ITEM_PIPELINES = {
 
 
 DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
+# Keeps request fingerprints in a memory bounded bloom filter per crawling job instead of a redis set,
+# `scrapy dupefilter_stats <spider> <crawling_job_id>` prints its fill ratio and memory
+# DUPEFILTER_CLASS = "docket_scraper.dupefilter.BloomDupeFilter"
+BLOOM_DUPEFILTER_KEY = '%(spider)s:%(crawling_job_id)s:bloom-dupefilter'
+BLOOM_DUPEFILTER_INITIAL_CAPACITY = 1000000
+BLOOM_DUPEFILTER_ERROR_RATE = 0.0001
+# Seconds the bloom filter is kept after its last added request, kept forever if 0
+BLOOM_DUPEFILTER_TTL = 0
 SCHEDULER = "scrapy_redis.scheduler.Scheduler"
 SCHEDULER_PERSIST = True
+# Queued dockets are always requested before listing pages. A listing page is held back while
+# SCHEDULER_DOCKETS_HIGH_WATER_MARK or more docket requests are in progress in this crawler, downloading or being
+# parsed, the depth of the dockets queue in redis does not count. Requests queued by earlier versions under the
+# single `<spider>:requests` key are popped first
+SCHEDULER_QUEUE_CLASS = 'docket_scraper.queue.DocketFirstQueue'
+SCHEDULER_DOCKETS_HIGH_WATER_MARK = 8
+# Stores docket and listing requests in the queue as small tuples instead of pickled request dicts, the pickled
+# request dicts queued by earlier versions are still loaded
+SCHEDULER_SERIALIZER = 'docket_scraper.request_serializer'
 REDIS_HOST = 'docket-redis'
 
+# Dockets already seen by any crawler of a crawling job are dropped before being requested,
+# use 'docket_scraper.seen_items.BloomSeenItems' to bound the redis memory used for it
+SEEN_ITEMS_CLASS = 'docket_scraper.seen_items.RedisSeenItems'
+SEEN_ITEMS_KEY = '%(spider)s:%(crawling_job_id)s:seen_items'
+SEEN_ITEMS_BLOOM_CAPACITY = 1000000
+SEEN_ITEMS_BLOOM_ERROR_RATE = 0.0001
+
+# Worker processes parsing docket reports off the reactor thread, parsed on the reactor thread if 0
+PARSE_POOL_PROCESSES = 0
+# Responses sent to the parse pool at once, the next ones wait for a free slot
+PARSE_POOL_MAX_PENDING = 32
+
+# Store the parties and entries of dockets in the `job-{id}-parties` and `job-{id}-entries` collections, streamed
+# as they are parsed, the dockets keep only their counts. Ignored by incremental crawls
+SPLIT_DOCKETS = False
+
+# Publish an event per docket to the CHANGE_FEED_STREAM_KEY redis stream, capped at about CHANGE_FEED_MAXLEN events,
+# with its case id, job id, content hash and the fields changed since the docket was last published
+CHANGE_FEED_ENABLED = False
+CHANGE_FEED_STREAM_KEY = '%(spider)s:changes'
+CHANGE_FEED_FIELD_HASHES_KEY = '%(spider)s:docket-field-hashes'
+CHANGE_FEED_MAXLEN = 1000000
+CHANGE_FEED_BATCH_SIZE = 100
+CHANGE_FEED_FLUSH_INTERVAL = 1
+
+# Export dockets, parties and entries to rolling files in EXPORT_DIR/{crawling_job_id}, 'parquet' or 'jsonl'
+EXPORT_ENABLED = False
+EXPORT_DIR = 'exports'
+EXPORT_FORMAT = 'parquet'
+# Items buffered before their rows are written, a parquet row group per table
+EXPORT_BATCH_SIZE = 500
+# Rows or bytes after which a file is closed, listed in the manifest.jsonl of the job, and a new one started
+EXPORT_MAX_FILE_ROWS = 1000000
+EXPORT_MAX_FILE_SIZE = 128 * 1024 * 1024
+
 MONGO_URI = 'mongodb://docket-mongo-db:27017'
 MONGO_DATABASE = 'dockets-warehouse'
+# Collection keyed by case id that incremental crawls (`-a incremental=true`) upsert changed dockets into
+MONGO_DOCKETS_COLLECTION = 'dockets-%(spider)s'
+# Collection the census items of census crawls (`-a census=true`) are inserted into
+MONGO_CENSUS_COLLECTION = 'census-%(crawling_job_id)s'
+# Indexed collection the job collections are consolidated into by `python -m docket_scraper.docket_store consolidate`,
+# and the collection recording the jobs already consolidated
+MONGO_CONSOLIDATED_COLLECTION = 'dockets'
+MONGO_CONSOLIDATED_JOBS_COLLECTION = 'consolidated-jobs'
+# Buffer dockets and write them in unordered bulk inserts off the reactor thread, e.g. 100, insert one by one if 0
+MONGO_BATCH_SIZE = 0
+# Seconds after which a partially filled buffer is written anyway
+MONGO_FLUSH_INTERVAL = 5
+# Bulk inserts in flight, once they are all busy and the buffer is full every item is held back until one finishes
+MONGO_MAX_PENDING_FLUSHES = 2
+# Times a batch is written again when the connection to MongoDB fails, waiting MONGO_WRITE_RETRY_DELAY seconds
+# doubled on every retry, before its documents are counted in mongodb/failed_documents
+MONGO_WRITE_RETRIES = 3
+MONGO_WRITE_RETRY_DELAY = 1
@@ -0,0 +1,5 @@
+# sent with the item, its response and the seconds its parse spider took when an item response is parsed
+item_response_parsed = object()
+
+# sent with the item by MongoDBPipeline once the document of an item is written
+item_stored = object()
@@ -1,11 +1,39 @@
+import dataclasses
+import time
 import uuid
+import weakref
+from collections import Counter
 
 from scrapy import Spider
+from scrapy.exceptions import StopDownload
+from scrapy.signals import bytes_received
+from scrapy.utils.misc import arg_to_iter, load_object
 from scrapy_redis.spiders import RedisCrawlSpider
 
+from docket_scraper import signals
+from docket_scraper.incremental import ClosedListings
+from docket_scraper.items import PART_KINDS, DocketPartItem, iter_docket_parts
+from docket_scraper.parse_pool import ParsePool
+from docket_scraper.selectors import CompiledSelectors
+
 
 class BaseParseSpider(Spider):
     name = 'base-parse'
+    # css queries by name, compiled once per class and evaluated with `select` and `select_texts`
+    selectors = {}
+    compiled_selectors = CompiledSelectors({})
+    # bytes pattern of where the header of an item page ends, only the header is downloaded and parsed by census crawls
+    header_end = None
+
+    def __init_subclass__(cls, **kwargs):
+        super(BaseParseSpider, cls).__init_subclass__(**kwargs)
+        cls.compiled_selectors = CompiledSelectors(cls.selectors)
+
+    def select(self, node, name):
+        return self.compiled_selectors.select(node, name)
+
+    def select_texts(self, node, name):
+        return self.compiled_selectors.texts(node, name)
 
     def parse(self, response, **kwargs):
         raise NotImplementedError
@@ -13,36 +41,252 @@ class BaseParseSpider(Spider):
     def parse_id(self, response):
         raise NotImplementedError
 
+    def iter_parse(self, response):
+        """Yields the item without its parts, then its parts as they are parsed"""
+        raise NotImplementedError
+
+    def parse_census(self, response):
+        """Returns the census item of the page, parsed from its header only"""
+        raise NotImplementedError
+
+    def header_response(self, response):
+        """The response cut where its header ends, so the rest of the page is not parsed at all"""
+        match = self.header_end and self.header_end.search(response.body)
+        return response.replace(body=response.body[:match.start()]) if match else response
+
 
 class BaseCrawlSpider(RedisCrawlSpider):
     name = 'base-crawl'
     parse_spider = BaseParseSpider()
+    # alternative parse spiders selectable with the "parser" argument, e.g. `-a parser=table-walk`
+    parse_spiders = {}
 
-    def __init__(self, crawling_job_id=None, *args, **kwargs):
+    def __init__(self, crawling_job_id=None, parser=None, incremental=False, census=False, *args, **kwargs):
         super(BaseCrawlSpider, self).__init__(*args, **kwargs)
 
         if not crawling_job_id:
             raise AttributeError('"crawling_job_id" is a required parameter.')
 
+        if parser:
+            if parser not in self.parse_spiders:
+                raise AttributeError(f'"parser" must be one of {sorted(self.parse_spiders)}.')
+            self.parse_spider = self.parse_spiders[parser]
+
+        self.parser = parser
         self.crawling_job_id = crawling_job_id
         self.crawler_id = str(uuid.uuid4())
-        self.seen_item_ids = set()
+        # refreshes the dockets of previous crawls instead of collecting them all again, `-a incremental=true`
+        self.incremental = str(incremental).lower() in ('true', '1', 'yes')
+        # keeps only the header fields of the dockets, taken from the listing rows when they have them all,
+        # `-a census=true`
+        self.census = str(census).lower() in ('true', '1', 'yes')
+
+    @classmethod
+    def update_settings(cls, settings):
+        super(BaseCrawlSpider, cls).update_settings(settings)
+        if settings.getint('USER_AGENT_IDENTITIES'):
+            # the connections of every user agent identity are kept apart, see `IdentityHTTP11DownloadHandler`
+            download_handlers = settings.getdict('DOWNLOAD_HANDLERS')
+            for scheme in ('http', 'https'):
+                download_handlers.setdefault(scheme, 'docket_scraper.downloadhandlers.IdentityHTTP11DownloadHandler')
+            settings.set('DOWNLOAD_HANDLERS', download_handlers, priority='spider')
+        if settings.getbool('METRICS_ENABLED'):
+            settings.set('ITEM_PROCESSOR', 'docket_scraper.metrics.TimedItemPipelineManager', priority='spider')
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(BaseCrawlSpider, cls).from_crawler(crawler, *args, **kwargs)
+
+        seen_items_cls = load_object(
+            crawler.settings.get('SEEN_ITEMS_CLASS', 'docket_scraper.seen_items.RedisSeenItems')
+        )
+        spider.seen_items = seen_items_cls.from_spider(spider)
+        # items are taken as seen once stored, a request that failed or an item that was not written is crawled again
+        crawler.signals.connect(spider.item_stored, signal=signals.item_stored)
+
+        if spider.census:
+            if spider.incremental:
+                spider.logger.warning('"incremental" is ignored by census crawls, census items are inserted')
+                spider.incremental = False
+
+            if spider.parse_spider.header_end:
+                # the last bytes received of every item page being downloaded
+                spider.census_download_tails = weakref.WeakKeyDictionary()
+                crawler.signals.connect(spider.stop_census_download, signal=bytes_received)
+
+        if spider.incremental:
+            spider.closed_listings = ClosedListings.from_spider(spider)
+            # listing rows of closed items parsed but not stored yet, recorded once their item is written
+            spider.pending_closed_listings = {}
+
+        # parses item responses in worker processes instead of the reactor thread, `-s PARSE_POOL_PROCESSES=4`
+        spider.parse_pool = None
+        if crawler.settings.getint('PARSE_POOL_PROCESSES') and not spider.census:
+            spider.parse_pool = ParsePool.from_spider(spider)
+
+        # yields the parties and entries of dockets as items of their own, `-s SPLIT_DOCKETS=true`
+        spider.split_items = crawler.settings.getbool('SPLIT_DOCKETS')
+        if spider.split_items and spider.incremental:
+            spider.logger.warning('SPLIT_DOCKETS is ignored by incremental crawls, dockets are upserted whole')
+            spider.split_items = False
+        if spider.split_items and spider.census:
+            spider.logger.warning('SPLIT_DOCKETS is ignored by census crawls, census items have no parts')
+            spider.split_items = False
+
+        return spider
 
     def parse(self, response, **kwargs):
+        if self.census:
+            yield from self.parse_listing_census_items(response)
         yield from self._parse_response(response, None, {})
 
+    def parse_listing_census_items(self, response):
+        """
+        Yields the census items of the listing rows having every census field, taken as seen once parsed so their
+        item requests are dropped and their pages never downloaded
+        """
+        for item in self.parse_listing_census(response):
+            if not self.seen_items.add(item.id):
+                continue
+
+            self.crawler.stats.inc_value('census/from_listing', spider=self)
+            yield item
+
+    def parse_listing_census(self, response):
+        """Returns the census items of a listing page, none if its rows lack any census field"""
+        raise NotImplementedError
+
+    def stop_census_download(self, data, request, spider):
+        """Stops downloading an item page once its header is received, the response has the bytes received"""
+        if not self.parse_request_item_id(request):
+            return
+
+        # the end of the previous chunk is kept in case the header end is split across chunks
+        received = self.census_download_tails.get(request, b'') + data
+        if self.parse_spider.header_end.search(received):
+            self.census_download_tails.pop(request, None)
+            self.crawler.stats.inc_value('census/stopped_downloads', spider=self)
+            raise StopDownload(fail=False)
+
+        self.census_download_tails[request] = received[-256:]
+
+    def closed(self, reason):
+        # selectors evaluated on the reactor thread, the ones of parse pool workers are counted in their processes
+        for stat, value in self.parse_spider.compiled_selectors.stats():
+            self.crawler.stats.set_value(stat, value, spider=self)
+
     def parse_item_id(self, response):
         return self.parse_spider.parse_id(response)
 
+    def parse_request_item_id(self, request):
+        raise NotImplementedError
+
+    def parse_listing_hash(self, request, response):
+        raise NotImplementedError
+
+    def is_closed_item(self, item):
+        raise NotImplementedError
+
     def parse_item(self, response):
-        item_id = self.parse_item_id(response)
-        if self.is_seen_item(item_id):
-            return
+        if self.census:
+            self.crawler.stats.inc_value('census/from_item_page', spider=self)
+            return self.parse_spider.parse_census(response)
+
+        if self.split_items:
+            return self.parse_split_item(response)
+
+        started_at = time.perf_counter()
+        item = self.parse_spider.parse(response)
+        return self.item_parsed(item, time.perf_counter() - started_at, response)
+
+    def parse_split_item(self, response):
+        """
+        Yields the parts of the item one by one as they are parsed, then the item with only their counts,
+        so the memory a long docket takes is not held until it is parsed whole
+        """
+        parse_time = 0
+        started_at = time.perf_counter()
+        parts = self.parse_spider.iter_parse(response)
+        item = next(parts)
+
+        counts = Counter()
+        for part in parts:
+            kind = PART_KINDS[type(part)]
+            parse_time += time.perf_counter() - started_at
+            yield DocketPartItem(docket_id=item.id, kind=kind, index=counts[kind], part=part)
+            counts[kind] += 1
+            started_at = time.perf_counter()
+
+        parse_time += time.perf_counter() - started_at
+        item.parties_count, item.entries_count = counts['parties'], counts['entries']
+
+        yield from arg_to_iter(self.item_parsed(item, parse_time, response))
+
+    def parse_item_in_pool(self, response):
+        """Returns a Deferred of the item parsed from the response by the parse pool"""
+        return self.parse_pool.parse(response).addCallback(lambda parsed: self.item_parsed(*parsed, response))
 
-        return self.parse_spider.parse(response)
+    def item_parsed(self, item, parse_time, response):
+        self.crawler.signals.send_catch_log(
+            signals.item_response_parsed, item=item, response=response, parse_time=parse_time, spider=self
+        )
+
+        listing = response.meta.get('listing')
+        if self.incremental and listing and self.is_closed_item(item):
+            self.pending_closed_listings[item.id] = listing
+
+        if self.split_items and item.parties_count is None:
+            # dockets parsed whole by the parse pool are split once parsed, streamed ones are split already
+            return self.split_item(item)
+
+        return item
+
+    def split_item(self, item):
+        return [
+            *iter_docket_parts(item),
+            dataclasses.replace(
+                item, parties=[], entries=[], parties_count=len(item.parties), entries_count=len(item.entries)
+            ),
+        ]
+
+    def process_item_request(self, request, response):
+        """Drops a request to an item already seen by any crawler of the crawling job before it is scheduled"""
+        item_id = self.parse_request_item_id(request)
+        if item_id and self.is_seen_item(item_id):
+            self.crawler.stats.inc_value('seen_items/dropped', spider=self)
+            return None
+
+        if self.incremental and item_id:
+            request = self.process_incremental_item_request(item_id, request, response)
+
+        if request and self.parse_pool:
+            request = request.replace(callback=self.parse_item_in_pool)
+
+        return request
+
+    def process_incremental_item_request(self, item_id, request, response):
+        """Drops a request to a closed item whose listing row is unchanged since it was last crawled"""
+        listing_hash = self.parse_listing_hash(request, response)
+        if not listing_hash:
+            return request
+
+        if self.closed_listings.is_unchanged(item_id, listing_hash):
+            self.crawler.stats.inc_value('incremental/skipped_closed', spider=self)
+            return None
+
+        request.meta['listing'] = {'item_id': item_id, 'hash': listing_hash}
+        return request
 
     def is_seen_item(self, item_id):
-        if item_id in self.seen_item_ids:
-            return True
+        return item_id in self.seen_items
+
+    def item_stored(self, item, spider):
+        # the parts of split dockets have no id of their own
+        item_id = getattr(item, 'id', None)
+        if not item_id:
+            return
 
-        self.seen_item_ids.add(item_id)
+        self.seen_items.add(item_id)
+        listing = self.incremental and self.pending_closed_listings.pop(item_id, None)
+        if listing:
+            self.closed_listings.add(listing['item_id'], listing['hash'])
@@ -3,149 +3,247 @@ from datetime import datetime
 
 from scrapy.linkextractors import LinkExtractor
 from scrapy.spiders import Rule
-from w3lib.url import url_query_cleaner
-
-from docket_scraper.helpers import strip_text, reset_cookies
+from w3lib.url import url_query_cleaner, url_query_parameter
+
+from docket_scraper.helpers import (
+    strip_text, reset_cookies, find_anchor_tables, index_label_cells, label_cell_texts, index_row_cells,
+    previous_element_sibling
+)
+from docket_scraper.incremental import listing_hash
+from docket_scraper.items import CensusItem, DocketItem, PartyItem, EntryItem
 from docket_scraper.spiders.base_spider import BaseParseSpider, BaseCrawlSpider
 
 
 class CourtConnectParseParseSpider(BaseParseSpider):
     name = 'court-connect-parse'
+    selectors = {
+        'id': '[NAME="selection"] + table td:contains("Case ID") + td::text',
+        'start_date': '[NAME="selection"] + table td:contains("Docket Start Date") + td::text',
+        'end_date': '[NAME="selection"] + table td:contains("Docket Ending Date") + td::text',
+        'title': '[NAME="description"] + table td:contains("Case ID") + td::text',
+        'filing_date': '[NAME="description"] + table td:contains("Filing Date") + td::text',
+        'type': '[NAME="description"] + table td:contains("Type") + td::text',
+        'status': '[NAME="description"] + table td:contains("Status") + td::text',
+        'party_rows_1': '[NAME="parties"] + table tr[valign]:not([align])',
+        'party_rows_2': '[NAME="parties"] + table tr[valign][align]',
+        'entry_rows_1': '[NAME="dockets"] + table tr[valign]',
+        'entry_rows_2': '[NAME="dockets"] + table tr[valign] + tr',
+        # texts of a column of a party or entry row
+        **{f'cell_{column}': f'td:nth-child({column}) ::text' for column in range(1, 7)},
+    }
+    # the selection and description tables come before the parties anchor
+    header_end = re.compile(rb'<a\s[^>]*name\s*=\s*["\']?parties\b', re.I)
 
     def parse(self, response, **kwargs):
-        docket = {
-            'url': response.url,
-            'id': self.parse_id(response),
-            'start_date': self.parse_start_date(response),
-            'end_date': self.parse_end_date(response),
-            'title': self.parse_title(response),
-            'filing_date': self.parse_filing_date(response),
-            'type': self.parse_type(response),
-            'status': self.parse_status(response),
-            'parties': self.parse_parties(response),
-            'entries': self.parse_entries(response),
-        }
-
-        for entry in docket['entries']:
-            if not entry['party']:
-                continue
+        parts = self.iter_parse(response)
+        docket = next(parts)
+        for part in parts:
+            (docket.parties if isinstance(part, PartyItem) else docket.entries).append(part)
 
-            party = next(
-                filter(lambda party: entry['party'] == party['name'], docket['parties']),
-                None
-            )
+        return docket
 
-            if not party:
-                raise Exception('Unable to find entry party in corresponding parties')
+    def iter_parse(self, response):
+        """
+        Yields the docket without its parties and entries, then its parties and, one by one as they are parsed,
+        its entries
+        """
+        yield DocketItem(
+            url=response.url,
+            id=self.parse_id(response),
+            start_date=self.parse_start_date(response),
+            end_date=self.parse_end_date(response),
+            title=self.parse_title(response),
+            filing_date=self.parse_filing_date(response),
+            type=self.parse_type(response),
+            status=self.parse_status(response),
+        )
+
+        parties = self.parse_parties(response)
+        yield from parties
+        yield from self.link_entry_parties(parties, self.parse_entries(response))
+
+    def parse_census(self, response):
+        response = self.header_response(response)
+        return CensusItem(
+            url=response.url,
+            id=self.parse_id(response),
+            title=self.parse_title(response),
+            filing_date=self.parse_filing_date(response),
+            type=self.parse_type(response),
+            status=self.parse_status(response),
+        )
+
+    def link_entry_parties(self, parties, entries):
+        party_ids = {}
+        for party in parties:
+            party_ids.setdefault(party.name, party.id)
 
-            entry['party'] = party['id']
+        for entry in entries:
+            if entry.party:
+                if entry.party not in party_ids:
+                    raise Exception('Unable to find entry party in corresponding parties')
 
-        return docket
+                entry.party = party_ids[entry.party]
+
+            yield entry
 
     def parse_id(self, response):
-        item_id_css = '[NAME="selection"] + table td:contains("Case ID") + td::text'
-        return strip_text(response.css(item_id_css).extract())[0]
+        return self.clean_id(self.select_texts(response, 'id'))
 
     def parse_start_date(self, response):
-        date_css = '[NAME="selection"] + table td:contains("Docket Start Date") + td::text'
-        return next(iter(strip_text(response.css(date_css).extract())), None)
+        return next(iter(self.select_texts(response, 'start_date')), None)
 
     def parse_end_date(self, response):
-        date_css = '[NAME="selection"] + table td:contains("Docket Ending Date") + td::text'
-        return next(iter(strip_text(response.css(date_css).extract())), None)
+        return next(iter(self.select_texts(response, 'end_date')), None)
 
     def parse_title(self, response):
-        title_css = '[NAME="description"] + table td:contains("Case ID") + td::text'
-        raw_title = strip_text(response.css(title_css).extract())[0]
-        item_id = self.parse_id(response)
-        return strip_text(re.sub(rf'^({item_id}|\s|-)*', '', raw_title, flags=re.S))
+        return self.clean_title(self.select_texts(response, 'title'), self.parse_id(response))
 
     def parse_filing_date(self, response):
-        date_css = '[NAME="description"] + table td:contains("Filing Date") + td::text'
-        filing_date = strip_text(response.css(date_css).extract())[0]
-        filing_date = re.sub(r'\s*,\s*|(st|nd|rd|th),', ',', filing_date)
-        return datetime.strptime(filing_date, '%A,%B %d, %Y').isoformat()
+        return self.clean_filing_date(self.select_texts(response, 'filing_date'))
 
     def parse_type(self, response):
-        type_css = '[NAME="description"] + table td:contains("Type") + td::text'
-        return strip_text(response.css(type_css).extract())[0]
+        return self.select_texts(response, 'type')[0]
 
     def parse_status(self, response):
-        status_css = '[NAME="description"] + table td:contains("Status") + td::text'
-        raw_status = strip_text(response.css(status_css).extract())[0]
-        return strip_text(raw_status.split('-'))[0]
+        return self.clean_status(self.select_texts(response, 'status'))
 
     def parse_parties(self, response):
-        css_1 = '[NAME="parties"] + table tr[valign]:not([align])'
-        css_2 = '[NAME="parties"] + table tr[valign][align]'
-
-        parties = []
-        for party_selector_1, party_selector_2 in zip(response.css(css_1), response.css(css_2)):
-            party_sequence = strip_text(party_selector_1.css('td:nth-child(1) ::text').extract())
-            party_associates = strip_text(party_selector_1.css('td:nth-child(2) ::text').extract())
-            party_type = strip_text(party_selector_1.css('td:nth-child(4) ::text').extract())
-            party_id = strip_text(party_selector_1.css('td:nth-child(5) ::text').extract())
-            party_name = strip_text(party_selector_1.css('td:nth-child(6) ::text').extract())
-            party_address = '\n'.join(strip_text(party_selector_2.css('td:nth-child(2) ::text').extract()))
-            party_aliases = filter(
-                lambda t: t.lower() != 'none',
-                strip_text(party_selector_2.css('td:nth-child(4) ::text').extract())
-            )
-
-            party_end_date = next(iter(strip_text(party_selector_1.css('td:nth-child(3) ::text').extract())), None)
-            if party_end_date:
-                party_end_date = datetime.strptime(party_end_date, '%d-%b-%Y').isoformat()
-
-            party = {
-                'sequence': next(iter(party_sequence), None),
-                'associates': next(iter(party_associates), None),
-                'end_date': party_end_date,
-                'type': next(iter(party_type), None),
-                'id': next(iter(party_id), None),
-                'name': next(iter(party_name), None),
-                'address': party_address if party_address.lower() != 'unavailable' else None,
-                'aliases': next(party_aliases, None)
-            }
-
-            parties.append(party)
+        sequenced_parties = []
+        party_rows = zip(self.select(response, 'party_rows_1'), self.select(response, 'party_rows_2'))
+        for party_row_1, party_row_2 in party_rows:
+            party_cells_1 = {column: self.select_texts(party_row_1, f'cell_{column}') for column in range(1, 7)}
+            party_cells_2 = {column: self.select_texts(party_row_2, f'cell_{column}') for column in (2, 4)}
+            sequenced_parties.append(self.make_party(party_cells_1, party_cells_2))
 
-        for party in parties:
-            associates = strip_text((party['associates'] or '').split(','))
-            party['associates'] = [
-                next(filter(lambda p: p['sequence'] == associate, parties), {}).get('id')
-                for associate in associates
-            ]
-
-        for party in parties:
-            party.pop('sequence', None)
-
-        return parties
+        return self.link_party_associates(sequenced_parties)
 
     def parse_entries(self, response):
-        css_1 = '[NAME="dockets"] + table tr[valign]'
-        css_2 = '[NAME="dockets"] + table tr[valign] + tr'
+        entry_rows = zip(self.select(response, 'entry_rows_1'), self.select(response, 'entry_rows_2'))
+        for entry_row_1, entry_row_2 in entry_rows:
+            entry_cells_1 = {column: self.select_texts(entry_row_1, f'cell_{column}') for column in range(1, 5)}
+            entry_cells_2 = {2: self.select_texts(entry_row_2, 'cell_2')}
+            yield self.make_entry(entry_cells_1, entry_cells_2)
+
+    def clean_id(self, texts):
+        return texts[0]
+
+    def clean_title(self, texts, item_id):
+        return strip_text(re.sub(rf'^({item_id}|\s|-)*', '', texts[0], flags=re.S))
+
+    def clean_filing_date(self, texts):
+        filing_date = re.sub(r'\s*,\s*|(st|nd|rd|th),', ',', texts[0])
+        return datetime.strptime(filing_date, '%A,%B %d, %Y')
+
+    def clean_status(self, texts):
+        return strip_text(texts[0].split('-'))[0]
+
+    def make_party(self, cells_1, cells_2):
+        party_address = '\n'.join(cells_2[2])
+        party_aliases = filter(lambda t: t.lower() != 'none', cells_2[4])
+
+        party_end_date = next(iter(cells_1[3]), None)
+        if party_end_date:
+            party_end_date = datetime.strptime(party_end_date, '%d-%b-%Y')
+
+        # associates hold sequences of the other parties until they are linked to their ids
+        party = PartyItem(
+            associates=strip_text((next(iter(cells_1[2]), None) or '').split(',')),
+            end_date=party_end_date,
+            type=next(iter(cells_1[4]), None),
+            id=next(iter(cells_1[5]), None),
+            name=next(iter(cells_1[6]), None),
+            address=party_address if party_address.lower() != 'unavailable' else None,
+            aliases=next(party_aliases, None)
+        )
+        return next(iter(cells_1[1]), None), party
+
+    def link_party_associates(self, sequenced_parties):
+        party_ids = {}
+        for sequence, party in sequenced_parties:
+            party_ids.setdefault(sequence, party.id)
 
-        entries = []
-        for entry_selector_1, entry_selector_2 in zip(response.css(css_1), response.css(css_2)):
-            entry_filing_date = ' '.join(strip_text(entry_selector_1.css('td:nth-child(1) ::text').extract()))
-            entry_description = '\n'.join(strip_text(entry_selector_1.css('td:nth-child(2) ::text').extract()))
-            entry_party = strip_text(entry_selector_1.css('td:nth-child(3) ::text').extract())
-            entry_monetary = '\n'.join(strip_text(entry_selector_1.css('td:nth-child(4) ::text').extract()))
-            entry_content = '\n'.join(strip_text(entry_selector_2.css('td:nth-child(2) ::text').extract()))
-
-            if entry_filing_date:
-                entry_filing_date = datetime.strptime(entry_filing_date, '%d-%b-%Y %I:%M %p').isoformat()
+        parties = []
+        for _, party in sequenced_parties:
+            party.associates = [party_ids.get(associate) for associate in party.associates]
+            parties.append(party)
 
-            entry = {
-                'filing_date': entry_filing_date or None,
-                'description': entry_description or None,
-                'party': strip_text(next(iter(entry_party), '').strip(',')) or None,
-                'monetary': entry_monetary or None,
-                'content': entry_content if entry_content.lower() != 'none.' else None
-            }
-            entries.append(entry)
+        return parties
 
-        return entries
+    def make_entry(self, cells_1, cells_2):
+        entry_filing_date = ' '.join(cells_1[1])
+        entry_description = '\n'.join(cells_1[2])
+        entry_monetary = '\n'.join(cells_1[4])
+        entry_content = '\n'.join(cells_2[2])
+
+        if entry_filing_date:
+            entry_filing_date = datetime.strptime(entry_filing_date, '%d-%b-%Y %I:%M %p')
+
+        return EntryItem(
+            filing_date=entry_filing_date or None,
+            description=entry_description or None,
+            party=strip_text(next(iter(cells_1[3]), '').strip(',')) or None,
+            monetary=entry_monetary or None,
+            content=entry_content if entry_content.lower() != 'none.' else None
+        )
+
+
+class CourtConnectTableWalkParseSpider(CourtConnectParseParseSpider):
+    """
+    Produces the same docket as CourtConnectParseParseSpider but walks each anchor table once
+    instead of evaluating a css query per field over the whole document
+    """
+    name = 'court-connect-table-walk-parse'
+    anchor_names = ['selection', 'description', 'parties', 'dockets']
+
+    def iter_parse(self, response):
+        tables = find_anchor_tables(response.selector.root, self.anchor_names)
+        selection_cells = index_label_cells(tables['selection'])
+        description_cells = index_label_cells(tables['description'])
+
+        item_id = self.clean_id(label_cell_texts(selection_cells, 'Case ID'))
+        yield DocketItem(
+            url=response.url,
+            id=item_id,
+            start_date=next(iter(label_cell_texts(selection_cells, 'Docket Start Date')), None),
+            end_date=next(iter(label_cell_texts(selection_cells, 'Docket Ending Date')), None),
+            title=self.clean_title(label_cell_texts(description_cells, 'Case ID'), item_id),
+            filing_date=self.clean_filing_date(label_cell_texts(description_cells, 'Filing Date')),
+            type=label_cell_texts(description_cells, 'Type')[0],
+            status=self.clean_status(label_cell_texts(description_cells, 'Status')),
+        )
+
+        parties = self.walk_parties(tables['parties'])
+        yield from parties
+        yield from self.link_entry_parties(parties, self.walk_entries(tables['dockets']))
+
+    def walk_parties(self, tables):
+        rows_1, rows_2 = [], []
+        for table in tables:
+            for row in table.iter('tr'):
+                if row.get('valign') is None:
+                    continue
+                (rows_1 if row.get('align') is None else rows_2).append(row)
+
+        sequenced_parties = [
+            self.make_party(index_row_cells(row_1), index_row_cells(row_2))
+            for row_1, row_2 in zip(rows_1, rows_2)
+        ]
+        return self.link_party_associates(sequenced_parties)
+
+    def walk_entries(self, tables):
+        rows_1, rows_2 = [], []
+        for table in tables:
+            for row in table.iter('tr'):
+                if row.get('valign') is not None:
+                    rows_1.append(row)
+
+                previous_row = previous_element_sibling(row)
+                if previous_row is not None and previous_row.tag == 'tr' and previous_row.get('valign') is not None:
+                    rows_2.append(row)
+
+        for row_1, row_2 in zip(rows_1, rows_2):
+            yield self.make_entry(index_row_cells(row_1), index_row_cells(row_2))
 
 
 def process_item_url(url):
@@ -165,11 +263,28 @@ def process_pagination_url(url):
 class CourtConnectCrawlSpider(BaseCrawlSpider):
     name = 'court-connect-crawl'
     parse_spider = CourtConnectParseParseSpider()
+    parse_spiders = {
+        'css': parse_spider,
+        'table-walk': CourtConnectTableWalkParseSpider(),
+    }
 
     allowed_domains = ['courtconnect.courts.delaware.gov']
 
     item_css = '[href*="case_id="]'
     listings_css = ['[href*=cp_personcase_srch_details]']
+    closed_statuses = ['CLOSED']
+    # census fields of the columns of search results, by lowercase header
+    listing_census_columns = {
+        'case id': 'id',
+        'title': 'title',
+        'caption': 'title',
+        'filing date': 'filing_date',
+        'case type': 'type',
+        'type': 'type',
+        'status': 'status',
+        'case status': 'status',
+    }
+    listing_date_formats = ['%d-%b-%Y', '%m/%d/%Y']
 
     rules = [
         Rule(
@@ -177,7 +292,7 @@ class CourtConnectCrawlSpider(BaseCrawlSpider):
                 restrict_css=item_css,
                 process_value=process_item_url
             ),
-            process_request=reset_cookies,
+            process_request='process_item_request',
             callback='parse_item'
         ),
         Rule(
@@ -189,3 +304,78 @@ class CourtConnectCrawlSpider(BaseCrawlSpider):
             callback='parse'
         ),
     ]
+
+    def parse_request_item_id(self, request):
+        return url_query_parameter(request.url, 'case_id')
+
+    def process_item_request(self, request, response):
+        request = super(CourtConnectCrawlSpider, self).process_item_request(request, response)
+        return request and reset_cookies(request, response)
+
+    def parse_listing_hash(self, request, response):
+        listing_rows = self.parse_listing_rows(response)
+        row_texts = listing_rows.get(self.parse_request_item_id(request))
+        return listing_hash(row_texts) if row_texts else None
+
+    def parse_listing_rows(self, response):
+        """Texts of the search result row of each case on a listing page, parsed once per listing page"""
+        if getattr(self, 'listing_rows_response', None) is response:
+            return self.listing_rows
+
+        listing_rows = {}
+        for case_link in response.css(self.item_css):
+            item_id = url_query_parameter(case_link.attrib.get('href', ''), 'case_id')
+            row_texts = strip_text(case_link.xpath('ancestor::tr[1]//text()').extract())
+            listing_rows.setdefault(item_id, row_texts)
+
+        self.listing_rows_response, self.listing_rows = response, listing_rows
+        return listing_rows
+
+    def parse_listing_census(self, response):
+        items = []
+        for table in response.xpath('//table[tr/th]'):
+            columns = [
+                self.listing_census_columns.get(' '.join(strip_text(header.xpath('.//text()').extract())).lower())
+                for header in table.xpath('tr/th')
+            ]
+            if not {'id', 'title', 'filing_date', 'type', 'status'}.issubset(columns):
+                continue
+
+            for row in table.xpath('tr[td]'):
+                item_url = row.css(f'{self.item_css}::attr(href)').get()
+                if not item_url:
+                    continue
+
+                cells = {
+                    field: ' '.join(strip_text(cell.xpath('.//text()').extract()))
+                    for field, cell in zip(columns, row.xpath('td')) if field
+                }
+                # short rows, e.g. with cells spanning columns, are left to the census of their docket report
+                if len(cells) < len(set(filter(None, columns))) or not cells.get('id'):
+                    self.crawler.stats.inc_value('census/incomplete_listing_rows', spider=self)
+                    continue
+
+                items.append(CensusItem(
+                    url=process_item_url(response.urljoin(item_url)),
+                    id=cells['id'],
+                    title=cells.get('title') or None,
+                    filing_date=self.parse_listing_date(cells.get('filing_date')),
+                    type=cells.get('type') or None,
+                    status=self.parse_spider.clean_status([cells['status']]) if cells.get('status') else None,
+                ))
+
+        return items
+
+    def parse_listing_date(self, text):
+        if not text:
+            return None
+
+        for date_format in self.listing_date_formats:
+            try:
+                return datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+        return None
+
+    def is_closed_item(self, item):
+        return item.status.upper() in self.closed_statuses
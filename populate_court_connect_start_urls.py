@@ -1,15 +1,168 @@
+"""
+Seeds the court connect crawlers with last name searches, a search with more than `--max-pages` pages of results
+is split into longer prefixes (`a` -> `aa`...`az`, `a'`, `a `, `a-`) until every search is small enough to spread
+evenly over crawlers
+"""
+import argparse
 import time
 from string import ascii_lowercase
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
 
-import redis
+from parsel import Selector
+from scrapy.utils.project import get_project_settings
+from scrapy_redis.connection import get_redis_from_settings
 
-r = redis.Redis(host='docket-redis', port=6379, db=0)
-r.flushdb()
+from docket_scraper.queue import REQUEST_TYPES, request_type_key
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
 
-start_url_t = 'https://courtconnect.courts.delaware.gov/cc/cconnect/ck_public_qry_cpty.cp_personcase_srch_details?' \
-              'partial_ind=checked&last_name={}&case_type=ALL&PageNo=1'
+BASE_URL = 'https://courtconnect.courts.delaware.gov'
+# characters of last names other than letters, a prefix is split on them too
+NAME_CHARACTERS = "' -"
+SEARCH_URL_T = '{base_url}/cc/cconnect/ck_public_qry_cpty.cp_personcase_srch_details?' \
+               '{partial_ind}last_name={last_name}&case_type=ALL&PageNo={page}'
 
-for character in ascii_lowercase:
-    start_url = start_url_t.format(character)
-    r.lpush('court-connect-crawl:start_urls', start_url)
-    time.sleep(1)
+
+def search_url(base_url, last_name, page=1, partial=True):
+    partial_ind = 'partial_ind=checked&' if partial else ''
+    return SEARCH_URL_T.format(base_url=base_url, partial_ind=partial_ind, last_name=quote(last_name), page=page)
+
+
+def fetch(url, delay, retries=5):
+    for attempt in range(retries):
+        time.sleep(delay * 2 ** attempt)
+        try:
+            with urlopen(Request(url, headers={'User-Agent': 'Mozilla/5.0'}), timeout=60) as response:
+                return response.read().decode('utf-8', errors='replace')
+        except HTTPError as error:
+            if error.code != 503 or attempt == retries - 1:
+                raise
+
+
+def results_count(html):
+    return len(Selector(text=html).css(CourtConnectCrawlSpider.item_css))
+
+
+def has_results(html):
+    return bool(results_count(html))
+
+
+def count_results(base_url, last_name, delay, partial=True, known_page=0):
+    """
+    Counts the results of a search from the size of its first page and the results of its last page, found by
+    doubling the page number past `known_page`, a page known to have results, then bisecting
+
+    Every page but the last is taken to be as full as the first one, the site pages its results by a fixed size
+    """
+    page_counts = {}
+
+    def page_count(page):
+        if page not in page_counts:
+            page_counts[page] = results_count(fetch(search_url(base_url, last_name, page, partial), delay))
+        return page_counts[page]
+
+    if not page_count(1):
+        return 0
+
+    last_page, empty_page = max(known_page, 1), max(known_page, 1) * 2
+    while page_count(empty_page):
+        last_page, empty_page = empty_page, empty_page * 2
+    while empty_page - last_page > 1:
+        page = (last_page + empty_page) // 2
+        if page_count(page):
+            last_page = page
+        else:
+            empty_page = page
+
+    return (last_page - 1) * page_count(1) + page_count(last_page)
+
+
+def partition_last_names(base_url, alphabet, max_pages, max_prefix_length, delay, split_characters=None,
+                         check_coverage=False):
+    """
+    Returns the last name prefixes to search partially and the ones to search exactly, a prefix is split when its
+    results go past `max_pages`, searching it exactly too keeps the names equal to the prefix itself
+
+    A prefix is split on `split_characters`, the alphabet and the other characters of last names by default, e.g.
+    `o` -> `o'` for O'BRIEN and `de` -> `de ` for DE LA CRUZ. With `check_coverage`, the results of the searches a
+    prefix is split into are counted, and a prefix whose split searches miss some of its results is searched whole too
+    """
+    split_characters = split_characters or alphabet + NAME_CHARACTERS
+    partial_names, exact_names = [], []
+
+    def partition(last_name):
+        """Adds the searches of the prefix, returns the count of their results if checked"""
+        if len(last_name) < max_prefix_length:
+            html = fetch(search_url(base_url, last_name, page=max_pages + 1), delay)
+            if has_results(html):
+                print(f'Splitting "{last_name}", more than {max_pages} pages of results')
+                exact_names.append(last_name)
+                split_count = sum(partition(last_name + character) for character in split_characters)
+                if not check_coverage:
+                    return 0
+
+                split_count += count_results(base_url, last_name, delay, partial=False)
+                count = count_results(base_url, last_name, delay, known_page=max_pages + 1)
+                if split_count < count:
+                    print(f'The searches "{last_name}" is split into miss {count - split_count} of its {count} '
+                          f'results, searching it whole too')
+                    partial_names.append(last_name)
+                return count
+
+        partial_names.append(last_name)
+        return count_results(base_url, last_name, delay) if check_coverage else 0
+
+    for last_name in alphabet:
+        partition(last_name)
+
+    return partial_names, exact_names
+
+
+def schedule_start_urls(settings, base_url, partial_names, exact_names, keep_queue=False):
+    start_urls = [search_url(base_url, last_name) for last_name in partial_names]
+    start_urls += [search_url(base_url, last_name, partial=False) for last_name in exact_names]
+
+    spider_name = CourtConnectCrawlSpider.name
+    start_urls_key = settings.get('REDIS_START_URLS_KEY', '%(name)s:start_urls') % {'name': spider_name}
+
+    pipe = get_redis_from_settings(settings).pipeline()
+    if not keep_queue:
+        dupefilter_key = settings.get('SCHEDULER_DUPEFILTER_KEY', '%(spider)s:dupefilter') % {'spider': spider_name}
+        queue_key = settings.get('SCHEDULER_QUEUE_KEY', '%(spider)s:requests') % {'spider': spider_name}
+        queue_keys = [queue_key] + [request_type_key(queue_key, request_type) for request_type in REQUEST_TYPES]
+        delayed_retries_key = settings.get('DELAYED_RETRY_KEY', '%(spider)s:delayed_retries') % {'spider': spider_name}
+        pipe.delete(start_urls_key, dupefilter_key, delayed_retries_key, *queue_keys)
+    pipe.lpush(start_urls_key, *start_urls)
+    pipe.execute()
+
+    print(f'Scheduled {len(start_urls)} searches in "{start_urls_key}"')
+    return start_urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--alphabet', default=ascii_lowercase, help='first characters of the last names searched')
+    parser.add_argument('--split-characters', help=f'characters a prefix is split on, the alphabet and '
+                                                   f'"{NAME_CHARACTERS}" by default')
+    parser.add_argument('--check-coverage', action='store_true',
+                        help='count the results of split prefixes, which takes a few more searches per prefix')
+    parser.add_argument('--max-pages', type=int, default=10, help='pages of results a search may have unsplit')
+    parser.add_argument('--max-prefix-length', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=1, help='seconds between probing searches')
+    parser.add_argument(
+        '--keep-queue', action='store_true',
+        help='keep the start urls, requests and dupefilter left by the previous crawl of the spider'
+    )
+    args = parser.parse_args()
+
+    partial_names, exact_names = partition_last_names(
+        args.base_url, args.alphabet, args.max_pages, args.max_prefix_length, args.delay,
+        split_characters=args.split_characters, check_coverage=args.check_coverage,
+    )
+    schedule_start_urls(get_project_settings(), args.base_url, partial_names, exact_names, keep_queue=args.keep_queue)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+from pathlib import Path
+
+import fakeredis
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+CORPUS_DIR = Path(__file__).parent.parent / 'benchmarks' / 'corpus'
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def docket_response():
+    """The typical docket report of the benchmark corpus as the response to an item request"""
+    url = (
+        'https://courtconnect.courts.delaware.gov/cc/cconnect/ck_public_qry_doct.cp_dktrpt_docket_report'
+        '?case_id=N22C-01-001'
+    )
+    return HtmlResponse(url, body=(CORPUS_DIR / 'typical.html').read_bytes(), encoding='utf-8', request=Request(url))
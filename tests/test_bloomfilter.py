@@ -0,0 +1,115 @@
+import json
+
+from scrapy.http import Request
+from scrapy.settings import Settings
+
+from docket_scraper.bloomfilter import RedisScalableBloomFilter
+from docket_scraper.commands import dupefilter_stats
+from docket_scraper.dupefilter import BloomDupeFilter
+
+
+def scalable_filter(server, initial_capacity=1000, error_rate=0.01, ttl=None, key='spider:1:bloom'):
+    return RedisScalableBloomFilter(server, key, initial_capacity, error_rate, ttl=ttl)
+
+
+def test_new_and_duplicate_values(server):
+    bloom_filter = scalable_filter(server)
+
+    new = sum(bloom_filter.add(f'value-{number}') for number in range(1000))
+    # an unseen value may be taken as seen, with about the error rate
+    assert new >= 980
+    assert len(bloom_filter) == new
+    assert not any(bloom_filter.add(f'value-{number}') for number in range(1000))
+    assert all(f'value-{number}' in bloom_filter for number in range(1000))
+    assert len(bloom_filter) == new
+
+
+def test_false_positive_rate_within_error_rate(server):
+    bloom_filter = scalable_filter(server, initial_capacity=1000, error_rate=0.01)
+    for number in range(1000):
+        bloom_filter.add(f'value-{number}')
+
+    false_positives = sum(f'other-{number}' in bloom_filter for number in range(3000))
+    assert false_positives / 3000 < 0.01
+
+
+def test_slices_are_added_past_capacity(server):
+    bloom_filter = scalable_filter(server, initial_capacity=10)
+    assert bloom_filter.slice_count() == 1
+
+    for number in range(50):
+        bloom_filter.add(f'value-{number}')
+
+    # slices of 10, 20 and 40 values, each with a tighter error rate than the one before
+    assert bloom_filter.slice_count() == 3
+    slices = bloom_filter.stats()['slices']
+    assert [slice_stats['capacity'] for slice_stats in slices] == [10, 20, 40]
+    assert slices[0]['count'] == 10 and slices[1]['count'] == 20
+    assert slices[0]['error_rate'] > slices[1]['error_rate'] > slices[2]['error_rate']
+    assert sum(slice_stats['error_rate'] for slice_stats in slices) < bloom_filter.error_rate
+    assert all(f'value-{number}' in bloom_filter for number in range(50))
+
+
+def test_crawlers_share_the_filter(server):
+    first, second = scalable_filter(server, initial_capacity=10), scalable_filter(server, initial_capacity=10)
+
+    assert first.add('shared')
+    assert not second.add('shared')
+
+    # the first crawler fills the first slice, the second one still knows of a single slice
+    second.add('value-0')
+    for number in range(1, 20):
+        first.add(f'value-{number}')
+    assert first.slice_count() == 2 and len(second.bloom_filters) == 1
+
+    assert second.add('late-value')
+    assert len(second.bloom_filters) == 2
+    assert 'late-value' in first
+    assert not first.add('late-value')
+    assert len(first) == len(second)
+
+
+def test_ttl_is_refreshed_on_every_add(server):
+    bloom_filter = scalable_filter(server, ttl=60)
+    bloom_filter.add('value')
+
+    assert 0 < server.ttl('spider:1:bloom:meta') <= 60
+    assert 0 < server.ttl('spider:1:bloom:0') <= 60
+
+
+def test_clear(server):
+    bloom_filter = scalable_filter(server, initial_capacity=10)
+    for number in range(30):
+        bloom_filter.add(f'value-{number}')
+
+    bloom_filter.clear()
+
+    assert not server.keys('spider:1:bloom*')
+    assert bloom_filter.add('value-0')
+
+
+def test_dupefilter_sees_requests_once(server):
+    dupefilter = BloomDupeFilter(server, 'spider:1:bloom', scalable_filter(server))
+
+    assert not dupefilter.request_seen(Request('https://example.com/?case_id=1'))
+    assert dupefilter.request_seen(Request('https://example.com/?case_id=1'))
+    assert not dupefilter.request_seen(Request('https://example.com/?case_id=2'))
+    assert len(dupefilter) == 2
+
+
+def test_stats_command(server, monkeypatch, capsys):
+    settings = Settings({'BLOOM_DUPEFILTER_INITIAL_CAPACITY': 10, 'BLOOM_DUPEFILTER_ERROR_RATE': 0.01})
+    monkeypatch.setattr(dupefilter_stats, 'get_redis_from_settings', lambda _: server)
+    bloom_filter = scalable_filter(server, initial_capacity=10, key='court-connect-crawl:7:bloom-dupefilter')
+    for number in range(15):
+        bloom_filter.add(f'value-{number}')
+
+    command = dupefilter_stats.Command()
+    command.settings = settings
+    command.run(['court-connect-crawl', '7'], None)
+
+    stats = json.loads(capsys.readouterr().out)
+    assert stats['key'] == 'court-connect-crawl:7:bloom-dupefilter'
+    assert stats['count'] == len(bloom_filter)
+    assert stats['capacity'] == 30
+    assert len(stats['slices']) == 2
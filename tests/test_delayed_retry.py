@@ -0,0 +1,80 @@
+import json
+
+import pytest
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request, Response
+from scrapy.utils.request import request_from_dict
+from scrapy.utils.test import get_crawler
+
+from docket_scraper import request_serializer
+from docket_scraper.delayed_retry import RedisDelayedRetries
+from docket_scraper.middlewares import DelayedRetryMiddleware
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+DOCKET_URL = 'https://courtconnect.courts.delaware.gov/cc/cconnect/ck_public_qry_doct.cp_dktrpt_docket_report?case_id='
+
+
+@pytest.fixture
+def delayed_retries(server):
+    return RedisDelayedRetries(server, 'court-connect-crawl:delayed_retries', 'court-connect-crawl:dead_letter')
+
+
+def test_claim_due_returns_only_due_requests(delayed_retries):
+    delayed_retries.schedule('due', 0)
+    delayed_retries.schedule('later', 60)
+
+    assert delayed_retries.claim_due(10) == [b'due']
+    # a claimed request is removed, so no other crawler claims it too
+    assert delayed_retries.claim_due(10) == []
+    assert len(delayed_retries) == 1
+
+
+def test_claim_due_claims_at_most_count(delayed_retries):
+    for number in range(5):
+        delayed_retries.schedule(f'request-{number}', 0)
+
+    assert len(delayed_retries.claim_due(3)) == 3
+    assert len(delayed_retries.claim_due(3)) == 2
+    assert len(delayed_retries) == 0
+
+
+def test_request_is_dead_lettered_after_max_attempts(server, delayed_retries):
+    crawler = get_crawler(CourtConnectCrawlSpider)
+    spider = CourtConnectCrawlSpider(crawling_job_id='1')
+    spider.crawler_id = 'crawler-1'
+    middleware = DelayedRetryMiddleware(
+        crawler, delayed_retries, request_serializer, max_times=2, base_delay=0, max_delay=0, poll_interval=1,
+        claim_count=10,
+    )
+
+    request = Request(DOCKET_URL + 'N22C-01-001')
+    for attempt in (1, 2):
+        with pytest.raises(IgnoreRequest, match=f'delayed retry {attempt}'):
+            middleware.process_response(request, Response(request.url, status=503), spider)
+        encoded_request, = delayed_retries.claim_due(10)
+        request = request_from_dict(request_serializer.loads(encoded_request), spider=spider)
+        assert request.meta['delayed_retry_times'] == attempt
+
+    with pytest.raises(IgnoreRequest, match='Gave up'):
+        middleware.process_response(request, Response(request.url, status=503), spider)
+
+    assert len(delayed_retries) == 0
+    dead_letter = json.loads(server.lindex('court-connect-crawl:dead_letter', 0))
+    assert (dead_letter['url'], dead_letter['reason'], dead_letter['attempts']) == (request.url, '503', 2)
+    assert dead_letter['crawler_id'] == 'crawler-1'
+    assert crawler.stats.get_value('delayed_retry/scheduled') == 2
+    assert crawler.stats.get_value('delayed_retry/dead_letter') == 1
+
+
+def test_clean_response_is_not_retried(delayed_retries):
+    crawler = get_crawler(CourtConnectCrawlSpider)
+    spider = CourtConnectCrawlSpider(crawling_job_id='1')
+    middleware = DelayedRetryMiddleware(
+        crawler, delayed_retries, request_serializer, max_times=2, base_delay=0, max_delay=0, poll_interval=1,
+        claim_count=10,
+    )
+    request = Request(DOCKET_URL + 'N22C-01-001')
+    response = Response(request.url, status=200)
+
+    assert middleware.process_response(request, response, spider) is response
+    assert len(delayed_retries) == 0
@@ -0,0 +1,32 @@
+from scrapy.utils.test import get_crawler
+
+from docket_scraper import signals
+from docket_scraper.incremental import ClosedListings
+from docket_scraper.seen_items import RedisSeenItems
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+
+def incremental_spider(server):
+    crawler = get_crawler(CourtConnectCrawlSpider)
+    spider = CourtConnectCrawlSpider(crawling_job_id='1', incremental=True)
+    spider.crawler = crawler
+    spider.split_items = False
+    spider.seen_items = RedisSeenItems(server, 'court-connect-crawl:1:seen_items')
+    spider.closed_listings = ClosedListings(server, 'court-connect-crawl:closed-listings')
+    spider.pending_closed_listings = {}
+    spider.is_closed_item = lambda item: True
+    crawler.signals.connect(spider.item_stored, signal=signals.item_stored)
+    return spider
+
+
+def test_closed_listing_is_recorded_once_its_item_is_stored(server, docket_response):
+    spider = incremental_spider(server)
+    docket_response.request.meta['listing'] = {'item_id': 'N22C-01-001', 'hash': 'row-hash'}
+
+    docket = spider.parse_item(docket_response)
+    # the docket may still fail to be written, its listing row must be crawled again until it is
+    assert not spider.closed_listings.is_unchanged('N22C-01-001', 'row-hash')
+
+    spider.crawler.signals.send_catch_log(signals.item_stored, item=docket, spider=spider)
+    assert spider.closed_listings.is_unchanged('N22C-01-001', 'row-hash')
+    assert spider.pending_closed_listings == {}
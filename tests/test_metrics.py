@@ -0,0 +1,39 @@
+import json
+
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+
+from docket_scraper.metrics import RedisCrawlStats
+from docket_scraper.middlewares import CallbackTimingMiddleware
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+
+def test_timings_are_recorded_only_with_metrics():
+    crawler = get_crawler(CourtConnectCrawlSpider)
+    assert crawler.settings.get('ITEM_PROCESSOR') == 'scrapy.pipelines.ItemPipelineManager'
+    with pytest.raises(NotConfigured):
+        CallbackTimingMiddleware.from_crawler(crawler)
+
+    crawler = get_crawler(CourtConnectCrawlSpider, {'METRICS_ENABLED': True})
+    assert crawler.settings.get('ITEM_PROCESSOR') == 'docket_scraper.metrics.TimedItemPipelineManager'
+    assert CallbackTimingMiddleware.from_crawler(crawler).stats is crawler.stats
+
+
+def test_crawl_stats_are_written_only_when_enabled(server, monkeypatch):
+    monkeypatch.setattr('docket_scraper.metrics.get_redis_from_settings', lambda settings: server)
+    with pytest.raises(NotConfigured):
+        RedisCrawlStats.from_crawler(get_crawler(CourtConnectCrawlSpider))
+
+    crawler = get_crawler(CourtConnectCrawlSpider, {
+        'CRAWL_STATS_ENABLED': True, 'CRAWL_STATS_KEY': '%(spider)s:%(crawling_job_id)s:crawl-stats',
+    })
+    extension = RedisCrawlStats.from_crawler(crawler)
+    crawler.stats.set_value('item_scraped_count', 3)
+    spider = CourtConnectCrawlSpider(crawling_job_id='1')
+    spider.crawler_id = 'crawler-1'
+
+    extension.spider_closed(spider)
+    stats = json.loads(server.hget('court-connect-crawl:1:crawl-stats', 'crawler-1'))
+    assert stats['item_scraped_count'] == 3
+    assert server.ttl('court-connect-crawl:1:crawl-stats') > 0
@@ -0,0 +1,161 @@
+import logging
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from docket_scraper import pipelines, signals
+from docket_scraper.items import CensusItem
+from docket_scraper.pipelines import MongoDBPipeline
+
+
+class ManualThreads(object):
+    """Stands in for deferToThread, the writes run when the test finishes them"""
+
+    def __init__(self):
+        self.pending = []
+
+    def deferToThread(self, function, *args):
+        deferred = defer.Deferred()
+        self.pending.append((deferred, function, args))
+        return deferred
+
+    def finish(self):
+        deferred, function, args = self.pending.pop(0)
+        deferred.callback(function(*args))
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    manual_threads = ManualThreads()
+    monkeypatch.setattr(pipelines, 'threads', manual_threads)
+    monkeypatch.setattr(pipelines.pymongo, 'MongoClient', mongomock.MongoClient)
+    return manual_threads
+
+
+@pytest.fixture
+def spider():
+    return SimpleNamespace(
+        name='court-connect-crawl', crawling_job_id='1', logger=logging.getLogger('test'), crawler=get_crawler()
+    )
+
+
+def stored_items(spider):
+    items = []
+    spider.crawler.signals.connect(lambda item, spider: items.append(item), signal=signals.item_stored, weak=False)
+    return items
+
+
+def open_pipeline(spider, **kwargs):
+    pipeline = MongoDBPipeline('mongodb://localhost', 'dockets', stats=MemoryStatsCollector(get_crawler()), **kwargs)
+    pipeline.open_spider(spider)
+    return pipeline
+
+
+def census_item(number):
+    return CensusItem(url=f'https://example.com/{number}', id=f'case-{number}', title=None, filing_date=None,
+                      type=None, status=None)
+
+
+def stored_ids(pipeline):
+    return sorted(document['id'] for document in pipeline.collection.find())
+
+
+def test_batch_is_flushed_when_full(threads, spider):
+    pipeline = open_pipeline(spider, batch_size=2)
+    stored = stored_items(spider)
+
+    pipeline.process_item(census_item(1), spider)
+    assert not threads.pending
+    pipeline.process_item(census_item(2), spider)
+    assert len(threads.pending) == 1
+    assert not stored
+
+    threads.finish()
+    assert [item.id for item in stored] == ['case-1', 'case-2']
+    assert stored_ids(pipeline) == ['case-1', 'case-2']
+    assert pipeline.stats.get_value('mongodb/batches') == 1
+    assert pipeline.stats.get_value('mongodb/documents') == 2
+
+
+def test_every_item_waits_while_the_buffer_is_full_and_slots_busy(threads, spider):
+    pipeline = open_pipeline(spider, batch_size=2, max_pending_flushes=1)
+    items = [census_item(number) for number in range(1, 6)]
+
+    results = [pipeline.process_item(item, spider) for item in items[:4]]
+    assert results == items[:4]
+    # the first batch is written, the second fills the buffer
+    assert len(threads.pending) == 1 and len(pipeline.buffer) == 2
+
+    held = pipeline.process_item(items[4], spider)
+    assert isinstance(held, defer.Deferred) and not held.called
+    assert len(pipeline.buffer) == 2
+
+    threads.finish()
+    # the full buffer took the free slot, the held item went into the emptied buffer
+    assert held.called and held.result is items[4]
+    assert len(threads.pending) == 1 and len(pipeline.buffer) == 1
+    threads.finish()
+    assert stored_ids(pipeline) == ['case-1', 'case-2', 'case-3', 'case-4']
+
+
+def test_only_rejected_documents_are_counted_as_failed(threads, spider, monkeypatch):
+    pipeline = open_pipeline(spider, batch_size=3)
+    insert_many = mongomock.collection.Collection.insert_many
+
+    def insert_rejecting_second(collection, documents, ordered=True):
+        insert_many(collection, [documents[0], documents[2]], ordered=ordered)
+        raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 121, 'errmsg': 'Document failed validation'}]})
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'insert_many', insert_rejecting_second)
+    stored = stored_items(spider)
+    for number in range(1, 4):
+        pipeline.process_item(census_item(number), spider)
+    threads.finish()
+
+    assert stored_ids(pipeline) == ['case-1', 'case-3']
+    assert [item.id for item in stored] == ['case-1', 'case-3']
+    assert pipeline.stats.get_value('mongodb/documents') == 2
+    assert pipeline.stats.get_value('mongodb/failed_documents') == 1
+
+
+def test_duplicates_of_a_retried_batch_are_not_failures(threads, spider):
+    pipeline = open_pipeline(spider, batch_size=2)
+    documents = [pipeline.to_document(census_item(number)) for number in (1, 2)]
+    pipeline.write_documents(documents)
+
+    counts, failures = pipeline.write_documents(documents)
+
+    assert counts == {'mongodb/duplicate_documents': 2}
+    assert failures == []
+    assert stored_ids(pipeline) == ['case-1', 'case-2']
+
+
+def test_close_writes_the_buffer_and_waits_for_pending_flushes(threads, spider):
+    pipeline = open_pipeline(spider, batch_size=2)
+    for number in range(1, 4):
+        pipeline.process_item(census_item(number), spider)
+
+    closed = pipeline.close_spider(spider)
+    assert not closed.called
+    assert len(threads.pending) == 2
+
+    threads.finish()
+    assert not closed.called
+    threads.finish()
+    assert closed.called
+    assert stored_ids(pipeline) == ['case-1', 'case-2', 'case-3']
+
+
+def test_unbatched_item_is_signalled_once_written(threads, spider):
+    pipeline = open_pipeline(spider)
+    stored = stored_items(spider)
+
+    item = census_item(1)
+    assert pipeline.process_item(item, spider) is item
+    assert stored == [item]
+    assert stored_ids(pipeline) == ['case-1']
@@ -0,0 +1,17 @@
+from docket_scraper.items import docket_to_dict
+from docket_scraper.parse_pool import parse_page, worker_pool
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+
+def test_spawned_workers_parse_like_the_crawler(docket_response):
+    executor = worker_pool(1, CourtConnectCrawlSpider, 'table-walk')
+    try:
+        assert executor._mp_context.get_start_method() == 'spawn'
+        item, parse_time = executor.submit(
+            parse_page, docket_response.url, docket_response.body, docket_response.encoding
+        ).result(timeout=60)
+    finally:
+        executor.shutdown()
+
+    assert parse_time > 0
+    assert docket_to_dict(item) == docket_to_dict(CourtConnectCrawlSpider.parse_spider.parse(docket_response))
@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+from scrapy_redis.queue import PriorityQueue
+
+from docket_scraper import request_serializer
+from docket_scraper.queue import DocketFirstQueue
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+QUEUE_KEY = '%(spider)s:requests'
+DOCKET_URL = 'https://courtconnect.courts.delaware.gov/cc/cconnect/ck_public_qry_doct.cp_dktrpt_docket_report?case_id='
+LISTING_URL = (
+    'https://courtconnect.courts.delaware.gov/cc/cconnect/ck_public_qry_cpty.cp_personcase_srch_details?PageNo='
+)
+
+
+@pytest.fixture
+def spider():
+    crawler = get_crawler(CourtConnectCrawlSpider, {'SCHEDULER_DOCKETS_HIGH_WATER_MARK': 2})
+    spider = CourtConnectCrawlSpider(crawling_job_id='1')
+    spider.crawler = crawler
+    spider.settings = crawler.settings
+    return spider
+
+
+def docket(number, priority=0):
+    return Request(f'{DOCKET_URL}{number}', priority=priority)
+
+
+def listing(number, priority=0):
+    return Request(f'{LISTING_URL}{number}', priority=priority)
+
+
+def in_progress(spider, *requests):
+    spider.crawler.engine = SimpleNamespace(slot=SimpleNamespace(inprogress=set(requests)))
+
+
+def popped_urls(queue):
+    urls = []
+    while (request := queue.pop()) is not None:
+        urls.append(request.url)
+    return urls
+
+
+def test_dockets_before_listings(server, spider):
+    queue = DocketFirstQueue(server, spider, QUEUE_KEY)
+    queue.push(listing(1))
+    queue.push(docket(1))
+    queue.push(listing(2, priority=10))
+    queue.push(docket(2, priority=5))
+
+    assert queue.depths() == {'dockets': 2, 'listings': 2}
+    assert popped_urls(queue) == [f'{DOCKET_URL}2', f'{DOCKET_URL}1', f'{LISTING_URL}2', f'{LISTING_URL}1']
+    assert spider.crawler.stats.get_value('scheduler/max_depth/dockets') == 2
+
+
+def test_listings_held_back_while_dockets_in_progress(server, spider):
+    queue = DocketFirstQueue(server, spider, QUEUE_KEY)
+    queue.push(listing(1))
+    in_progress(spider, docket(1), docket(2), listing(3))
+
+    assert queue.pop() is None
+    assert spider.crawler.stats.get_value('scheduler/listings_held_back') == 1
+    assert len(queue) == 1
+
+    # below the mark of 2 dockets in progress
+    in_progress(spider, docket(1), listing(3))
+    assert queue.pop().url == f'{LISTING_URL}1'
+
+
+def test_empty_queue_is_not_held_back(server, spider):
+    queue = DocketFirstQueue(server, spider, QUEUE_KEY)
+    in_progress(spider, docket(1), docket(2))
+
+    assert queue.pop() is None
+    assert spider.crawler.stats.get_value('scheduler/listings_held_back') is None
+
+
+def test_len_counts_every_queue(server, spider):
+    queue = DocketFirstQueue(server, spider, QUEUE_KEY)
+    assert len(queue) == 0
+
+    queue.push(docket(1))
+    queue.push(listing(1))
+    queue.push(listing(2))
+    PriorityQueue(server, spider, QUEUE_KEY).push(docket(3))
+
+    assert len(queue) == 4
+    queue.pop()
+    assert len(queue) == 3
+
+    queue.clear()
+    assert len(queue) == 0
+
+
+def test_requests_of_the_legacy_queue_are_popped_first(server, spider):
+    legacy_queue = PriorityQueue(server, spider, QUEUE_KEY)
+    legacy_queue.push(listing(1, priority=1))
+    legacy_queue.push(docket(1))
+    queue = DocketFirstQueue(server, spider, QUEUE_KEY)
+    queue.push(docket(2))
+    in_progress(spider, docket(3), docket(4))
+
+    assert popped_urls(queue) == [f'{LISTING_URL}1', f'{DOCKET_URL}1', f'{DOCKET_URL}2']
+    assert len(legacy_queue) == 0
+
+
+def test_pickled_requests_of_earlier_crawls_are_loaded_by_the_compact_serializer(server, spider):
+    PriorityQueue(server, spider, QUEUE_KEY).push(docket(1))
+    queue = DocketFirstQueue(server, spider, QUEUE_KEY, serializer=request_serializer)
+    queue.push(docket(2))
+
+    assert popped_urls(queue) == [f'{DOCKET_URL}1', f'{DOCKET_URL}2']
@@ -0,0 +1,55 @@
+import pytest
+
+from docket_scraper.ratelimit import RedisTokenBucket
+
+BUCKET_KEY = 'rate-limit:%(bucket)s'
+
+
+def token_bucket(server, **kwargs):
+    options = {'initial_rate': 4, 'min_rate': 1, 'max_rate': 8, 'burst': 2, 'ttl': 60, **kwargs}
+    return RedisTokenBucket(server, BUCKET_KEY, **options)
+
+
+def test_burst_then_spacing(server):
+    bucket = token_bucket(server)
+
+    waits = [bucket.acquire('courtconnect.courts.delaware.gov') for _ in range(5)]
+
+    # the burst goes out right away, every later request waits a quarter of a second more than the one before it
+    assert waits == [0, 0, pytest.approx(0.25, abs=0.02), pytest.approx(0.5, abs=0.02), pytest.approx(0.75, abs=0.02)]
+    assert 0 < server.ttl(BUCKET_KEY % {'bucket': 'courtconnect.courts.delaware.gov'}) <= 60
+
+
+def test_buckets_are_apart(server):
+    bucket = token_bucket(server)
+
+    assert [bucket.acquire('a.example.com') for _ in range(3)][-1] > 0
+    assert bucket.acquire('b.example.com') == 0
+
+
+def test_adjust_grows_and_backs_off_within_the_rate_range(server):
+    bucket = token_bucket(server, increase=3, decrease_factor=0.5, decrease_cooldown=0)
+
+    assert bucket.adjust('courtconnect', congested=False) == 7
+    assert bucket.adjust('courtconnect', congested=False) == 8
+    assert bucket.adjust('courtconnect', congested=False) == 8
+
+    assert bucket.adjust('courtconnect', congested=True) == 4
+    assert bucket.adjust('courtconnect', congested=True) == 2
+    assert bucket.adjust('courtconnect', congested=True) == 1
+    assert bucket.adjust('courtconnect', congested=True) == 1
+
+
+def test_congestion_backs_off_once_per_cooldown(server):
+    bucket = token_bucket(server, decrease_factor=0.5, decrease_cooldown=60)
+
+    assert bucket.adjust('courtconnect', congested=True) == 2
+    assert bucket.adjust('courtconnect', congested=True) == 2
+
+
+def test_acquire_spaces_requests_at_the_adjusted_rate(server):
+    bucket = token_bucket(server, burst=1, decrease_cooldown=0)
+    bucket.adjust('courtconnect', congested=True)
+
+    assert bucket.acquire('courtconnect') == 0
+    assert bucket.acquire('courtconnect') == pytest.approx(0.5, abs=0.02)
@@ -0,0 +1,89 @@
+import pickle
+
+import pytest
+from scrapy.http import Request
+from scrapy.utils.request import request_from_dict
+from scrapy_redis import picklecompat
+
+from docket_scraper import request_serializer
+from docket_scraper.request_serializer import DOCKET_REPORT_URL, LISTING_URL
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+
+@pytest.fixture
+def spider():
+    return CourtConnectCrawlSpider(crawling_job_id='1')
+
+
+def round_trip(request, spider):
+    request_dict = request.to_dict(spider=spider)
+    loaded = request_serializer.loads(request_serializer.dumps(request_dict))
+    assert loaded == request_dict
+    return request_from_dict(loaded, spider=spider)
+
+
+def test_docket_request_round_trip(spider):
+    request = Request(
+        DOCKET_REPORT_URL + 'N22C-01-001', callback=spider._callback, errback=spider._errback, priority=5,
+        meta={'rule': 0, 'dont_merge_cookies': True, 'link_text': 'N22C-01-001', 'depth': 2, 'retry_times': 1},
+    )
+
+    loaded = round_trip(request, spider)
+
+    assert loaded.url == request.url
+    assert loaded.callback == spider._callback and loaded.errback == spider._errback
+    assert loaded.priority == 5
+    assert loaded.meta == request.meta
+    assert len(request_serializer.dumps(request.to_dict(spider=spider))) < 100
+
+
+def test_listing_request_round_trip(spider):
+    request = Request(
+        LISTING_URL + 'last_name=SMITH&PageNo=3', callback=spider._callback, errback=spider._errback, priority=-1,
+        meta={'rule': 1, 'dont_merge_cookies': True, 'listing': {'item_id': 'N22C-01-001', 'hash': 'abc'}},
+        dont_filter=True,
+    )
+
+    loaded = round_trip(request, spider)
+
+    assert loaded.callback == spider._callback
+    assert loaded.priority == -1
+    assert loaded.dont_filter
+    assert loaded.meta == request.meta
+
+
+def test_docket_request_of_another_shape_keeps_its_meta(spider):
+    request = Request(DOCKET_REPORT_URL + 'N22C-01-001', callback=spider.parse_item, meta={'depth': 1})
+
+    loaded = round_trip(request, spider)
+
+    assert loaded.callback == spider.parse_item
+    assert loaded.meta == {'depth': 1}
+
+
+def test_other_requests_are_stored_whole(spider):
+    request = Request(
+        'https://example.com/search', method='POST', body=b'last_name=A', callback=spider.parse,
+        cb_kwargs={'page': 2}, headers={'X-Test': '1'}, priority=3,
+    )
+
+    loaded = round_trip(request, spider)
+
+    assert loaded.callback == spider.parse
+    assert loaded.cb_kwargs == {'page': 2}
+    assert (loaded.method, loaded.body, loaded.priority) == ('POST', b'last_name=A', 3)
+
+
+def test_requests_queued_with_picklecompat_are_loaded(spider):
+    request = Request(
+        DOCKET_REPORT_URL + 'N22C-01-001', callback=spider._callback, errback=spider._errback, priority=5,
+        meta={'rule': 0, 'dont_merge_cookies': True, 'link_text': 'N22C-01-001'},
+    )
+    request_dict = request.to_dict(spider=spider)
+
+    assert request_serializer.loads(picklecompat.dumps(request_dict)) == request_dict
+
+
+def test_unknown_payload_is_an_error():
+    with pytest.raises(ValueError):
+        request_serializer.loads(pickle.dumps(('x', 'N22C-01-001', 0, {})))
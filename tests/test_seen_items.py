@@ -0,0 +1,80 @@
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from docket_scraper import signals
+from docket_scraper.bloomfilter import RedisBloomFilter
+from docket_scraper.items import DocketPartItem
+from docket_scraper.seen_items import BloomSeenItems, RedisSeenItems
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+ITEM_URL = 'https://courtconnect.courts.delaware.gov/cc/cconnect/ck_public_qry_doct.cp_dktrpt_docket_report?case_id='
+
+
+def seen_items_of_crawlers(server, seen_items_cls, crawlers=2):
+    if seen_items_cls is RedisSeenItems:
+        return [RedisSeenItems(server, 'spider:1:seen_items') for _ in range(crawlers)]
+    return [
+        BloomSeenItems(RedisBloomFilter(server, 'spider:1:seen_items', capacity=1000, error_rate=0.001))
+        for _ in range(crawlers)
+    ]
+
+
+def test_add_and_contains(server):
+    for seen_items_cls in (RedisSeenItems, BloomSeenItems):
+        server.flushall()
+        seen_items, = seen_items_of_crawlers(server, seen_items_cls, crawlers=1)
+
+        assert 'N22C-01-001' not in seen_items
+        assert seen_items.add('N22C-01-001')
+        assert 'N22C-01-001' in seen_items
+        assert not seen_items.add('N22C-01-001')
+        assert 'N22C-01-002' not in seen_items
+
+
+def test_crawlers_share_their_seen_items(server):
+    for seen_items_cls in (RedisSeenItems, BloomSeenItems):
+        server.flushall()
+        first, second = seen_items_of_crawlers(server, seen_items_cls)
+
+        new = [crawler_seen.add(f'case-{number}') for number in range(100) for crawler_seen in (first, second)]
+        # every id is new to exactly one of the crawlers adding it
+        assert new == [True, False] * 100
+        assert all(f'case-{number}' in first and f'case-{number}' in second for number in range(100))
+
+        first.clear()
+        assert 'case-1' not in second
+
+
+def crawl_spider(server):
+    crawler = get_crawler(CourtConnectCrawlSpider)
+    spider = CourtConnectCrawlSpider(crawling_job_id='1')
+    spider.crawler = crawler
+    spider.incremental = False
+    spider.parse_pool = None
+    spider.seen_items = RedisSeenItems(server, 'court-connect-crawl:1:seen_items')
+    crawler.signals.connect(spider.item_stored, signal=signals.item_stored)
+    return spider
+
+
+def test_item_is_seen_once_stored_not_once_requested(server, docket_response):
+    spider = crawl_spider(server)
+    request = Request(ITEM_URL + 'N22C-01-001')
+
+    assert spider.process_item_request(request, docket_response) is not None
+    # the first request failed or its docket was never written, the case is requested again
+    assert spider.process_item_request(request, docket_response) is not None
+
+    docket = spider.parse_spider.parse(docket_response)
+    spider.crawler.signals.send_catch_log(signals.item_stored, item=docket, spider=spider)
+    assert docket.id in spider.seen_items
+    assert spider.process_item_request(Request(ITEM_URL + docket.id), docket_response) is None
+    assert spider.crawler.stats.get_value('seen_items/dropped') == 1
+
+
+def test_parts_of_split_dockets_are_not_seen_items(server):
+    spider = crawl_spider(server)
+    part = DocketPartItem(docket_id='N22C-01-001', kind='parties', index=0, part=None)
+
+    spider.crawler.signals.send_catch_log(signals.item_stored, item=part, spider=spider)
+
+    assert not server.exists('court-connect-crawl:1:seen_items')
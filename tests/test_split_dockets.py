@@ -0,0 +1,39 @@
+from scrapy.utils.test import get_crawler
+
+from docket_scraper.items import DocketItem, DocketPartItem
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+
+def split_spider():
+    crawler = get_crawler(CourtConnectCrawlSpider, {'SPLIT_DOCKETS': True})
+    spider = CourtConnectCrawlSpider(crawling_job_id='1')
+    spider.crawler = crawler
+    spider.split_items = True
+    return spider
+
+
+def test_streamed_docket_keeps_its_counts(docket_response):
+    spider = split_spider()
+    items = list(spider.parse_item(docket_response))
+
+    parts = [item for item in items if isinstance(item, DocketPartItem)]
+    dockets = [item for item in items if isinstance(item, DocketItem)]
+    assert len(dockets) == 1
+    docket = dockets[0]
+    assert (docket.parties, docket.entries) == ([], [])
+    assert docket.parties_count == sum(part.kind == 'parties' for part in parts) > 0
+    assert docket.entries_count == sum(part.kind == 'entries' for part in parts) > 0
+    assert len(items) == docket.parties_count + docket.entries_count + 1
+
+
+def test_docket_parsed_whole_is_split_once(docket_response):
+    spider = split_spider()
+    whole = spider.parse_spider.parse(docket_response)
+    parties_count, entries_count = len(whole.parties), len(whole.entries)
+
+    items = spider.item_parsed(whole, 0, docket_response)
+
+    assert len(items) == parties_count + entries_count + 1
+    docket = items[-1]
+    assert (docket.parties_count, docket.entries_count) == (parties_count, entries_count)
+    assert spider.item_parsed(docket, 0, docket_response) is docket
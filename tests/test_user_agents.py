@@ -0,0 +1,35 @@
+import json
+import logging
+
+from scrapy.utils.test import get_crawler
+
+from docket_scraper.middlewares import RandomUserAgentMiddleware, load_user_agent_pool
+from docket_scraper.spiders.court_connect import CourtConnectCrawlSpider
+
+IDENTITY_HANDLER = 'docket_scraper.downloadhandlers.IdentityHTTP11DownloadHandler'
+FILTERS = {
+    'software_names': RandomUserAgentMiddleware.useragent_browsers,
+    'hardware_types': RandomUserAgentMiddleware.useragent_hardware,
+    'popularity': RandomUserAgentMiddleware.useragent_popularity,
+    'limit': 5,
+}
+
+
+def test_identity_handler_is_installed_only_with_identities():
+    handlers = get_crawler(CourtConnectCrawlSpider).settings.getdict('DOWNLOAD_HANDLERS')
+    assert IDENTITY_HANDLER not in handlers.values()
+
+    handlers = get_crawler(CourtConnectCrawlSpider, {'USER_AGENT_IDENTITIES': 4}).settings.getdict('DOWNLOAD_HANDLERS')
+    assert handlers == {'http': IDENTITY_HANDLER, 'https': IDENTITY_HANDLER}
+
+
+def test_user_agent_pool_is_cached_under_its_path(tmp_path):
+    spider = CourtConnectCrawlSpider(crawling_job_id='1')
+    spider.logger.setLevel(logging.ERROR)
+    path = tmp_path / 'cache' / 'user_agents.json'
+
+    user_agents = load_user_agent_pool(str(path), FILTERS, spider)
+    assert json.loads(path.read_text()) == {'filters': FILTERS, 'user_agents': user_agents}
+
+    path.write_text(json.dumps({'filters': FILTERS, 'user_agents': ['cached']}))
+    assert load_user_agent_pool(str(path), FILTERS, spider) == ['cached']